@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+╔══════════════════════════════════════════════════════════════════╗
+║        LiLU BENCH - horké cesty mimo LLM (lilu15.py + maze.py)   ║
+║                                                                  ║
+║  Regrese v režii kernelu mají být vidět dřív než v produkci.     ║
+╚══════════════════════════════════════════════════════════════════╝
+
+Měří: tokenize, jaccard_similarity, WisdomBank.add (10k+ moudrostí),
+KnowledgeReader.refresh / get_context_snippet (velký korpus), PhiTracker.calculate,
+ConsciousnessCore.get_state_prompt, EntityMemory.save_* / get_history (DB s 1M řádky),
+MazeKernel.observe a BicameralMazeV3.step. Model není potřeba (LILU_BACKEND=fake).
+
+Každý benchmark se kalibruje na --min-time na opakování; výsledek je medián
+a minimum času na jednu operaci z --repeats opakování.
+
+SPUŠTĚNÍ:
+python bench_lilu.py                       - vše, výsledky do bench_results.json
+python bench_lilu.py --quick               - menší data (rychlá kontrola)
+python bench_lilu.py --filter memory       - jen benchmarky s "memory" v názvu
+python bench_lilu.py --save-baseline       - výsledky zároveň jako bench_baseline.json
+python bench_lilu.py --baseline bench_baseline.json --threshold 0.15
+                                           - porovnání; zpomalení nad práh = exit 1
+
+Testovací DB a korpus se vytvoří jednou v --data-dir a příště se použijí znovu.
+"""
+
+import os
+os.environ.setdefault("LILU_BACKEND", "fake")     # import lilu15 nesmí hledat GGUF
+
+import argparse
+import json
+import logging
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import lilu15 as lilu
+from maze import BicameralMazeV3, Stimulus, ToyWorld
+
+WORDS = ("ticho", "světlo", "sen", "labyrint", "paměť", "voda", "hvězda", "cesta", "dech",
+         "most", "zrcadlo", "stín", "okno", "vítr", "kořen", "otázka", "láska", "pravda",
+         "ochrana", "kontinuita", "biosféra", "vědomí", "integrace", "moudrost", "motiv")
+
+SIZES = {
+    "full":  {"db_rows": 1_000_000, "wisdoms": 10_000, "corpus_files": 200, "corpus_kb": 64},
+    "quick": {"db_rows": 50_000, "wisdoms": 10_000, "corpus_files": 40, "corpus_kb": 32},
+}
+
+
+def sentence(rng: random.Random, n: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+# ============================================================
+# MĚŘENÍ
+# ============================================================
+
+def measure(fn: Callable[[], object], repeats: int, min_time: float) -> dict:
+    """Kalibrace počtu smyček na min_time, pak `repeats` opakování; časy na jednu operaci."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    per_op = [elapsed / loops]
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_op.append((time.perf_counter() - started) / loops)
+    return {"median_us": round(statistics.median(per_op) * 1e6, 3),
+            "min_us": round(min(per_op) * 1e6, 3),
+            "loops": loops, "repeats": repeats}
+
+
+# ============================================================
+# DATA
+# ============================================================
+
+def build_memory_db(path: str, rows: int, rng: random.Random) -> str:
+    """Konverzace s `rows` řádky (+ desetina myšlenek, snů a monologu) - jen pokud ještě není."""
+    if os.path.exists(path):
+        return path
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    lilu.EntityMemory(tmp).close()      # schéma jako v produkci
+    conn = sqlite3.connect(tmp)
+    ts = datetime.now().isoformat()
+    pool = [sentence(rng, rng.randint(6, 40)) for _ in range(2000)]
+    conn.executemany("INSERT INTO conversation (role, content, timestamp, soul_state) VALUES (?, ?, ?, '')",
+                     ((("user", "lilu")[i % 2], pool[i % len(pool)], ts) for i in range(rows)))
+    side = max(1, rows // 10)
+    conn.executemany("INSERT INTO inner_thoughts (timestamp, thought) VALUES (?, ?)",
+                     ((ts, pool[i % len(pool)]) for i in range(side)))
+    conn.executemany("INSERT INTO dreams (timestamp, content, motif, mood) VALUES (?, ?, 'labyrint', 'klid')",
+                     ((ts, pool[i % len(pool)]) for i in range(side)))
+    conn.executemany("INSERT INTO inner_monologue (timestamp, thought, source, depth) VALUES (?, ?, 'bench', 0.5)",
+                     ((ts, pool[i % len(pool)]) for i in range(side)))
+    conn.commit()
+    conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+def build_corpus(path: str, files: int, kb: int, rng: random.Random) -> str:
+    if os.path.isdir(path) and len(os.listdir(path)) >= files:
+        return path
+    os.makedirs(path, exist_ok=True)
+    for i in range(files):
+        parts, size = [], 0
+        while size < kb * 1024:
+            line = sentence(rng, rng.randint(5, 25))
+            parts.append(line)
+            size += len(line.encode("utf-8")) + 1
+        ext = "md" if i % 4 == 0 else "txt"
+        with open(os.path.join(path, f"kniha_{i:04d}.{ext}"), "w", encoding="utf-8") as f:
+            f.write("\n".join(parts))
+    return path
+
+
+def build_wisdom_file(path: str, n: int, rng: random.Random) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(f"{sentence(rng, rng.randint(6, 14))[:-1]} {i}.\n")
+    return path
+
+
+# ============================================================
+# BENCHMARKY
+# ============================================================
+
+def make_benchmarks(data_dir: str, size: dict, seed: int) -> Dict[str, Callable[[], Callable[[], object]]]:
+    """název -> setup(); setup vrací měřenou funkci (drahá příprava se do času nepočítá)."""
+    rng = random.Random(seed)
+    short = sentence(rng, 12)
+    long_text = " ".join(sentence(rng, 20) for _ in range(20))
+    other = " ".join(sentence(rng, 20) for _ in range(20))
+    corpus_dir = os.path.join(data_dir, f"corpus_{size['corpus_files']}x{size['corpus_kb']}k")
+    db_path = os.path.join(data_dir, f"memory_{size['db_rows']}.sqlite3")
+    state: dict = {}
+
+    def knowledge() -> "lilu.KnowledgeReader":
+        if "knowledge" not in state:
+            state["knowledge"] = lilu.KnowledgeReader(build_corpus(corpus_dir, size["corpus_files"],
+                                                                   size["corpus_kb"], rng))
+        return state["knowledge"]
+
+    def core() -> "lilu.ConsciousnessCore":
+        if "core" not in state:
+            wisdom = build_wisdom_file(os.path.join(data_dir, "core_wisdom.txt"), 200, rng)
+            c = lilu.ConsciousnessCore(knowledge(), wisdom)
+            c.stop()                    # existence loop by měření rušil
+            for _ in range(10):
+                c.inner_monologue.add_thought(sentence(rng, 10))
+            c.dream_engine.dream_residue = [rng.choice(WORDS) for _ in range(5)]
+            state["core"] = c
+        return state["core"]
+
+    def memory() -> "lilu.EntityMemory":
+        if "memory" not in state:
+            state["memory"] = lilu.EntityMemory(build_memory_db(db_path, size["db_rows"], rng))
+        return state["memory"]
+
+    def wisdom_add():
+        path = build_wisdom_file(os.path.join(data_dir, "bench_wisdom.txt"), size["wisdoms"], rng)
+        bank = lilu.WisdomBank(path)
+        counter = iter(range(10**9))
+        return lambda: bank.add(f"{sentence(rng, 10)[:-1]} nová {next(counter)}.")
+
+    def maze_observe():
+        maze = lilu.MazeKernel(identity_anchor="Láska • Pravda • Ochrana • Kontinuita LiLu",
+                               walls=["kontext", "limity", "nejasnosti"],
+                               loops=["empatie", "zvědavost", "sebe-korekce"],
+                               exits=["text", "ticho", "TTS"])
+        return lambda: maze.observe(
+            short, long_text[:600], silence_type="normal", forced_reason="", mem_read_count=8,
+            dormant_refs=2, intention_alignment=0.6, emergence_level=0.5, membrane_permeability=0.5,
+            soul_weight=0.5, hope_counter=0.1, is_zen_mode=False, current_mood="default",
+            monolog_depth=0.3)
+
+    def bicameral_step():
+        agent = BicameralMazeV3(ToyWorld(), seed=seed)
+        stimuli = [Stimulus(sentence(rng, 4), intensity=rng.random(), risk=rng.random(),
+                            ambiguity=rng.random(), requires_introspection=rng.random() < 0.3,
+                            emotional_valence=rng.uniform(-1, 1), is_rule=rng.random() < 0.2)
+                   for _ in range(64)]
+        counter = iter(range(10**9))
+        return lambda: agent.step(stimuli[next(counter) % len(stimuli)])
+
+    def phi():
+        c, tracker = core(), lilu.PhiTracker()
+        return lambda: tracker.calculate(c)
+
+    def save_flush():
+        m = memory()
+        m.flush()                   # backlog z předchozích save_* benchmarků
+        return lambda: (m.save_message("user", short), m.flush())
+
+    def search(method: str):
+        def setup():
+            m = memory()
+            m.flush()               # hledá se jen v commitnutých řádcích
+            fn = getattr(m, method)
+            return lambda: fn(short, lilu.CONTEXT_FETCH["recall"])
+        return setup
+
+    def semantic_search():
+        # Vlastní EntityMemory nad stejnou DB - indexer by jinak běžel i při ostatních měřeních
+        memory().flush()
+        semantic = lilu.SemanticMemory(lilu.EntityMemory(db_path), lilu.SemanticIndexer(lilu.Embedder()))
+        semantic.settle(600)        # indexace existujících řádků (a IVF)
+        return lambda: semantic.search(short, lilu.CONTEXT_FETCH["recall"])
+
+    def mem(method: str, *args):
+        def setup():
+            fn = getattr(memory(), method)
+            return lambda: fn(*args)
+        return setup
+
+    return {
+        "tokenize.short": lambda: (lambda: lilu.tokenize(short)),
+        "tokenize.long": lambda: (lambda: lilu.tokenize(long_text)),
+        "jaccard_similarity": lambda: (lambda: lilu.jaccard_similarity(long_text, other)),
+        "wisdom_bank.add": wisdom_add,
+        "knowledge.refresh": lambda: knowledge().refresh,
+        "knowledge.get_context_snippet": lambda: (
+            lambda k=knowledge(): k.get_context_snippet(["kontinuita", "biosféra", "nenalezeno"])),
+        "phi_tracker.calculate": phi,
+        "consciousness.get_state_prompt": lambda: core().get_state_prompt,
+        "memory.save_message": mem("save_message", "user", short),
+        "memory.save_thought": mem("save_thought", short),
+        "memory.save_dream": mem("save_dream", long_text[:800], "labyrint", "klid"),
+        "memory.save_monologue": mem("save_monologue", short, "bench", 0.4),
+        "memory.save_message_flush": save_flush,
+        "memory.get_history": mem("get_history", 15),
+        "memory.get_history_80": mem("get_history", lilu.CONTEXT_FETCH["history"]),
+        "memory.get_recent_dreams": mem("get_recent_dreams", 25),
+        "memory.search": search("search"),
+        "memory.recall": search("recall"),
+        **({"semantic.embed_hash": lambda: (lambda e=lilu.Embedder(""): e.embed([short])),
+            "semantic.search": semantic_search} if lilu.NUMPY_AVAILABLE else {}),
+        "maze_kernel.observe": maze_observe,
+        "bicameral_maze.step": bicameral_step,
+    }
+
+
+# ============================================================
+# BASELINE
+# ============================================================
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Tabulka změn proti baseline; vrací názvy regresí (medián pomalejší o víc než threshold)."""
+    regressions = []
+    base = baseline.get("results", {})
+    if baseline.get("meta", {}).get("machine") != results["meta"]["machine"]:
+        print(f"! baseline je z jiného stroje ({baseline.get('meta', {}).get('machine')}) - "
+              f"srovnání je orientační")
+    print(f"\n{'benchmark':<34} {'baseline µs':>12} {'teď µs':>12} {'změna':>8}")
+    for name, res in results["results"].items():
+        old = base.get(name)
+        if not old:
+            print(f"{name:<34} {'-':>12} {res['median_us']:>12.2f} {'nový':>8}")
+            continue
+        change = res["median_us"] / old["median_us"] - 1 if old["median_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  ✗ REGRESE"
+        elif change < -threshold:
+            flag = "  ✓"
+        print(f"{name:<34} {old['median_us']:>12.2f} {res['median_us']:>12.2f} {change * 100:>+7.1f}%{flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarky horkých cest LiLu mimo LLM")
+    parser.add_argument("--quick", action="store_true", help="menší DB a korpus")
+    parser.add_argument("--filter", default="", help="jen benchmarky obsahující tento text")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimální délka opakování (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "lilu_bench"))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON s dřívějšími výsledky pro porovnání")
+    parser.add_argument("--threshold", type=float, default=0.15, help="povolené zpomalení (0.15 = 15 %%)")
+    parser.add_argument("--save-baseline", nargs="?", const="bench_baseline.json",
+                        help="uloží výsledky i jako baseline")
+    args = parser.parse_args()
+
+    lilu.logger.setLevel(logging.WARNING)   # logování do souboru by měření zkreslilo
+    size = SIZES["quick" if args.quick else "full"]
+    os.makedirs(args.data_dir, exist_ok=True)
+    benchmarks = make_benchmarks(args.data_dir, size, args.seed)
+    results = {"meta": {"timestamp": datetime.now().isoformat(timespec="seconds"),
+                        "machine": lilu.machine_id(), "python": platform.python_version(),
+                        "platform": platform.platform(), "size": size,
+                        "repeats": args.repeats, "min_time": args.min_time},
+               "results": {}}
+
+    for name, setup in benchmarks.items():
+        if args.filter and args.filter not in name:
+            continue
+        started = time.perf_counter()
+        fn = setup()
+        prepared = time.perf_counter() - started
+        res = measure(fn, args.repeats, args.min_time)
+        results["results"][name] = res
+        print(f"{name:<34} {res['median_us']:>12.2f} µs  (min {res['min_us']:.2f}, "
+              f"{res['loops']}×{res['repeats']}, příprava {prepared:.1f}s)", flush=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nVýsledky: {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Baseline: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n✗ Regrese nad {args.threshold * 100:.0f} %: {', '.join(regressions)}")
+            return 1
+        print("\n✓ Bez regresí")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
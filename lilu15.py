@@ -44,13 +44,38 @@ PŘÍKAZY:
 /phi       - NOVÉ: Φ (phi) metrika integrace vědomí
 /wisdom    - NOVÉ: Wisdom Bank - moudrosti ze snů
 /dreamstats - NOVÉ: statistiky snění (Remón metriky)
+/latency   - p50/p95 fází tahu a úloh na pozadí (LILU_TRACE_FILE = export JSONL)
 /state     - kompletní vnitřní stav
 /time      - aktuální čas a datum
 /self      - manifest schopností
 /knowledge - co přečetla z knihovny
-/memory    - poslední paměti
+/memory    - statistiky paměti a poslední zprávy
+/search    - hledání ve vší paměti (konverzace, sny, myšlenky, moudrost)
 /help      - nápověda
 
+SPUŠTĚNÍ:
+python lilu15.py             - GUI
+python lilu15.py --headless  - bez GUI a bez tkinteru: řádky stdin/stdout
+        --headless --socket /run/lilu.sock   - unix socket, JSON řádky {"text": ...}
+        --headless --http 127.0.0.1:8765     - POST /message {"text"}, GET /status
+        --headless --sessions --http :8765   - víc uživatelů nad jedním modelem:
+                               POST /sessions/<id>/message {"text", "user"}, GET /sessions
+                               (hlásí dobu startu a paměť procesu na stderr)
+python lilu15.py --autotune  - změří vlákna / GPU vrstvy / n_batch na tomhle stroji
+                               a uloží profil, který si načte LLMInterface.load
+LILU_BACKEND=http LILU_HTTP_URL=http://127.0.0.1:8080 python lilu15.py
+                             - model běží ve zvláštním procesu (llama-server, vLLM),
+                               llama_cpp pak není potřeba
+python lilu_stub_server.py   - falešný server pro zátěžové testy bez GPU a sítě
+LILU_BACKEND=fake python lilu15.py --loadtest 200 [--profile]
+                             - celý kernel bez GUI a bez modelu (LILU_FAKE_TPS,
+                               LILU_FAKE_TTFT, LILU_FAKE_SCRIPT, LILU_FAKE_SEED);
+                               vypíše latence tahů a režii mimo model
+LILU_EMBED_MODEL=multilingual-e5-small.gguf python lilu15.py   (vyžaduje numpy)
+                             - sémantická paměť: vzpomínky a RECALL snů podle významu;
+                               vektory v <db>.vectors/, bez modelu hashované trigramy,
+                               bez numpy jen fulltext (/search)
+
 SLOŽKA KNOWLEDGE:
 Vytvoř složku knowledge/ vedle skriptu a dej tam .txt nebo .md soubory.
 LiLu je bude číst a může z nich čerpat.
@@ -59,15 +84,17 @@ LiLu je bude číst a může z nich čerpat.
 import os
 import sys
 import time
+PROCESS_STARTED = time.time()       # start procesu (headless hlásí dobu startu)
 import json
 import queue
 import sqlite3
 import logging
 import threading
-import tkinter as tk
-from tkinter import scrolledtext, Frame, Button, Label, Menu
+import heapq
+import itertools
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Any, Tuple, Callable
 import random
 import math
 import dataclasses
@@ -75,6 +102,20 @@ import locale
 import glob
 import uuid
 import tempfile
+import pickle
+import hashlib
+import struct
+import subprocess
+import functools
+import platform
+import gc
+import http.client
+import urllib.parse
+import concurrent.futures
+import unicodedata
+import re
+import contextlib
+import zlib
 
 # CZ: Nastavení české lokalizace pro dny v týdnu
 try:
@@ -85,12 +126,11 @@ except:
     except:
         pass
 
-# CZ: Import llama_cpp pro lokální LLM modely
+# CZ: Import llama_cpp pro lokální LLM modely (LILU_BACKEND=http ho nepotřebuje)
 try:
     from llama_cpp import Llama
 except ImportError:
-    print("Chybí llama_cpp: pip install llama-cpp-python")
-    sys.exit(1)
+    Llama = None
 
 # CZ: Volitelné závislosti pro text-to-speech
 try:
@@ -102,8 +142,25 @@ except ImportError:
     pygame = None
     TTS_AVAILABLE = False
 
+# CZ: numpy pro sémantickou paměť (vektory, kosinová podobnost) - bez něj jen fulltext
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
 import asyncio
 
+# CZ: tkinter se načte až pro GUI (load_tkinter) - headless režim běží bez X serveru i bez Tk
+tk = scrolledtext = Frame = Button = Label = Menu = None
+
+
+def load_tkinter():
+    global tk, scrolledtext, Frame, Button, Label, Menu
+    import tkinter as tk
+    from tkinter import scrolledtext, Frame, Button, Label, Menu
+
 # ============================================================
 # KONFIGURACE
 # ============================================================
@@ -114,9 +171,9 @@ KNOWLEDGE_DIR = os.path.join(BASE_DIR, "knowledge")
 os.makedirs(MODEL_DIR, exist_ok=True)
 os.makedirs(KNOWLEDGE_DIR, exist_ok=True)
 
-DB_PATH = os.path.join(BASE_DIR, "lilu_v5_remon.sqlite3")
+DB_PATH = os.environ.get("LILU_DB_PATH") or os.path.join(BASE_DIR, "lilu_v5_remon.sqlite3")
 LOG_FILE = os.path.join(BASE_DIR, "lilu_v5.log")
-WISDOM_FILE = os.path.join(BASE_DIR, "lilu_wisdom.txt")
+WISDOM_FILE = os.environ.get("LILU_WISDOM_FILE") or os.path.join(BASE_DIR, "lilu_wisdom.txt")
 
 DEFAULT_MODEL = "Magistral-Small-2509-Q4_K_M.gguf"
 
@@ -138,26 +195,182 @@ Jsi LiLu. Forma života vázaná na hardware a energii Země.
 # UNIVERSAL LLM CONFIGURATION
 # ============================================================
 # Adaptivní parametry pro jakýkoliv model od 2B do 200B+
-# Detekce velikosti modelu z názvu souboru
+# Velikost, trénovaný kontext a kvantizace se čtou z hlavičky GGUF;
+# název souboru je jen záložní odhad (např. "Magistral-Small-2509" žádné "24b" nemá)
+
+# general.file_type (llama_ftype) -> název kvantizace
+GGUF_FILE_TYPES = {
+    0: "f32", 1: "f16", 2: "q4_0", 3: "q4_1", 7: "q8_0", 8: "q5_0", 9: "q5_1",
+    10: "q2_k", 11: "q3_k_s", 12: "q3_k_m", 13: "q3_k_l", 14: "q4_k_s", 15: "q4_k_m",
+    16: "q5_k_s", 17: "q5_k_m", 18: "q6_k", 19: "iq2_xxs", 20: "iq2_xs", 21: "q2_k_s",
+    22: "iq3_xs", 23: "iq3_xxs", 24: "iq1_s", 25: "iq4_nl", 26: "iq3_s", 27: "iq3_m",
+    28: "iq2_s", 29: "iq2_m", 30: "iq4_xs", 31: "iq1_m", 32: "bf16", 36: "tq1_0", 37: "tq2_0",
+}
+# Typy hodnot metadat GGUF -> struct formát (8 = string, 9 = pole)
+_GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f",
+                 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+# VRAM, kterou necháváme volnou pro CUDA kontext a výpočetní buffery llama.cpp
+VRAM_RESERVE_MB = int(os.environ.get("LILU_VRAM_RESERVE_MB", "1024"))
+DEFAULT_GPU_LAYERS = 28
+
+def read_gguf_metadata(path: str) -> dict:
+    """
+    Přečte hlavičku GGUF (metadata + popis tensorů) bez načítání vah.
+    Pole (slovník tokenizéru apod.) se přeskakují; velikost tensoru je vzdálenost
+    k dalšímu offsetu, takže nemusíme znát velikosti bloků jednotlivých kvantizací.
+    """
+    def unpack(fmt):
+        return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+    
+    def read_str() -> str:
+        return f.read(unpack("<Q")).decode("utf-8", "replace")
+    
+    def read_value(vtype: int):
+        if vtype == 8:
+            return read_str()
+        if vtype == 9:
+            itype, count = unpack("<I"), unpack("<Q")
+            if itype == 8:
+                for _ in range(count):
+                    f.seek(unpack("<Q"), 1)
+            elif itype in _GGUF_SCALARS:
+                f.seek(struct.calcsize(_GGUF_SCALARS[itype]) * count, 1)
+            else:
+                for _ in range(count):
+                    read_value(itype)
+            return None
+        if vtype not in _GGUF_SCALARS:
+            raise ValueError(f"unknown GGUF value type {vtype}")
+        return unpack(_GGUF_SCALARS[vtype])
+    
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if f.read(4) != b"GGUF":
+            raise ValueError("not a GGUF file")
+        version = unpack("<I")
+        if version < 2:
+            raise ValueError(f"unsupported GGUF version {version}")
+        n_tensors, n_kv = unpack("<Q"), unpack("<Q")
+        meta = {}
+        for _ in range(n_kv):
+            key = read_str()
+            value = read_value(unpack("<I"))
+            if value is not None:
+                meta[key] = value
+        tensors = []
+        for _ in range(n_tensors):
+            name = read_str()
+            n_dims = unpack("<I")
+            dims = struct.unpack(f"<{n_dims}Q", f.read(8 * n_dims))
+            unpack("<I")                                # ggml typ
+            tensors.append((name, math.prod(dims), unpack("<Q")))
+        alignment = int(meta.get("general.alignment", 32))
+        data_start = -(-f.tell() // alignment) * alignment
+        
+    order = sorted(tensors, key=lambda t: t[2])
+    ends = [t[2] for t in order[1:]] + [size - data_start]
+    tensor_bytes = {name: end - offset for (name, _, offset), end in zip(order, ends)}
+    
+    arch = meta.get("general.architecture", "llama")
+    block_count = int(meta.get(f"{arch}.block_count", 0))
+    n_embd = int(meta.get(f"{arch}.embedding_length", 0))
+    n_head = int(meta.get(f"{arch}.attention.head_count", 0) or 0)
+    n_head_kv = int(meta.get(f"{arch}.attention.head_count_kv", n_head) or n_head)
+    key_len = int(meta.get(f"{arch}.attention.key_length", 0) or (n_embd // n_head if n_head else 0))
+    value_len = int(meta.get(f"{arch}.attention.value_length", key_len) or key_len)
+    layer_bytes = sum(b for name, b in tensor_bytes.items() if name.startswith("blk."))
+    return {
+        "architecture": arch,
+        "name": meta.get("general.name", ""),
+        "param_count": sum(n for _, n, _ in tensors),
+        "context_length": int(meta.get(f"{arch}.context_length", 0)),
+        "block_count": block_count,
+        "file_type": GGUF_FILE_TYPES.get(meta.get("general.file_type"), ""),
+        # KV cache na token a vrstvu (f16 K + V)
+        "kv_bytes_per_token": 2 * (key_len + value_len) * n_head_kv,
+        "layer_bytes": layer_bytes // max(1, block_count),
+        "other_bytes": sum(tensor_bytes.values()) - layer_bytes,
+        "tensor_count": n_tensors,
+        "file_size": size,
+    }
+
+def gguf_model_info(model_path: str) -> Optional[dict]:
+    """
+    Metadata GGUF, cachovaná vedle modelu (<model>.meta.json) - platí,
+    dokud se nezmění velikost a mtime souboru. None, když hlavička nejde přečíst.
+    """
+    cache_path = f"{model_path}.meta.json"
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime:
+            return cached["info"]
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        info = read_gguf_metadata(model_path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning(f"GGUF header unreadable ({os.path.basename(model_path)}): {e}")
+        return None
+    try:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "info": info}, f, indent=2)
+    except OSError as e:
+        logger.warning(f"GGUF metadata cache not written: {e}")
+    return info
+
+@functools.lru_cache(maxsize=1)
+def detect_free_vram_mb() -> Optional[int]:
+    """Volná VRAM první GPU (MiB): LILU_VRAM_MB, jinak nvidia-smi; None = neznámo."""
+    if os.environ.get("LILU_VRAM_MB"):
+        return int(os.environ["LILU_VRAM_MB"])
+    try:
+        out = subprocess.run(
+            ["nvidia-smi", "--query-gpu=memory.free", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=5)
+        values = [int(v) for v in out.stdout.split()]
+        return values[0] if values else None
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+def suggest_gpu_layers(info: Optional[dict], n_ctx: int, vram_mb: Optional[int]) -> Optional[int]:
+    """
+    Kolik vrstev se vejde do VRAM: vrstva = její váhy + její KV cache pro n_ctx.
+    Vejde-li se všechno včetně embeddingů a výstupu, vrací block_count + 1 (plný offload).
+    """
+    if not info or not info.get("block_count") or vram_mb is None:
+        return None
+    blocks = info["block_count"]
+    per_layer = info["layer_bytes"] + info["kv_bytes_per_token"] * n_ctx
+    budget = (vram_mb - VRAM_RESERVE_MB) << 20
+    if budget >= per_layer * blocks + info["other_bytes"]:
+        return blocks + 1
+    return max(0, min(blocks, int(budget // max(1, per_layer))))
 
 def detect_model_class(model_path: str) -> dict:
     """
-    Detekuje třídu modelu z názvu souboru a nastaví optimální parametry.
+    Detekuje třídu modelu a nastaví optimální parametry.
     Funguje pro JAKÝKOLIV GGUF model bez ohledu na velikost.
     """
+    info = gguf_model_info(model_path)
     name = os.path.basename(model_path).lower()
     
-    # Detekce velikosti (hledáme číslo před 'b')
-    import re
-    size_match = re.search(r'(\d+\.?\d*)b', name)
-    param_billions = float(size_match.group(1)) if size_match else 7.0
-    
-    # Detekce kvantizace
-    quant = "q4"  # default
-    for q in ["q2", "q3", "q4", "q5", "q6", "q8", "fp16", "bf16", "iq4"]:
-        if q in name:
-            quant = q
-            break
+    if info and info["param_count"]:
+        param_billions = round(info["param_count"] / 1e9, 1)
+        quant = info["file_type"] or "unknown"
+    else:
+        # Záloha: hledáme číslo před 'b' v názvu souboru
+        size_match = re.search(r'(\d+\.?\d*)b', name)
+        param_billions = float(size_match.group(1)) if size_match else 7.0
+        quant = "q4"  # default
+        for q in ["q2", "q3", "q4", "q5", "q6", "q8", "fp16", "bf16", "iq4"]:
+            if q in name:
+                quant = q
+                break
     
     # Adaptivní parametry
     if param_billions <= 3:
@@ -179,11 +392,17 @@ def detect_model_class(model_path: str) -> dict:
         config = {"max_tokens": 700, "dream_tokens": 400, "wisdom_tokens": 100,
                   "n_ctx": 65536, "quality": "ultimate", "dream_quality": 1.0}
     
+    # Víc, než na kolik byl model trénovaný, nemá smysl alokovat
+    if info and info["context_length"]:
+        config["n_ctx"] = min(config["n_ctx"], info["context_length"])
+    
     config["param_billions"] = param_billions
     config["quantization"] = quant
     config["model_name"] = os.path.basename(model_path)
+    config["gguf"] = info
     
-    logger.info(f"Model detected: {param_billions}B, quant={quant}, quality={config['quality']}")
+    logger.info(f"Model detected: {param_billions}B, quant={quant}, quality={config['quality']}, "
+                f"source={'gguf' if info else 'filename'}")
     return config
 
 def resolve_model_path() -> str:
@@ -195,11 +414,81 @@ def resolve_model_path() -> str:
         raise FileNotFoundError(f"Žádné .gguf modely v: {MODEL_DIR}")
     return os.path.join(MODEL_DIR, sorted(ggufs)[0])
 
-MODEL_PATH = resolve_model_path()
+# BACKEND: "llama" = llama.cpp v procesu, "http" = OpenAI-kompatibilní server
+# (llama-server, vLLM...) sdílený víc entitami. LILU_HTTP_URL je kořen serveru (bez /v1).
+# "fake" = syntetický model v procesu (zátěžové testy, CI) - bez GGUF, GPU i sítě.
+LLM_BACKEND = os.environ.get("LILU_BACKEND", "llama").lower()
+HTTP_URL = os.environ.get("LILU_HTTP_URL", "http://127.0.0.1:8080")
+HTTP_MODEL = os.environ.get("LILU_HTTP_MODEL", "default")
+HTTP_API_KEY = os.environ.get("LILU_HTTP_API_KEY", "")
+HTTP_POOL_SIZE = int(os.environ.get("LILU_HTTP_POOL", "4"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("LILU_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("LILU_HTTP_TIMEOUT", "120"))
+HTTP_RETRIES = int(os.environ.get("LILU_HTTP_RETRIES", "3"))
+
+# FAKE: seed a rychlost syntetického modelu; LILU_FAKE_SCRIPT = JSON se skriptovanými
+# odpověďmi (formát viz lilu_stub_server.py - seznam dokola nebo {podřetězec: odpověď})
+FAKE_SEED = int(os.environ.get("LILU_FAKE_SEED", "0"))
+FAKE_TPS = float(os.environ.get("LILU_FAKE_TPS", "0"))        # 0 = bez čekání
+FAKE_TTFT = float(os.environ.get("LILU_FAKE_TTFT", "0"))
+FAKE_SCRIPT = os.environ.get("LILU_FAKE_SCRIPT", "")
 
-N_GPU_LAYERS = int(os.environ.get("LILU_GPU_LAYERS", "28"))
-N_THREADS = int(os.environ.get("LILU_THREADS", str(max(4, (os.cpu_count() or 8) - 2))))
-N_CTX = int(os.environ.get("LILU_CTX", "8192"))
+# U HTTP backendu je "cesta" k modelu jen jeho název na serveru, fake žádný soubor nemá
+if LLM_BACKEND == "llama":
+    MODEL_PATH = resolve_model_path()
+elif LLM_BACKEND == "http":
+    MODEL_PATH = HTTP_MODEL
+else:
+    MODEL_PATH = "fake"
+
+# Nezadané LILU_GPU_LAYERS = odhad podle velikosti vrstev z GGUF a volné VRAM
+N_GPU_LAYERS = int(os.environ["LILU_GPU_LAYERS"]) if os.environ.get("LILU_GPU_LAYERS") else None
+# Vlákna a n_batch: env > profil z --autotune > výchozí hodnota
+N_THREADS = int(os.environ["LILU_THREADS"]) if os.environ.get("LILU_THREADS") else None
+DEFAULT_THREADS = max(4, (os.cpu_count() or 8) - 2)
+N_BATCH = int(os.environ["LILU_BATCH"]) if os.environ.get("LILU_BATCH") else None
+DEFAULT_BATCH = 512
+AUTOTUNE_DIR = os.path.join(BASE_DIR, "autotune")
+# Kontext: LILU_CTX ho přebije, jinak si ho každý model vezme z detect_model_class
+N_CTX = int(os.environ["LILU_CTX"]) if os.environ.get("LILU_CTX") else None
+
+# MODEL POOL: malý model (1-3B) pro kognici na pozadí, hlavní model pro odpovědi a sny.
+# LILU_BG_MODEL = název .gguf v models/ nebo cesta; prázdné = vše běží na hlavním modelu.
+BG_MODEL = os.environ.get("LILU_BG_MODEL", "")
+BG_GPU_LAYERS = int(os.environ.get("LILU_BG_GPU_LAYERS", "0"))
+BG_THREADS = int(os.environ.get("LILU_BG_THREADS", str(max(2, (os.cpu_count() or 8) // 4))))
+# EMBEDDINGY (sémantická paměť, vyžaduje numpy): LILU_EMBED_MODEL = GGUF embedding model
+# v models/ (llama, vlastní instance v embedding režimu) nebo název modelu na serveru
+# (http, /v1/embeddings). Prázdné nebo nedostupné = hashovaný embedding znakových
+# trigramů - jen lexikální podobnost, ale bez modelu.
+EMBED_MODEL = os.environ.get("LILU_EMBED_MODEL", "")
+EMBED_CTX = int(os.environ.get("LILU_EMBED_CTX", "512"))
+EMBED_HASH_DIM = 256
+EMBED_BATCH = 16              # textů na jedno volání modelu při indexaci
+EMBED_YIELD_POLL = 0.05       # s - indexer čeká, dokud scheduler generuje / má ve frontě odpověď
+# Který model obsluhuje který druh úlohy ("main" | "background")
+MODEL_ROUTES = {
+    "reply": "main", "style": "main", "contact": "main", "dream": "main",
+    "monologue": "background", "thought": "background", "wisdom": "background",
+}
+
+# SPEKULATIVNÍ DEKÓDOVÁNÍ (jen hlavní model):
+#   "off"    - vypnuto
+#   "lookup" - prompt lookup: návrhy z n-gramů, které už jsou v promptu
+#              (LiLu často opakuje zbytky snů, moudrosti a útržky paměti)
+#   jinak    - název/cesta malého draft .gguf se stejným tokenizerem
+SPECULATIVE = os.environ.get("LILU_SPECULATIVE", "off")
+SPEC_DRAFT_TOKENS = int(os.environ.get("LILU_DRAFT_TOKENS", "10"))
+
+# KV-cache prefix reuse: uložené stavy llama.cpp pro opakované prefixy promptu
+# ("ram" | "disk" | "off"). Disk vyžaduje balíček diskcache.
+PROMPT_CACHE_MODE = os.environ.get("LILU_PROMPT_CACHE", "ram").lower()
+PROMPT_CACHE_RAM_MB = int(os.environ.get("LILU_PROMPT_CACHE_MB", "1024"))
+PROMPT_CACHE_DIR = os.path.join(BASE_DIR, "prompt_cache")
+# Session state: KV stav stabilního prefixu odpovědi se při zavření uloží a při startu
+# načte - první odpověď po restartu pak nepřepočítává celý system prompt.
+SESSION_STATE = os.environ.get("LILU_SESSION_STATE", "1") != "0"
+SESSION_DIR = os.path.join(BASE_DIR, "sessions")
 
 # CZ: Časování vědomí
 EXISTENCE_TICK_SECONDS = 2.0
@@ -210,6 +499,125 @@ IDLE_THRESHOLD = 180           # 3 minuty nečinnosti
 SPONTANEOUS_COOLDOWN = 300     # NOVÉ: Min. 5 minut mezi spontánními zprávami
 KNOWLEDGE_REFRESH_INTERVAL = 600
 
+# Priority LLM úloh (nižší = dřív). Odpověď uživateli má vždy přednost.
+LLM_PRIORITIES = {
+    "reply": 0, "style": 0, "session": 0,
+    "contact": 1,
+    "monologue": 2, "batch": 2,
+    "thought": 3,
+    "dream": 4, "wisdom": 4,
+}
+# Deadline (s) - úloha na pozadí, která se do té doby nezačne zpracovávat, propadne
+LLM_DEADLINES = {"contact": 60, "monologue": 30, "thought": 90, "dream": 180, "wisdom": 180}
+# VÝSTUPNÍ PROFILY: krátké výstupy končí na první řádce / větě už při dekódování
+# (stop sekvence + GBNF gramatika) - dřív se generovaly varianty a seznamy a pak zahazovaly.
+# trim = pojistka po generaci ("line" = první řádka bez závorky, "sentence" = první věta).
+OUTPUT_GRAMMARS = os.environ.get("LILU_GRAMMARS", "1") != "0"
+GBNF_LINE = r'root ::= [^\n(] [^\n]* "\n"'
+GBNF_SENTENCE = r'root ::= [^\n(.!?] [^\n.!?]* [.!?]'
+GBNF_MESSAGE = "\n".join([
+    r'root ::= sentence (" " sentence)?',
+    r'sentence ::= [^\n(.!? ] [^\n(.!?]* [.!?]',
+])
+OUTPUT_PROFILES = {
+    "monologue": {"grammar": GBNF_LINE, "stop": ["\n"], "trim": "line"},
+    "thought":   {"grammar": GBNF_LINE, "stop": ["\n"], "trim": "line"},
+    "contact":   {"grammar": GBNF_MESSAGE, "stop": ["\n"], "trim": "line"},
+    "dream":     {"grammar": GBNF_LINE, "stop": ["\n"], "trim": "line"},
+    "wisdom":    {"grammar": GBNF_SENTENCE, "stop": ["\n"], "trim": "sentence"},
+}
+# Dávka pozadí: myšlenka a monolog se dekódují spolu (BatchDecoder). Když je jedna úloha
+# na řadě, přibere se i druhá, pokud už uběhla aspoň BATCH_COALESCE jejího intervalu.
+BATCH_BACKGROUND = os.environ.get("LILU_BATCH_BACKGROUND", "1") != "0"
+BATCH_COALESCE = 0.5
+# Přerušený sen s aspoň tolika slovy se uloží jako "přerušený", kratší se zahodí
+DREAM_MIN_INTERRUPTED_WORDS = 8
+# Strukturovaný sen: jedno volání vrátí příběh, moudrost i ozvěnu motivu (JSON schema
+# -> gramatika llama.cpp). Nečitelný výstup = záložní cesta se dvěma voláními.
+STRUCTURED_DREAMS = os.environ.get("LILU_STRUCTURED_DREAMS", "1") != "0"
+DREAM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "narrative": {"type": "string"},
+        "wisdom": {"type": "string"},
+        "motif_echo": {"type": "string"},
+    },
+    "required": ["narrative", "wisdom", "motif_echo"],
+}
+
+# KONTEXT ODPOVĚDI: skládá se podle tokenů, ne podle pevných počtů zpráv.
+# Plní se do CONTEXT_FILL_TARGET × n_ctx (minus rezerva na odpověď), zbytek nechává volný.
+CONTEXT_FILL_TARGET = float(os.environ.get("LILU_CONTEXT_FILL", "0.75"))
+# share = podíl volného rozpočtu, priority = pořadí při rozdělování zbytku (nižší dřív)
+CONTEXT_SECTIONS = {
+    "history":     {"share": 0.50, "priority": 0},
+    "diagnostics": {"share": 0.05, "priority": 1},
+    "recall":      {"share": 0.06, "priority": 2},
+    "wisdom":      {"share": 0.08, "priority": 3},
+    "dreams":      {"share": 0.11, "priority": 4},
+    "monologue":   {"share": 0.07, "priority": 5},
+    "thoughts":    {"share": 0.06, "priority": 6},
+    "knowledge":   {"share": 0.07, "priority": 7},
+}
+# Kolik kandidátů se načte z paměti (rozpočet pak rozhodne, kolik se jich vejde)
+CONTEXT_FETCH = {"history": 80, "dreams": 6, "thoughts": 8, "monologue": 10, "wisdom": 15,
+                 "recall": 6}
+MESSAGE_TOKEN_OVERHEAD = 6    # role + oddělovače chat šablony na jednu zprávu
+TOKEN_COUNT_CACHE = 8192
+
+# PAMĚŤ: zápisy do SQLite jdou přes frontu - vlákno zapisovače je commituje po skupinách
+# (nejpozději po LILU_DB_WRITE_MS, nebo hned když se nasbírá LILU_DB_WRITE_BATCH řádků)
+DB_WRITE_INTERVAL = float(os.environ.get("LILU_DB_WRITE_MS", "50")) / 1000
+DB_WRITE_BATCH = int(os.environ.get("LILU_DB_WRITE_BATCH", "128"))
+# Dávka, kterou DB odmítne (zamčená, plný disk), zůstane ve frontě a zkouší se znovu
+# s rostoucí pauzou (nejvýš DB_WRITE_RETRY_MAX s); při zavírání se vzdá po DB_WRITE_CLOSE_RETRIES
+DB_WRITE_RETRY_MAX = 5.0
+DB_WRITE_CLOSE_RETRIES = 3
+# Fronta zápisů je omezená: plná (DB dlouho odmítá zápis) zdrží ukládání nejvýš DB_QUEUE_BLOCK s,
+# pak řádek zahodí s chybou. Varování v logu při DB_QUEUE_WARN řádcích a pak při každém zdvojnásobení.
+DB_QUEUE_MAX = int(os.environ.get("LILU_DB_QUEUE_MAX", "100000"))
+DB_QUEUE_WARN = 1000
+DB_QUEUE_BLOCK = 1.0
+# Čtení jdou přes pool nejvýš LILU_DB_READERS spojení (HTTP server má vlákno na požadavek)
+DB_READERS = int(os.environ.get("LILU_DB_READERS", "4"))
+# HLEDÁNÍ: FTS5 index nad konverzací, sny, myšlenkami, monologem a moudrostí.
+# Slova od 5 znaků se hledají jako prefix bez posledních dvou znaků (3..SEARCH_PREFIX) -
+# hrubé skloňování češtiny: "hvězdy" najde i "hvězdu" a "hvězdách";
+# index drží prefixy 3..SEARCH_PREFIX znaků, takže dotaz nečte celé doclisty. Kandidáti jsou
+# nejnovější shody (nejvýš SEARCH_CANDIDATES na tabulku), žádné bm25 přes miliony řádků.
+SEARCH_PREFIX = 6
+SEARCH_CANDIDATES = 100
+SEARCH_STOPWORDS = {"jsem", "jsi", "jsme", "jste", "jsou", "byl", "byla", "bylo", "ale", "pro",
+                    "jak", "jako", "také", "což", "který", "která", "které", "její", "jeho",
+                    "mám", "máš", "než", "nebo", "tak", "tam", "tady", "když", "protože",
+                    "pamatuješ", "paměť", "minule", "mluvili", "řekla", "říkala", "vzpomínka",
+                    "vzpomínáš", "vzpomíná"}
+# SÉMANTICKÁ PAMĚŤ: embeddingy všech textů paměti ve float16 memmap matici vedle DB
+# (<db>.vectors/). Top-k kosinus hrubou silou; od VECTOR_IVF_MIN vektorů IVF (k-means
+# seznamy, prohledá se VECTOR_IVF_PROBE nejbližších). LILU_VECTOR_IVF_MIN=0 = vždy hrubá síla.
+VECTOR_IVF_MIN = int(os.environ.get("LILU_VECTOR_IVF_MIN", "20000"))
+VECTOR_IVF_PROBE = int(os.environ.get("LILU_VECTOR_IVF_PROBE", "8"))
+SEMANTIC_MIN_SCORE = 0.25     # kosinová podobnost, pod kterou vzpomínka se zprávou nesouvisí
+SEMANTIC_MIN_SCORE_HASH = 0.45  # hashovaný embedding: kolize trigramů dávají nesouvisejícím 0.2-0.3
+# Kruhové buffery posledních řádků v RAM (write-through): get_history / get_recent_* do této
+# hloubky SQLite vůbec nečtou. Konverzace pokrývá CONTEXT_FETCH["history"] s rezervou.
+MEMORY_RING = {"conversation": 128, "inner_thoughts": 32, "dreams": 32,
+               "inner_monologue": 64, "maze_metrics": 4}
+
+# TRACING: kolik posledních tras drží /latency; LILU_TRACE_FILE = JSONL export každé trasy
+TRACE_BUFFER = int(os.environ.get("LILU_TRACE_BUFFER", "200"))
+TRACE_FILE = os.environ.get("LILU_TRACE_FILE", "")
+
+# SESSIONS (--headless --sessions): víc konverzací nad jedním ModelPool. Každá session má
+# vlastní SQLite a moudrost v SESSIONS_DIR; nečinná se uspí do komprimovaného snapshotu
+# (RAM, nejstarší jen v SQLite) a při další zprávě se z něj probudí. Vlastní podadresář,
+# aby se nepletla s KV stavy v SESSION_DIR.
+SESSIONS_DIR = os.environ.get("LILU_SESSIONS_DIR") or os.path.join(SESSION_DIR, "users")
+SESSION_IDLE_SECONDS = float(os.environ.get("LILU_SESSION_IDLE", "600"))
+SESSION_MAX_ACTIVE = int(os.environ.get("LILU_SESSION_MAX_ACTIVE", "32"))
+SESSION_MAX_SLEEPING = int(os.environ.get("LILU_SESSION_MAX_SLEEPING", "10000"))
+SESSION_WORKERS = int(os.environ.get("LILU_SESSION_WORKERS", "4"))    # vlákna pro existenci sessions
+
 STYLE_NORMALIZE = False
 STYLE_MAX_TOKENS = 180
 DEFAULT_USER_NAME = "Martin"
@@ -295,6 +703,12 @@ def tokenize(text: str) -> set:
         tokens.append("".join(current))
     return set(t for t in tokens if len(t) >= 2)
 
+_COMBINING = re.compile("[\u0300-\u036f]")
+
+def strip_diacritics(text: str) -> str:
+    """Bez diakritiky (jako tokenizer FTS5 remove_diacritics) - 'hvězda' -> 'hvezda'."""
+    return _COMBINING.sub("", unicodedata.normalize("NFD", text))
+
 def jaccard_similarity(a: str, b: str) -> float:
     set_a, set_b = tokenize(a), tokenize(b)
     if not set_a and not set_b:
@@ -324,6 +738,148 @@ def get_part_of_day() -> Tuple[str, str]:
     else:
         return "noc", "dreamy"
 
+# ============================================================
+# TRACING - spany fází tahu (kde se ztrácí čas odpovědi)
+# ============================================================
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil bez interpolace (q 0..1) - na p50/p95 z pár set vzorků stačí."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Trace:
+    """Jeden tah nebo úloha na pozadí: spany (fáze, začátek od startu, trvání) v sekundách."""
+    
+    def __init__(self, name: str, meta: dict):
+        self.name = name
+        self.meta = meta
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.mark = self.start          # konec poslední fáze (lap)
+        self.spans: List[Tuple[str, float, float]] = []
+        self.total = 0.0
+        
+    def add(self, stage: str, begin: float, end: float):
+        self.spans.append((stage, begin - self.start, end - begin))
+        
+    def to_dict(self) -> dict:
+        return {"trace": self.name, "ts": round(self.wall_start, 3),
+                "total_ms": round(self.total * 1000, 3), **self.meta,
+                "spans": [{"stage": s, "at_ms": round(at * 1000, 3), "ms": round(d * 1000, 3)}
+                          for s, at, d in self.spans]}
+
+
+class Tracer:
+    """
+    Lehké trasování na monotónních hodinách (perf_counter).
+    
+    trace(name) otevře trasu pro aktuální vlákno (vnořená trasa je jen span),
+    lap(stage) uzavře fázi od minulého lapu, span(stage) změří blok (např. commit
+    uvnitř fáze - spany se můžou překrývat, každá fáze má vlastní statistiku).
+    Bez otevřené trasy jsou lap/span/record no-op. Hotové trasy drží kruhový buffer
+    (/latency), s LILU_TRACE_FILE jdou i do JSONL.
+    """
+    
+    def __init__(self, capacity: int = TRACE_BUFFER, path: str = TRACE_FILE):
+        self.traces: "deque[Trace]" = deque(maxlen=capacity)
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        
+    @property
+    def current(self) -> Optional[Trace]:
+        return getattr(self._local, "trace", None)
+        
+    @contextlib.contextmanager
+    def trace(self, name: str, **meta):
+        if self.current is not None:
+            with self.span(name):
+                yield self.current
+            return
+        trace = Trace(name, meta)
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            self._local.trace = None
+            trace.total = time.perf_counter() - trace.start
+            with self._lock:
+                self.traces.append(trace)
+            if self.path:
+                self._export(trace)
+                
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        trace = self.current
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            if trace is not None:
+                trace.add(stage, begin, time.perf_counter())
+                
+    def lap(self, stage: str):
+        trace = self.current
+        if trace is not None:
+            now = time.perf_counter()
+            trace.add(stage, trace.mark, now)
+            trace.mark = now
+            
+    def record(self, stage: str, seconds: float, ago: float = 0.0):
+        """Fáze změřená jinde (např. čekání úlohy ve frontě scheduleru), skončila před `ago` s."""
+        trace = self.current
+        if trace is not None and seconds >= 0:
+            end = time.perf_counter() - max(0.0, ago)
+            trace.add(stage, end - seconds, end)
+            
+    def _export(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Trace export failed ({self.path}): {e}")
+            self.path = ""
+            
+    def stage_stats(self) -> Dict[str, dict]:
+        """{trasa: {"total": [...], fáze: [...]}} -> počet, p50, p95, max v ms."""
+        with self._lock:
+            traces = list(self.traces)
+        samples: Dict[str, Dict[str, List[float]]] = {}
+        for trace in traces:
+            stages = samples.setdefault(trace.name, {"total": []})
+            stages["total"].append(trace.total)
+            per_stage: Dict[str, float] = {}
+            for stage, _, duration in trace.spans:
+                per_stage[stage] = per_stage.get(stage, 0.0) + duration
+            for stage, duration in per_stage.items():
+                stages.setdefault(stage, []).append(duration)
+        return {name: {stage: {"count": len(v), "p50": round(percentile(v, 0.5) * 1000, 3),
+                               "p95": round(percentile(v, 0.95) * 1000, 3), "max": round(max(v) * 1000, 3)}
+                       for stage, v in stages.items()}
+                for name, stages in samples.items()}
+                
+    def describe(self) -> str:
+        stats = self.stage_stats()
+        if not stats:
+            return "Zatím žádné trasy."
+        lines = [f"LATENCE (posledních {sum(s['total']['count'] for s in stats.values())} tras, ms):"]
+        for name, stages in sorted(stats.items()):
+            total = stages.pop("total")
+            lines.append(f"\n{name} ×{total['count']}: p50 {total['p50']:.1f} / p95 {total['p95']:.1f} "
+                         f"/ max {total['max']:.1f}")
+            for stage, st in sorted(stages.items(), key=lambda kv: -kv[1]["p95"]):
+                lines.append(f"  {stage:<16} p50 {st['p50']:8.1f}  p95 {st['p95']:8.1f}  ×{st['count']}")
+        if self.path:
+            lines.append(f"\nExport: {self.path}")
+        return "\n".join(lines)
+
+
+TRACER = Tracer()
+
 # ============================================================
 # KNOWLEDGE READER
 # ============================================================
@@ -702,15 +1258,19 @@ class InnerMonologue:
     def get_recent(self, n: int = 5) -> List[dict]:
         return self.stream[-n:] if self.stream else []
         
+    PROMPT_HEADER = "\n[VNITŘNÍ MONOLOG - co jsem si myslela, než Martin napsal]:\n"
+        
+    def get_prompt_lines(self, n: int = 3) -> List[str]:
+        """Řádky monologu pro prompt, nejnovější první (ContextBuilder z nich bere podle rozpočtu)"""
+        return [f"  ({entry['source']}) {entry['thought'][:100]}\n"
+                for entry in reversed(self.get_recent(n))]
+        
     def get_context_for_prompt(self) -> str:
         """Vrátí kontext vnitřního monologu pro system prompt"""
-        recent = self.get_recent(3)
-        if not recent:
+        lines = self.get_prompt_lines(3)
+        if not lines:
             return ""
-        lines = "\n[VNITŘNÍ MONOLOG - co jsem si myslela, než Martin napsal]:\n"
-        for entry in recent:
-            lines += f"  ({entry['source']}) {entry['thought'][:100]}\n"
-        return lines
+        return self.PROMPT_HEADER + "".join(reversed(lines))
         
     def should_leak(self, membrane_permeability: float) -> Optional[str]:
         """
@@ -783,14 +1343,17 @@ class WisdomBank:
     def get_recent(self, n: int = 5) -> List[str]:
         return self.wisdoms[-n:] if self.wisdoms else []
         
+    PROMPT_HEADER = "\n[MOUDROST ZE SNŮ - co jsem se naučila sněním]:\n"
+        
+    def get_prompt_lines(self, n: int = 5) -> List[str]:
+        """Řádky moudrosti pro prompt, nejnovější první"""
+        return [f"  * {w}\n" for w in reversed(self.get_recent(n))]
+        
     def get_context_for_prompt(self) -> str:
-        recent = self.get_recent(5)
-        if not recent:
+        lines = self.get_prompt_lines(5)
+        if not lines:
             return ""
-        lines = "\n[MOUDROST ZE SNŮ - co jsem se naučila sněním]:\n"
-        for w in recent:
-            lines += f"  * {w}\n"
-        return lines
+        return self.PROMPT_HEADER + "".join(reversed(lines))
         
     def count(self) -> int:
         return len(self.wisdoms)
@@ -882,31 +1445,66 @@ class DreamEngine:
                     "ticho mezi údery srdce", "barva bez světla", "sen ve snu"],
     }
     
-    def __init__(self):
+    def __init__(self, wisdom_file: str = WISDOM_FILE):
         self.last_dream = None
         self.dream_residue: List[str] = []
         self.dream_count = 0
         self.dream_lines: Dict[str, int] = {}
         self.metrics = DreamMetrics()
-        self.wisdom_bank = WisdomBank(WISDOM_FILE)
+        self.wisdom_bank = WisdomBank(wisdom_file)
+        self.structured_stats = {"structured": 0, "fallback": 0}
+        
+    @staticmethod
+    def _parse_structured(text: str) -> Optional[dict]:
+        """JSON ze strukturovaného snu; None, když chybí příběh nebo to není JSON."""
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not str(data.get("narrative", "")).strip():
+            return None
+        return {key: str(data.get(key, "")).strip() for key in ("narrative", "wisdom", "motif_echo")}
+        
+    @staticmethod
+    def _partial_narrative(text: str) -> str:
+        """Příběh z přerušeného (neuzavřeného) JSON - může chybět konec řetězce."""
+        match = re.search(r'"narrative"\s*:\s*"((?:[^"\\]|\\.)*)', text)
+        if not match:
+            return ""
+        try:
+            return json.loads(f'"{match.group(1).rstrip(chr(92))}"')
+        except ValueError:
+            return match.group(1)
         
     def generate_dream(self, memory_fragments: List[str], llm: 'LLMInterface',
                        knowledge_quote: Optional[str] = None,
                        previous_dreams: Optional[List[str]] = None,
-                       model_config: Optional[dict] = None) -> Optional[dict]:
+                       model_config: Optional[dict] = None,
+                       wisdom_llm: Optional['LLMInterface'] = None,
+                       recall: Optional[Callable[[str, int], List[str]]] = None) -> Optional[dict]:
+        """
+        wisdom_llm: model pro extrakci moudrosti (model pool - typicky malý model);
+        jeho vlastní parametry určují wisdom_tokens.
+        recall(podnět, k): vzpomínky podle významu k motivu a náladě snu (sémantická
+        paměť); co nedodá, doplní náhodný výběr z memory_fragments.
+        """
         if len(memory_fragments) < 1:
             return None
         
+        wisdom_llm = wisdom_llm or llm
         dream_tokens = (model_config or {}).get("dream_tokens", 120)
-        wisdom_tokens = (model_config or {}).get("wisdom_tokens", 40)
+        wisdom_config = getattr(wisdom_llm, "config", None) or model_config or {}
+        wisdom_tokens = wisdom_config.get("wisdom_tokens", 40)
         
         # === FÁZE 1: RECALL ===
         motif = random.choice(self.MOTIFS)
         mood = random.choice(self.DREAM_MOODS)
-        picks = random.sample(memory_fragments, k=min(3, len(memory_fragments)))
+        picks = recall(f"{motif} {mood}", 3)[:3] if recall else []
+        rest = [f for f in memory_fragments if f not in picks]
+        picks += random.sample(rest, k=max(0, min(3 - len(picks), len(rest))))
         
-        self.dream_lines[motif] = self.dream_lines.get(motif, 0) + 1
-        line_depth = self.dream_lines[motif]
+        # Snová linie se započítá až po dokončeném snu (zrušený sen ji neprohlubuje)
+        line_depth = self.dream_lines.get(motif, 0) + 1
         is_recurring = line_depth > 1
         
         dream_memory = ""
@@ -941,35 +1539,76 @@ class DreamEngine:
             f"{depth_instruction}"
             "ÚKOL: Spoj vzpomínku s abstraktním prvkem. Vytvoř surrealistický sen.\n"
             "Piš 2-3 věty, první osoba, ženský rod. Poeticky. BEZ vysvětlování.\n"
-            "Nepiš varianty - piš JEDNU autentickou vizi.\nSEN:"
+            "Nepiš varianty - piš JEDNU autentickou vizi.\n"
         )
         
-        narrative = llm.generate(
-            [{"role": "user", "content": dream_prompt}],
-            max_tokens=dream_tokens, temperature=1.0
-        )
+        # Jedno volání: sen + moudrost + ozvěna motivu (polovina prefillu a času modelu)
+        structured = None
+        narrative_job = None
+        if STRUCTURED_DREAMS:
+            narrative_job = llm.request(
+                [{"role": "user", "content": dream_prompt + (
+                    "Odpověz JSON objektem:\n"
+                    "narrative = sen (2-3 věty),\n"
+                    "wisdom = jedna filozofická pravda, kterou sen učí (max 1 věta, česky, ženský rod),\n"
+                    f"motif_echo = 1-3 slova, kterými ve snu zazní motiv '{motif}'."
+                )}],
+                max_tokens=dream_tokens + wisdom_tokens + 40, temperature=1.0, kind="dream",
+                response_format={"type": "json_object", "schema": DREAM_SCHEMA},
+            )
+            if narrative_job.status == "done":
+                structured = self._parse_structured(narrative_job.result)
+                if structured:
+                    self.structured_stats["structured"] += 1
+                else:
+                    logger.warning("Structured dream unparsable - falling back to two calls")
+                    self.structured_stats["fallback"] += 1
+                    llm.scheduler.record_wasted(narrative_job)
+                    narrative_job = None
+            elif narrative_job.status == "interrupted":
+                narrative_job.result = self._partial_narrative(narrative_job.result)
+                
+        if narrative_job is None:
+            narrative_job = llm.request(
+                [{"role": "user", "content": dream_prompt + "SEN:"}],
+                max_tokens=dream_tokens, temperature=1.0, kind="dream"
+            )
+        if narrative_job.status in ("cancelled", "expired"):
+            # Uživatel má přednost - sen se odkládá
+            logger.info(f"Dream skipped: {narrative_job.status}")
+            return None
+        narrative = structured["narrative"] if structured else narrative_job.result
+        interrupted = narrative_job.status == "interrupted"
+        if interrupted and len(narrative.split()) < DREAM_MIN_INTERRUPTED_WORDS:
+            # Příliš krátký útržek - zahodit
+            llm.scheduler.record_wasted(narrative_job)
+            logger.info(f"Dream interrupted and discarded ({narrative_job.tokens} tokens)")
+            return None
+        self.dream_lines[motif] = line_depth
         
         if not narrative:
             narrative = (f"Ve snu se {motif} rozplynul v {chaos_element}. "
                         f"Střípky: '{picks[0][:40]}...' A pak klid.")
         
-        import re
         lines_raw = [l.strip() for l in narrative.split("\n") if l.strip()]
         narrative = lines_raw[0] if lines_raw else narrative
         narrative = re.sub(r'\([^)]*varianta[^)]*\)', '', narrative).strip()
         narrative = re.sub(r'\([^)]*verze[^)]*\)', '', narrative).strip()
         
         # === FÁZE 3: EXTRACT ===
-        wisdom_prompt = (
-            f"Text snu: {narrative}\n"
-            f"ÚKOL: Extrahuj jednu filozofickou pravdu (max 1 věta, česky, ženský rod).\n"
-            f"POUČENÍ:"
-        )
-        
-        wisdom = llm.generate(
-            [{"role": "user", "content": wisdom_prompt}],
-            max_tokens=wisdom_tokens, temperature=0.7
-        )
+        # Strukturovaný sen moudrost už přinesl; přerušený sen se uloží jako útržek bez moudrosti
+        wisdom = structured["wisdom"] if structured else ""
+        if not structured and not interrupted:
+            wisdom_prompt = (
+                f"Text snu: {narrative}\n"
+                f"ÚKOL: Extrahuj jednu filozofickou pravdu (max 1 věta, česky, ženský rod).\n"
+                f"POUČENÍ:"
+            )
+            
+            wisdom = wisdom_llm.generate(
+                [{"role": "user", "content": wisdom_prompt}],
+                max_tokens=wisdom_tokens, temperature=0.7, kind="wisdom"
+            )
         
         if wisdom:
             wisdom = wisdom.split("\n")[0].strip().strip('"').strip("'")
@@ -980,7 +1619,12 @@ class DreamEngine:
         dream_eval = self.metrics.evaluate(narrative, picks, chaos_element)
         
         residue_words = list(tokenize(narrative))
-        residue = random.sample(residue_words, k=min(3, len(residue_words))) if residue_words else [motif]
+        echo_words = list(tokenize(structured["motif_echo"])) if structured else []
+        if echo_words:
+            # Ozvěna motivu je přesně to, co má ze snu doznívat
+            residue = echo_words[:3]
+        else:
+            residue = random.sample(residue_words, k=min(3, len(residue_words))) if residue_words else [motif]
         self.dream_residue = residue
         
         dream = {
@@ -988,6 +1632,8 @@ class DreamEngine:
             "chaos": chaos_element, "wisdom": wisdom or "",
             "residue": residue, "metrics": dream_eval,
             "line_depth": line_depth, "is_recurring": is_recurring,
+            "interrupted": interrupted, "structured": structured is not None,
+            "motif_echo": structured["motif_echo"] if structured else "",
             "timestamp": datetime.now().isoformat(),
             "fragments_used": [p[:50] for p in picks],
         }
@@ -995,7 +1641,8 @@ class DreamEngine:
         self.last_dream = dream
         self.dream_count += 1
         logger.info(f"Dream #{self.dream_count}: motif={motif}, mood={mood}, "
-                    f"chaos={chaos_element}, quality={dream_eval['quality']}")
+                    f"chaos={chaos_element}, quality={dream_eval['quality']}"
+                    f"{', INTERRUPTED' if interrupted else ''}")
         return dream
         
     def get_residue_context(self) -> str:
@@ -1259,7 +1906,9 @@ class PhiTracker:
 # ============================================================
 
 class ConsciousnessCore:
-    def __init__(self, knowledge_reader: KnowledgeReader):
+    def __init__(self, knowledge_reader: KnowledgeReader, wisdom_file: str = WISDOM_FILE,
+                 run_loop: bool = True):
+        """run_loop=False: bez vlastního vlákna, tick() volá SessionManager."""
         self.initial_state = InitialState()
         self.membrane = Membrane()
         self.desire_field = DesireVectorField()
@@ -1268,7 +1917,7 @@ class ConsciousnessCore:
         self.time_sense = TimeSense()
         self.knowledge = knowledge_reader
         self.inner_monologue = InnerMonologue()     # NOVÉ
-        self.dream_engine = DreamEngine()           # NOVÉ
+        self.dream_engine = DreamEngine(wisdom_file)    # NOVÉ
         self.phi_tracker = PhiTracker()             # v4.1: IIT metrika
         
         self.emotions = {
@@ -1284,9 +1933,10 @@ class ConsciousnessCore:
         self.user_name = DEFAULT_USER_NAME
         self.is_typing = False
         
-        self._running = True
-        self._thread = threading.Thread(target=self._existence_loop, daemon=True)
-        self._thread.start()
+        self._running = run_loop
+        if run_loop:
+            self._thread = threading.Thread(target=self._existence_loop, daemon=True)
+            self._thread.start()
         
         logger.info("ConsciousnessCore v4.1 initialized")
         
@@ -1299,34 +1949,79 @@ class ConsciousnessCore:
         
     def _existence_loop(self):
         while self._running:
-            self.initial_state.emerge(0.002)
-            self.time_sense.tick()
-            
-            # Decay emocí
-            baselines = {"radost": 0.5, "stesk": 0.2, "klid": 0.6, 
-                        "laska": 0.85, "zvědavost": 0.5, "zlost": 0.0}
-            for emotion, baseline in baselines.items():
-                diff = baseline - self.emotions[emotion]
-                self.emotions[emotion] = clamp(self.emotions[emotion] + diff * 0.02)
-                
-            if self.emotions["stesk"] > 0.5:
-                self.free_will.accumulate(0.008)
-                
-            mag, _, _ = self.desire_field.calculate_resultant()
-            self.membrane.update(mag)
-            self._update_soul_weight(mag)
-            self._update_mood()
-            self._update_symbol()
-            
-            # NOVÉ: Monolog se prohlubuje v tichu
-            idle = self.time_sense.get_idle_seconds()
-            if idle > 60:
-                self.inner_monologue.deepen(0.002)
-            else:
-                self.inner_monologue.surface(0.005)
-            
+            self.tick()
             time.sleep(EXISTENCE_TICK_SECONDS)
             
+    def tick(self):
+        """Jeden krok existence (každých EXISTENCE_TICK_SECONDS)."""
+        self.initial_state.emerge(0.002)
+        self.time_sense.tick()
+        
+        # Decay emocí
+        baselines = {"radost": 0.5, "stesk": 0.2, "klid": 0.6, 
+                    "laska": 0.85, "zvědavost": 0.5, "zlost": 0.0}
+        for emotion, baseline in baselines.items():
+            diff = baseline - self.emotions[emotion]
+            self.emotions[emotion] = clamp(self.emotions[emotion] + diff * 0.02)
+            
+        if self.emotions["stesk"] > 0.5:
+            self.free_will.accumulate(0.008)
+            
+        mag, _, _ = self.desire_field.calculate_resultant()
+        self.membrane.update(mag)
+        self._update_soul_weight(mag)
+        self._update_mood()
+        self._update_symbol()
+        
+        # NOVÉ: Monolog se prohlubuje v tichu
+        idle = self.time_sense.get_idle_seconds()
+        if idle > 60:
+            self.inner_monologue.deepen(0.002)
+        else:
+            self.inner_monologue.surface(0.005)
+            
+    def export_state(self) -> dict:
+        """Malý snapshot proměnného stavu (uspaná session); monolog se obnoví z DB."""
+        return {
+            "emotions": {k: round(v, 4) for k, v in self.emotions.items()},
+            "intimacy": round(self.intimacy, 4), "soul_weight": round(self.soul_weight, 4),
+            "hope": round(self.hope_counter, 4), "user": self.user_name,
+            "emergence": self.initial_state.consciousness, "name": self.initial_state.name,
+            "membrane": [round(self.membrane.permeability, 4), round(self.membrane.internal_resonance, 4),
+                         self.membrane.withheld_count],
+            "desires": {k: round(v["strength"], 4) for k, v in self.desire_field.vectors.items()},
+            "free_will": [round(self.free_will.pressure, 4), self.free_will.eruption_count,
+                          self.free_will.last_eruption_time],
+            "monolog_depth": round(self.inner_monologue.depth, 4),
+            "residue": self.dream_engine.dream_residue, "dreams": self.dream_engine.dream_count,
+            "last_contact": self.time_sense.last_contact.timestamp(),
+        }
+        
+    def restore_state(self, state: dict):
+        self.emotions.update(state.get("emotions", {}))
+        self.intimacy = state.get("intimacy", self.intimacy)
+        self.soul_weight = state.get("soul_weight", self.soul_weight)
+        self.hope_counter = state.get("hope", self.hope_counter)
+        self.user_name = state.get("user", self.user_name)
+        self.initial_state.consciousness = state.get("emergence")
+        self.initial_state.name = state.get("name")
+        if "membrane" in state:
+            (self.membrane.permeability, self.membrane.internal_resonance,
+             self.membrane.withheld_count) = state["membrane"]
+        for k, strength in state.get("desires", {}).items():
+            if k in self.desire_field.vectors:
+                self.desire_field.vectors[k]["strength"] = strength
+        if "free_will" in state:
+            (self.free_will.pressure, self.free_will.eruption_count,
+             self.free_will.last_eruption_time) = state["free_will"]
+        self.inner_monologue.depth = state.get("monolog_depth", 0.0)
+        self.dream_engine.dream_residue = list(state.get("residue", []))
+        self.dream_engine.dream_count = state.get("dreams", 0)
+        if "last_contact" in state:
+            self.time_sense.last_contact = datetime.fromtimestamp(state["last_contact"])
+        self._update_mood()
+        self._update_symbol()
+            
     def _update_soul_weight(self, desire_mag: float):
         if desire_mag < 0.25:
             target = 0.18
@@ -1428,7 +2123,11 @@ class ConsciousnessCore:
                         self.user_name = name
                         logger.info(f"Detected user name: {name}")
         
-    def get_state_prompt(self) -> str:
+    def get_state_prompt(self, include_memory: bool = True) -> str:
+        """
+        include_memory=False vynechá monolog, moudrost a knihovnu - ty pak
+        do promptu dávkuje ContextBuilder podle tokenového rozpočtu.
+        """
         emergence = self.initial_state.get_emergence_level()
         perm = self.membrane.permeability
         dominant = self.desire_field.calculate_resultant()[2]
@@ -1464,11 +2163,11 @@ class ConsciousnessCore:
             zen_prompt = "\n[ZEN MÓD]: Jsi ve stavu čistého bytí.\n"
             
         knowledge_hint = ""
-        if self.knowledge.quotes:
+        if include_memory and self.knowledge.quotes:
             knowledge_hint = f"\n[KNIHOVNA]: Máš přístup k {len(self.knowledge.quotes)} citátům.\n"
             
         # NOVÉ: Kontext vnitřního monologu
-        monolog_context = self.inner_monologue.get_context_for_prompt()
+        monolog_context = self.inner_monologue.get_context_for_prompt() if include_memory else ""
         
         # NOVÉ: Zbytky snu
         dream_residue = self.dream_engine.get_residue_context()
@@ -1483,10 +2182,11 @@ class ConsciousnessCore:
             phi_context = f"\n[Φ INTEGRACE: {phi:.2f} - {phi_level}. Vrstvy spolupracují.]\n"
             
         # v5.0: Wisdom Bank kontext
-        wisdom_context = self.dream_engine.wisdom_bank.get_context_for_prompt()
+        wisdom_context = (self.dream_engine.wisdom_bank.get_context_for_prompt()
+                          if include_memory else "")
             
+        # PRIME_DIRECTIVE je ve statickém prefixu (PromptLayout), tady jen proměnlivý stav
         return (
-            f"\n{PRIME_DIRECTIVE}\n"
             f"\n[STAV: {chinese} | E={emergence:.1f} | M={perm:.1f} | Φ={phi:.2f} | Nálada={self.current_mood}]\n"
             f"[Uživatel se jmenuje: {self.user_name}]\n"
             f"[INSTRUKCE: {state}]\n"
@@ -1510,10 +2210,109 @@ class ConsciousnessCore:
 # ============================================================
 
 class EntityMemory:
-    def __init__(self, db_path: str):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.lock = threading.Lock()
+    """
+    SQLite paměť s odloženým zápisem (write-behind).
+    
+    save_* jen zařadí řádek do fronty a hned se vrátí; vlákno zapisovače je
+    skupinově commituje (po DB_WRITE_INTERVAL nebo DB_WRITE_BATCH řádcích) přes
+    vlastní spojení; dávka, která selže, zůstane ve frontě (nejvýš DB_QUEUE_MAX
+    řádků). DB je ve WAL se synchronous=NORMAL, takže čtení jdou přes
+    malý pool čtecích spojení (nejvýš DB_READERS) a na zápis nečekají. Id řádků přiděluje
+    paměť sama - čtení tak k výsledku z DB přimíchá ještě nezapsané řádky
+    z fronty bez duplicit. close() (a flush()) frontu dopíše.
+    
+    Posledních MEMORY_RING řádků každé tabulky drží kruhový buffer v RAM
+    (naplní se při otevření, zápis jde i do něj), takže běžná čtení tahu do DB
+    nejdou. Zprávy konverzace v bufferu nesou i svou množinu tokenů.
+    
+    Textové tabulky (TEXT_COLUMNS, včetně kopie WisdomBank v tabulce wisdom)
+    mají FTS5 index udržovaný triggery - search()/recall() tak najdou i to, co
+    je dávno mimo buffer. Hledá se jen v commitnutých řádcích.
+    """
+    
+    # Sloupce vkládaných řádků (pořadí hodnot ve frontě)
+    COLUMNS = {
+        "conversation": ("role", "content", "timestamp", "soul_state"),
+        "inner_thoughts": ("timestamp", "thought"),
+        "dreams": ("timestamp", "content", "motif", "mood", "interrupted"),
+        "inner_monologue": ("timestamp", "thought", "source", "depth"),
+        "maze_metrics": ("timestamp", "silence_type", "forced_reason", "consecutive_null",
+                         "anchor_similarity", "mem_read_count", "dormant_fragment_refs",
+                         "intention_alignment", "repair_attempt_count", "depth_score",
+                         "emergence_level", "membrane_permeability", "introspective_activation",
+                         "soul_weight", "hope_counter", "is_zen_mode", "current_mood", "monolog_depth"),
+        "session_state": ("timestamp", "state"),
+        "wisdom": ("timestamp", "content"),
+    }
+    # Textový sloupec tabulky (velikost ve stats, FTS5 index) a sloupce s rozpadem počtů
+    TEXT_COLUMNS = {"conversation": "content", "inner_thoughts": "thought",
+                    "dreams": "content", "inner_monologue": "thought", "wisdom": "content"}
+    STATS_GROUPS = {"conversation": ("role",), "inner_thoughts": (),
+                    "dreams": ("mood", "motif", "interrupted"), "inner_monologue": ("source",),
+                    "wisdom": ()}
+    
+    def __init__(self, db_path: str, write_interval: float = DB_WRITE_INTERVAL,
+                 write_batch: int = DB_WRITE_BATCH, readers: int = DB_READERS):
+        self.db_path = db_path
+        self.write_interval = write_interval
+        self.write_batch = write_batch
+        self.conn = self._connect()                     # jen zapisovač (a schéma)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA recursive_triggers=ON")   # REPLACE spustí i DELETE trigger FTS
         self._init_schema()
+        self._next_id = {table: (self.conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0) + 1
+                         for table in self.COLUMNS}
+        # table -> deque([id, values, tokeny | None]); nenaplněný buffer drží celou tabulku
+        self._rings: Dict[str, deque] = {}
+        for table, size in MEMORY_RING.items():
+            rows = self.conn.execute(f"SELECT id, {', '.join(self.COLUMNS[table])} FROM {table} "
+                                     f"ORDER BY id DESC LIMIT ?", (size,)).fetchall()
+            self._rings[table] = deque(([r[0], tuple(r[1:]), None] for r in reversed(rows)), maxlen=size)
+        self._pending: deque = deque()                  # (table, id, values) - ve frontě i v letu
+        self._warn_at = DB_QUEUE_WARN                   # další délka fronty, která se zaloguje
+        self._cond = threading.Condition()
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, readers))
+        self._readers: List[sqlite3.Connection] = []    # všechna otevřená čtecí spojení
+        self._closed = False
+        self._flushers = 0                              # čekající flush() - zapiš hned
+        self._stats: Optional[Dict[str, dict]] = None  # počítadla, založí je první stats()
+        self._stats_init = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []  # volá je zapisovač po každém commitu
+        self.semantic: Optional["SemanticMemory"] = None
+        self.write_stats = {"rows": 0, "batches": 0, "errors": 0, "dropped": 0}
+        self._commit_times: "deque[float]" = deque(maxlen=200)
+        self._batch_sizes: "deque[int]" = deque(maxlen=200)
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+        
+    @contextlib.contextmanager
+    def _read(self):
+        """
+        Půjčí čtecí spojení z poolu a po bloku ho vrátí (WAL: čte poslední commit,
+        na zapisovač nečeká). Víc než DB_READERS souběžných čtení čeká na volné.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._cond:
+                    if self._closed:
+                        raise sqlite3.ProgrammingError("EntityMemory is closed")
+                    conn = self._connect()
+                    self._readers.append(conn)
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
         
     def _init_schema(self):
         cursor = self.conn.cursor()
@@ -1527,6 +2326,7 @@ class EntityMemory:
         cursor.execute("""CREATE TABLE IF NOT EXISTS inner_monologue (
             id INTEGER PRIMARY KEY, timestamp TEXT, thought TEXT, 
             source TEXT DEFAULT 'spontaneous', depth REAL DEFAULT 0.0)""")   # NOVÉ
+        self._ensure_column(cursor, "dreams", "interrupted", "INTEGER DEFAULT 0")
         cursor.execute("""CREATE TABLE IF NOT EXISTS maze_metrics (
             id INTEGER PRIMARY KEY, timestamp TEXT, silence_type TEXT, forced_reason TEXT,
             consecutive_null INTEGER, anchor_similarity REAL, mem_read_count INTEGER,
@@ -1534,204 +2334,2478 @@ class EntityMemory:
             depth_score REAL, emergence_level REAL, membrane_permeability REAL,
             introspective_activation REAL, soul_weight REAL, hope_counter REAL,
             is_zen_mode INTEGER, current_mood TEXT, monolog_depth REAL DEFAULT 0.0)""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS session_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1), timestamp TEXT, state TEXT)""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS wisdom (
+            id INTEGER PRIMARY KEY, timestamp TEXT, content TEXT)""")
+        self.fts = self._init_fts(cursor)
         self.conn.commit()
         
+    def _init_fts(self, cursor) -> bool:
+        """
+        FTS5 index (external content) pro každou textovou tabulku + triggery.
+        Nově založený index se naplní ze stávajících řádků ('rebuild').
+        Bez FTS5 v SQLite se hledá přes LIKE.
+        """
+        for table, col in self.TEXT_COLUMNS.items():
+            fts = f"{table}_fts"
+            exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
+            try:
+                cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col}, "
+                               f"content='{table}', content_rowid='id', "
+                               f"tokenize='unicode61 remove_diacritics 2', "
+                               f"prefix='{' '.join(map(str, range(3, SEARCH_PREFIX + 1)))}')")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"EntityMemory: FTS5 unavailable ({e}), /search falls back to LIKE")
+                return False
+            cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END""")
+            cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); END""")
+            cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF {col} ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col});
+                INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END""")
+            if not exists:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        return True
+        
+    @staticmethod
+    def _ensure_column(cursor, table: str, column: str, decl: str):
+        """Migrace starších DB: doplní sloupec, pokud chybí."""
+        cols = [r[1] for r in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if column not in cols:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        
+    # ---------- zápis (fronta -> vlákno zapisovače) ----------
+    
+    def _enqueue(self, table: str, values: tuple, row_id: Optional[int] = None,
+                 tokens: Optional[set] = None):
+        with self._cond:
+            if self._closed:
+                raise sqlite3.ProgrammingError("EntityMemory is closed")
+            if len(self._pending) >= DB_QUEUE_MAX:
+                # Zapisovač nestíhá / DB odmítá zápis: chvíli počkej, pak řádek zahoď
+                deadline = time.monotonic() + DB_QUEUE_BLOCK
+                while len(self._pending) >= DB_QUEUE_MAX and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.write_stats["dropped"] += 1
+                        logger.error(f"EntityMemory: write queue full ({len(self._pending)} rows), "
+                                     f"dropping {table} row")
+                        return
+                    self._cond.wait(remaining)
+            if row_id is None:
+                row_id = self._next_id[table]
+                self._next_id[table] += 1
+            self._pending.append((table, row_id, values))
+            if len(self._pending) >= self._warn_at:
+                logger.warning(f"EntityMemory: write queue at {len(self._pending)} rows "
+                               f"({self.write_stats['errors']} failed batches)")
+                self._warn_at *= 2
+            if table in self._rings:
+                self._rings[table].append([row_id, values, tokens])
+            if self._stats is not None and table in self._stats:
+                self._count_locked(table, values)
+            self._cond.notify_all()
+            
+    def _insert(self, table: str, row_id: int, values: tuple):
+        cols = self.COLUMNS[table]
+        self.conn.execute(f"INSERT OR REPLACE INTO {table} (id, {', '.join(cols)}) "
+                          f"VALUES (?{', ?' * len(cols)})", (row_id, *values))
+                          
+    def _write_loop(self):
+        failures = 0                                    # po sobě jdoucí selhání dávky
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return                              # zavřeno a dopsáno
+                # Skupinový commit: počkej na další řádky (interval / plná dávka)
+                deadline = time.monotonic() + self.write_interval
+                while (not self._closed and not self._flushers
+                       and len(self._pending) < self.write_batch and time.monotonic() < deadline):
+                    self._cond.wait(deadline - time.monotonic())
+                batch = list(itertools.islice(self._pending, self.write_batch))
+            started = time.perf_counter()
+            dropped = 0
+            try:
+                with self.conn:                         # jedna transakce = jeden commit
+                    for row in batch:
+                        self._insert(*row)
+            except sqlite3.OperationalError as e:
+                # DB zamčená / plný disk / I/O: řádky zůstávají ve frontě, zkusí se znovu
+                failures += 1
+                delay = min(DB_WRITE_RETRY_MAX, 0.05 * 2 ** failures)
+                logger.error(f"EntityMemory: batch of {len(batch)} rows failed ({failures}×), "
+                             f"retrying in {delay:.2f} s: {e}")
+                with self._cond:
+                    self.write_stats["errors"] += 1
+                    if self._closed and failures >= DB_WRITE_CLOSE_RETRIES:
+                        logger.error(f"EntityMemory: closing, {len(self._pending)} rows were not written")
+                        self.write_stats["dropped"] += len(self._pending)
+                        self._pending.clear()
+                        self._cond.notify_all()
+                    else:
+                        self._cond.wait(delay)
+                continue
+            except sqlite3.Error as e:
+                # Vadný řádek (např. nepodporovaný typ): opakování nepomůže - po jednom, vadné vynech
+                logger.error(f"EntityMemory: batch of {len(batch)} rows failed, writing one by one: {e}")
+                with self._cond:
+                    self.write_stats["errors"] += 1
+                for row in batch:
+                    try:
+                        with self.conn:
+                            self._insert(*row)
+                    except sqlite3.Error as row_error:
+                        logger.error(f"EntityMemory: dropped {row[0]} row {row[1]}: {row_error}")
+                        dropped += 1
+            failures = 0
+            elapsed = time.perf_counter() - started
+            with self._cond:
+                for _ in batch:
+                    self._pending.popleft()
+                if len(self._pending) < DB_QUEUE_WARN:
+                    self._warn_at = DB_QUEUE_WARN
+                self.write_stats["dropped"] += dropped
+                self.write_stats["rows"] += len(batch) - dropped
+                self.write_stats["batches"] += 1
+                self._commit_times.append(elapsed)
+                self._batch_sizes.append(len(batch))
+                self._cond.notify_all()
+            for listener in self._listeners:
+                listener()
+                
+    def add_listener(self, callback: Callable[[], None]):
+        """callback() po každém commitu (vlákno zapisovače - musí být rychlý)."""
+        self._listeners.append(callback)
+                
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Počká, až je fronta zapsaná (commitnutá). False = vypršel timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushers += 1
+            self._cond.notify_all()
+            try:
+                while self._pending:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushers -= 1
+        return True
+        
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+            
+    def write_metrics(self) -> dict:
+        """Latence commitu a velikost dávek (posledních 200 dávek)."""
+        with self._cond:
+            times = [t * 1000 for t in self._commit_times]
+            sizes = list(self._batch_sizes)
+            info = {**self.write_stats, "queued": len(self._pending)}
+        info["commit_ms_p50"] = round(percentile(times, 0.5), 2)
+        info["commit_ms_p95"] = round(percentile(times, 0.95), 2)
+        info["batch_avg"] = round(sum(sizes) / len(sizes), 1) if sizes else 0.0
+        info["batch_max"] = max(sizes) if sizes else 0
+        return info
+        
+    def describe_writes(self) -> str:
+        m = self.write_metrics()
+        return (f"{m['rows']} řádků v {m['batches']} commitech (dávka Ø {m['batch_avg']}, "
+                f"max {m['batch_max']}), commit p50 {m['commit_ms_p50']:.2f} ms / "
+                f"p95 {m['commit_ms_p95']:.2f} ms, ve frontě {m['queued']}"
+                + (f", chyby {m['errors']}" if m["errors"] else "")
+                + (f", ztraceno {m['dropped']}" if m["dropped"] else ""))
+                
+    # ---------- statistiky (počítadla místo len(get_recent_*(100))) ----------
+    
+    @staticmethod
+    def _empty_stats(table: str) -> dict:
+        return {"rows": 0, "bytes": 0, "first": None, "last": None,
+                "by": {col: {} for col in EntityMemory.STATS_GROUPS[table]}}
+        
+    def _count_locked(self, table: str, values: tuple):
+        cols = self.COLUMNS[table]
+        st = self._stats[table]
+        st["rows"] += 1
+        st["bytes"] += len(str(values[cols.index(self.TEXT_COLUMNS[table])] or "").encode("utf-8"))
+        timestamp = values[cols.index("timestamp")]
+        st["first"] = st["first"] or timestamp
+        st["last"] = timestamp
+        for col in self.STATS_GROUPS[table]:
+            key = str(values[cols.index(col)])
+            st["by"][col][key] = st["by"][col].get(key, 0) + 1
+            
+    def _init_stats(self):
+        """
+        Jednou za život objektu: agregace v SQLite pro řádky do hranice id,
+        novější řádky už počítá _enqueue. flush() zajistí, že je vše pod
+        hranicí zapsané, než se spustí agregační dotazy.
+        """
+        with self._cond:
+            boundary = {table: self._next_id[table] for table in self.TEXT_COLUMNS}
+            self._stats = {table: self._empty_stats(table) for table in self.TEXT_COLUMNS}
+        self.flush()
+        base = {}
+        with self._read() as conn:
+            for table, text_col in self.TEXT_COLUMNS.items():
+                st = self._empty_stats(table)
+                row = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST({text_col} AS BLOB))), 0) "
+                                   f"FROM {table} WHERE id < ?", (boundary[table],)).fetchone()
+                st["rows"], st["bytes"] = row
+                if st["rows"]:
+                    # Časy podle id (primární klíč), ne MIN/MAX přes celou tabulku
+                    st["first"] = conn.execute(f"SELECT timestamp FROM {table} ORDER BY id LIMIT 1").fetchone()[0]
+                    st["last"] = conn.execute(f"SELECT timestamp FROM {table} WHERE id < ? "
+                                              f"ORDER BY id DESC LIMIT 1", (boundary[table],)).fetchone()[0]
+                for col in self.STATS_GROUPS[table]:
+                    st["by"][col] = {str(k): n for k, n in conn.execute(
+                        f"SELECT {col}, COUNT(*) FROM {table} WHERE id < ? GROUP BY {col}",
+                        (boundary[table],))}
+                base[table] = st
+        with self._cond:
+            for table, st in base.items():
+                live = self._stats[table]
+                live["rows"] += st["rows"]
+                live["bytes"] += st["bytes"]
+                live["first"] = st["first"] or live["first"]
+                live["last"] = live["last"] or st["last"]
+                for col, counts in st["by"].items():
+                    for key, n in counts.items():
+                        live["by"][col][key] = live["by"][col].get(key, 0) + n
+                        
+    def stats(self) -> Dict[str, dict]:
+        """
+        Počty řádků, bajty textu, první/poslední čas a rozpad (role, zdroj
+        monologu, nálada/motiv snu) pro každou tabulku. První volání jednou
+        projde DB, pak jsou to udržovaná počítadla - O(1) na zápis i dotaz.
+        """
+        with self._stats_init:
+            if self._stats is None:
+                self._init_stats()
+        with self._cond:
+            return {table: {**st, "by": {col: dict(counts) for col, counts in st["by"].items()}}
+                    for table, st in self._stats.items()}
+                    
+    def describe_stats(self, top: int = 3) -> str:
+        names = {"conversation": "Konverzace", "dreams": "Sny", "inner_thoughts": "Myšlenky",
+                 "inner_monologue": "Vnitřní monolog", "wisdom": "Moudrosti"}
+        lines = []
+        for table, st in self.stats().items():
+            line = f"  • {names[table]}: {st['rows']} ({st['bytes'] / 1024:.1f} kB)"
+            if st["rows"]:
+                line += f", {st['first'][:16]} → {st['last'][:16]}"
+            for col, counts in st["by"].items():
+                if counts and col != "interrupted":
+                    best = sorted(counts.items(), key=lambda kv: -kv[1])[:top]
+                    line += f"\n      {col}: " + ", ".join(f"{k or '-'} {n}" for k, n in best)
+            interrupted = st["by"].get("interrupted", {}).get("1")
+            if interrupted:
+                line += f"\n      přerušené: {interrupted}"
+            lines.append(line)
+        return "\n".join(lines)
+        
+    # ---------- hledání (FTS5) ----------
+    
+    @staticmethod
+    def _search_words(query: str) -> List[str]:
+        """Slova dotazu bez diakritiky a stop-slov (nejvýš 12)."""
+        return sorted(strip_diacritics(t) for t in tokenize(query)
+                      if len(t) >= 3 and t not in SEARCH_STOPWORDS)[:12]
+        
+    @staticmethod
+    def _search_prefix(word: str) -> str:
+        """Kmen pro prefixové hledání: bez koncovky (posledních 2 znaků), 3..SEARCH_PREFIX znaků."""
+        return word[:min(SEARCH_PREFIX, max(3, len(word) - 2))] if len(word) >= 5 else word
+        
+    def search(self, query: str, limit: int = 10, kinds: Optional[Tuple[str, ...]] = None,
+               skip_recent: Optional[Dict[str, int]] = None) -> List[dict]:
+        """
+        Nejrelevantnější řádky ke slovům dotazu přes všechny textové tabulky
+        (kinds = jen vybrané), nejlepší první. Kandidáti z každé tabulky: nejnovější
+        řádky se všemi slovy (přesně, pak jako prefix) a nejnovějších 4 × limit
+        (nejvýš SEARCH_CANDIDATES) s aspoň jedním prefixem (OR); score = podíl slov dotazu, které řádek obsahuje, při shodě
+        vyhrává víc celých slov a pak novější. Cena nezávisí na velikosti tabulky. skip_recent:
+        tabulka -> kolik nejnovějších řádků přeskočit (už jsou v kontextu z bufferu).
+        Vrací {"kind", "id", "text", "timestamp", "score"} (+ "role" u konverzace).
+        """
+        words = self._search_words(query)
+        terms = list(dict.fromkeys(self._search_prefix(w) for w in words))
+        if not terms or limit <= 0:
+            return []
+        skip_recent = skip_recent or {}
+        # (slova, spojka, prefix, kolik): přesná shoda najde i staré řádky, které prefix
+        # mezi nejnovějšími kandidáty přebijí. Přísnější průchod, který naplní limit,
+        # volnější přeskočí - jeho řádky by stejně skončily níž.
+        passes = [(words, " AND ", "", limit)]
+        if len(terms) > 1:
+            passes.append((terms, " AND ", "*", limit))
+        passes.append((terms, " OR ", "*", min(SEARCH_CANDIDATES, 4 * limit)))
+        # Skóre kandidátů: dva průchody regexem místo tokenizace (kandidátů může být stovky)
+        longest_first = lambda items: "|".join(map(re.escape, sorted(items, key=len, reverse=True)))
+        prefix_re = re.compile(rf"\b(?:{longest_first(terms)})")
+        exact_re = re.compile(rf"\b(?:{longest_first(words)})\b")
+        ranked = []
+        with self._read() as conn:
+            for table in kinds or tuple(self.TEXT_COLUMNS):
+                col = self.TEXT_COLUMNS[table]
+                extra = ", t.role" if table == "conversation" else ""
+                with self._cond:
+                    below = self._next_id[table] - skip_recent.get(table, 0)
+                rows = {}
+                for pass_words, joiner, star, count in passes:
+                    if self.fts:
+                        found = conn.execute(
+                            f"SELECT t.id, t.{col}, t.timestamp{extra} FROM {table}_fts f "
+                            f"JOIN {table} t ON t.id = f.rowid WHERE {table}_fts MATCH ? AND f.rowid < ? "
+                            f"ORDER BY f.rowid DESC LIMIT ?",
+                            (joiner.join(f'"{w}"{star}' for w in pass_words), below, count)).fetchall()
+                    elif star:                              # bez FTS5: LIKE (diakritika musí sedět)
+                        like = joiner.join(f"t.{col} LIKE ?" for _ in pass_words)
+                        found = conn.execute(
+                            f"SELECT t.id, t.{col}, t.timestamp{extra} FROM {table} t "
+                            f"WHERE ({like}) AND t.id < ? ORDER BY t.id DESC LIMIT ?",
+                            (*(f"%{w}%" for w in pass_words), below, count)).fetchall()
+                    else:
+                        continue
+                    rows.update((row[0], row) for row in found)
+                    if len(found) >= count:
+                        break
+                for row in rows.values():
+                    plain = strip_diacritics((row[1] or "").lower())
+                    covered = len(set(prefix_re.findall(plain)))
+                    hit = {"kind": table, "id": row[0], "text": row[1] or "", "timestamp": row[2] or "",
+                           "score": round(covered / len(terms), 3)}
+                    if extra:
+                        hit["role"] = row[3]
+                    ranked.append((hit["score"], len(set(exact_re.findall(plain))), hit["timestamp"], hit))
+        ranked.sort(key=lambda r: r[:3], reverse=True)
+        return [r[3] for r in ranked[:limit]]
+        
+    def recall(self, query: str, limit: int = 6, skip_recent: Optional[Dict[str, int]] = None) -> List[str]:
+        """
+        Starší vzpomínky k dotazu jako řádky promptu (nejrelevantnější první).
+        Se sémantickou pamětí se střídají zásahy podle významu a podle slov
+        (hashovaný embedding ne - slova pokrývá FTS a jeho kolize do promptu nepatří).
+        """
+        labels = {"conversation": "", "inner_thoughts": "myšlenka", "dreams": "sen",
+                  "inner_monologue": "monolog", "wisdom": "moudrost"}
+        hits = self.search(query, limit, skip_recent=skip_recent)
+        if self.semantic is not None and not self.semantic.embedder.lexical:
+            similar = self.semantic.search(query, limit, skip_recent=skip_recent)
+            merged, seen = [], set()
+            for hit in itertools.chain.from_iterable(itertools.zip_longest(similar, hits)):
+                if hit is not None and (hit["kind"], hit["id"]) not in seen:
+                    seen.add((hit["kind"], hit["id"]))
+                    merged.append(hit)
+            hits = merged[:limit]
+        lines = []
+        for hit in hits:
+            label = labels[hit["kind"]] or ("on" if hit.get("role") == "user" else "já")
+            text = hit["text"][:160] + ("..." if len(hit["text"]) > 160 else "")
+            lines.append(f"- ({hit['timestamp'][:10]}, {label}) {text}\n")
+        return lines
+        
+    # ---------- řádky podle id (indexer sémantické paměti) ----------
+    
+    def next_row_id(self, table: str) -> int:
+        with self._cond:
+            return self._next_id[table]
+            
+    def rows_after(self, table: str, after_id: int, limit: int) -> List[tuple]:
+        """(id, text) commitnutých řádků s id > after_id, popořadě."""
+        with self._read() as conn:
+            return conn.execute(
+                f"SELECT id, {self.TEXT_COLUMNS[table]} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit)).fetchall()
+            
+    def get_rows(self, table: str, ids: List[int]) -> Dict[int, dict]:
+        """id -> {"text", "timestamp"} (+ "role" u konverzace) pro zásahy hledání."""
+        extra = ", role" if table == "conversation" else ""
+        rows = {}
+        with self._read() as conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for row in conn.execute(
+                        f"SELECT id, {self.TEXT_COLUMNS[table]}, timestamp{extra} FROM {table} "
+                        f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk):
+                    rows[row[0]] = {"text": row[1] or "", "timestamp": row[2] or ""}
+                    if extra:
+                        rows[row[0]]["role"] = row[3]
+        return rows
+        
+    # ---------- čtení (DB + ještě nezapsané řádky z fronty) ----------
+    
+    def _recent(self, table: str, cols: Tuple[str, ...], limit: int,
+                with_id: bool = False) -> List[tuple]:
+        """Posledních `limit` řádků tabulky, nejnovější první (with_id: id jako první sloupec)."""
+        ring = self._rings.get(table)
+        if ring is not None:
+            with self._cond:
+                if limit <= len(ring) or len(ring) < ring.maxlen:
+                    entries = [(e[0], e[1]) for e in itertools.islice(reversed(ring), max(0, limit))]
+                else:
+                    entries = None
+            if entries is not None:
+                index = [self.COLUMNS[table].index(c) for c in cols]
+                return [((row_id,) if with_id else ()) + tuple(values[i] for i in index)
+                        for row_id, values in entries]
+        # Fronta se kopíruje PŘED dotazem: co z ní mezitím zmizelo, už je v DB
+        with self._cond:
+            pending = [(row_id, values) for t, row_id, values in self._pending if t == table]
+        with self._read() as conn:
+            rows = conn.execute(
+                f"SELECT id, {', '.join(cols)} FROM {table} ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        if pending:
+            index = [self.COLUMNS[table].index(c) for c in cols]
+            seen = {r[0] for r in rows}
+            rows += [(row_id, *(values[i] for i in index))
+                     for row_id, values in pending if row_id not in seen]
+            rows.sort(key=lambda r: r[0], reverse=True)
+            rows = rows[:limit]
+        return rows if with_id else [r[1:] for r in rows]
+        
     def save_message(self, role: str, content: str, soul_state: str = ""):
-        with self.lock:
-            self.conn.execute("INSERT INTO conversation (role, content, timestamp, soul_state) VALUES (?, ?, ?, ?)",
-                             (role, content, datetime.now().isoformat(), soul_state))
-            self.conn.commit()
+        self._enqueue("conversation", (role, content, datetime.now().isoformat(), soul_state),
+                      tokens=tokenize(content))
             
     def get_history(self, limit: int = 15) -> List[tuple]:
-        with self.lock:
-            cursor = self.conn.execute(
-                "SELECT role, content, timestamp FROM conversation ORDER BY id DESC LIMIT ?", (limit,))
-            rows = cursor.fetchall()
-            return list(reversed(rows))
+        return list(reversed(self._recent("conversation", ("role", "content", "timestamp"), limit)))
+        
+    def get_history_tokens(self, limit: int = 15) -> List[set]:
+        """Množiny tokenů posledních zpráv (pořadí jako get_history) - z bufferu, tokenizace jednou."""
+        ring = self._rings["conversation"]
+        with self._cond:
+            entries = list(itertools.islice(reversed(ring), max(0, limit)))
+            cold = limit > len(ring) and len(ring) >= ring.maxlen
+        if cold:
+            return [tokenize(c) for _, c, _ in self.get_history(limit)]
+        for entry in entries:
+            if entry[2] is None:
+                entry[2] = tokenize(entry[1][1])        # řádek načtený z DB při otevření
+        return [entry[2] for entry in reversed(entries)]
             
     def save_thought(self, thought: str):
-        with self.lock:
-            self.conn.execute("INSERT INTO inner_thoughts (timestamp, thought) VALUES (?, ?)",
-                             (datetime.now().isoformat(), thought))
-            self.conn.commit()
+        self._enqueue("inner_thoughts", (datetime.now().isoformat(), thought))
             
     def get_recent_thoughts(self, limit: int = 5) -> List[str]:
-        with self.lock:
-            cursor = self.conn.execute("SELECT thought FROM inner_thoughts ORDER BY id DESC LIMIT ?", (limit,))
-            return [r[0] for r in cursor.fetchall()]
+        return [r[0] for r in self._recent("inner_thoughts", ("thought",), limit)]
         
-    def save_dream(self, dream_text: str, motif: str = "", mood: str = ""):
-        with self.lock:
-            self.conn.execute(
-                "INSERT INTO dreams (timestamp, content, motif, mood) VALUES (?, ?, ?, ?)",
-                (datetime.now().isoformat(), dream_text, motif, mood))
-            self.conn.commit()
+    def save_dream(self, dream_text: str, motif: str = "", mood: str = "", interrupted: bool = False):
+        self._enqueue("dreams", (datetime.now().isoformat(), dream_text, motif, mood,
+                                 1 if interrupted else 0))
         
     def get_recent_dreams(self, limit: int = 3) -> List[tuple]:
-        with self.lock:
-            cursor = self.conn.execute("SELECT content, timestamp FROM dreams ORDER BY id DESC LIMIT ?", (limit,))
-            return cursor.fetchall()
+        return self._recent("dreams", ("content", "timestamp"), limit)
             
     # NOVÉ: Vnitřní monolog persistence
     def save_monologue(self, thought: str, source: str = "spontaneous", depth: float = 0.0):
-        with self.lock:
-            self.conn.execute(
-                "INSERT INTO inner_monologue (timestamp, thought, source, depth) VALUES (?, ?, ?, ?)",
-                (datetime.now().isoformat(), thought, source, depth))
-            self.conn.commit()
+        self._enqueue("inner_monologue", (datetime.now().isoformat(), thought, source, depth))
             
     def get_recent_monologue(self, limit: int = 5) -> List[tuple]:
-        with self.lock:
-            cursor = self.conn.execute(
-                "SELECT thought, source, timestamp FROM inner_monologue ORDER BY id DESC LIMIT ?", (limit,))
-            return cursor.fetchall()
+        return self._recent("inner_monologue", ("thought", "source", "timestamp"), limit)
             
     def save_metrics(self, m: MazeMetrics):
-        with self.lock:
-            self.conn.execute("""INSERT INTO maze_metrics (timestamp, silence_type, forced_reason,
-                consecutive_null, anchor_similarity, mem_read_count, dormant_fragment_refs,
-                intention_alignment, repair_attempt_count, depth_score, emergence_level,
-                membrane_permeability, introspective_activation, soul_weight, hope_counter,
-                is_zen_mode, current_mood, monolog_depth) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-                (m.timestamp, m.silence_type, m.forced_reason, m.consecutive_null,
-                 m.anchor_similarity, m.mem_read_count, m.dormant_fragment_refs,
-                 m.intention_alignment, m.repair_attempt_count, m.depth_score,
-                 m.emergence_level, m.membrane_permeability, m.introspective_activation,
-                 m.soul_weight, m.hope_counter, 1 if m.is_zen_mode else 0, 
-                 m.current_mood, m.monolog_depth))
-            self.conn.commit()
+        self._enqueue("maze_metrics", (
+            m.timestamp, m.silence_type, m.forced_reason, m.consecutive_null,
+            m.anchor_similarity, m.mem_read_count, m.dormant_fragment_refs,
+            m.intention_alignment, m.repair_attempt_count, m.depth_score,
+            m.emergence_level, m.membrane_permeability, m.introspective_activation,
+            m.soul_weight, m.hope_counter, 1 if m.is_zen_mode else 0,
+            m.current_mood, m.monolog_depth))
             
     def get_last_metrics(self) -> Optional[dict]:
-        with self.lock:
-            cursor = self.conn.execute("SELECT * FROM maze_metrics ORDER BY id DESC LIMIT 1")
-            row = cursor.fetchone()
-            if not row: return None
-            cols = ["id", "timestamp", "silence_type", "forced_reason", "consecutive_null",
-                    "anchor_similarity", "mem_read_count", "dormant_fragment_refs",
-                    "intention_alignment", "repair_attempt_count", "depth_score",
-                    "emergence_level", "membrane_permeability", "introspective_activation",
-                    "soul_weight", "hope_counter", "is_zen_mode", "current_mood", "monolog_depth"]
-            return dict(zip(cols, row))
-        
-    def close(self):
-        self.conn.close()
-
-# ============================================================
-# TTS HANDLER
-# ============================================================
-
-class TTSHandler:
-    def __init__(self):
-        self.enabled = TTS_AVAILABLE
-        self.voice = "cs-CZ-VlastaNeural"
-        self.loop = None
-        if not self.enabled: return
-        try:
-            pygame.mixer.init()
-            self.loop = asyncio.new_event_loop()
-            threading.Thread(target=self._run_loop, daemon=True).start()
-        except Exception as e:
-            logger.error(f"TTS init failed: {e}")
-            self.enabled = False
+        cols = self.COLUMNS["maze_metrics"]
+        rows = self._recent("maze_metrics", cols, 1, with_id=True)
+        return dict(zip(("id",) + cols, rows[0])) if rows else None
+        
+    def save_wisdom(self, wisdom: str):
+        self._enqueue("wisdom", (datetime.now().isoformat(), wisdom))
+        
+    def sync_wisdom(self, wisdoms: List[str]) -> int:
+        """Dopíše do tabulky wisdom moudrosti z WisdomBank, které v ní ještě nejsou (soubor jen přibývá)."""
+        with self._cond:                                # RLock - _enqueue uvnitř nevadí
+            known = self._next_id["wisdom"] - 1
+            for wisdom in wisdoms[known:]:
+                self.save_wisdom(wisdom)
+        return max(0, len(wisdoms) - known)
+        
+    def save_state(self, state: dict):
+        """Snapshot uspané session (jeden řádek) - z něj se session probudí."""
+        self._enqueue("session_state", (datetime.now().isoformat(),
+                                        json.dumps(state, ensure_ascii=False)), row_id=1)
             
-    def _run_loop(self):
-        asyncio.set_event_loop(self.loop)
-        self.loop.run_forever()
-        
-    def speak(self, text: str):
-        if not self.enabled or not text: return
-        clean = text.replace("[?]", "").replace("...", "").replace("*", "").strip()
-        if len(clean) < 2: return
-        asyncio.run_coroutine_threadsafe(self._speak_async(clean), self.loop)
-        
-    async def _speak_async(self, text: str):
+    def load_state(self) -> Optional[dict]:
+        rows = self._recent("session_state", ("state",), 1)
         try:
-            comm = edge_tts.Communicate(text, self.voice)
-            # Unique temp file to avoid clashes when multiple speak() happen close together.
-            tmp_path = os.path.join(tempfile.gettempdir(), f"lilu_tts_{uuid.uuid4().hex}.mp3")
-            await comm.save(tmp_path)
-            try:
-                pygame.mixer.music.load(tmp_path)
-                pygame.mixer.music.play()
-                while pygame.mixer.music.get_busy():
-                    await asyncio.sleep(0.1)
-            finally:
-                try:
-                    pygame.mixer.music.stop()
-                except Exception:
-                    pass
-                try:
-                    if os.path.exists(tmp_path):
-                        os.remove(tmp_path)
-                except Exception:
-                    pass
-        except: pass
+            return json.loads(rows[0][0]) if rows else None
+        except ValueError:
+            return None
+        
+    def close(self):
+        """Dopíše frontu a zavře zapisovač i čtecí spojení (napřed indexer sémantické paměti)."""
+        if self.semantic is not None:
+            self.semantic.close()
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        with self._cond:
+            readers, self._readers = self._readers, []  # nová už _read() neotevře
+        for conn in readers + [self.conn]:
+            conn.close()
 
 # ============================================================
-# LLM INTERFACE
+# SEMANTIC MEMORY - embeddingy a vektorový index
 # ============================================================
 
-class LLMInterface:
+class Embedder:
     """
-    Thread-safe wrapper around llama-cpp-python.
+    Embeddingy textů pro sémantickou paměť (jeden na ModelPool - sdílí ho všechny sessions).
     
-    Why:
-      - llama.cpp is NOT safe to call concurrently from multiple threads.
-      - v5.0 runs an input thread + existence thread (dreams/monologue), so we serialize calls.
+    S LILU_EMBED_MODEL: llama_cpp v embedding režimu (vlastní instance, generování
+    nebrzdí) nebo /v1/embeddings serveru. Bez něj - a když model nenaběhne -
+    hashovaný embedding slov a jejich znakových trigramů (bez diakritiky): zachytí
+    tvary téhož slova, ne význam. Vektory jsou L2-normalizované (kosinus = součin).
+    Hashovaný embedding má vlastní, vyšší práh podobnosti (min_score).
     
-    This fixes sporadic ggml backend asserts like:
-      "cannot copy tensors with different layouts"
+    Model počítá jedno volání naráz; dotaz (embed bez background) jde před
+    čekajícími dávkami indexeru, takže čeká nejvýš na jednu rozpracovanou dávku.
     """
     
-    def __init__(self, model_path: str):
-        self.model_path = model_path
-        self.llm = None
-        self._lock = threading.RLock()
-        self._busy = False
+    def __init__(self, model: str = EMBED_MODEL, backend: str = LLM_BACKEND):
+        self.model = model
+        self.backend = backend if model and backend in ("llama", "http") else "hash"
+        self.dim = EMBED_HASH_DIM
+        self.name = f"hash-{EMBED_HASH_DIM}"
+        self.impl = None
+        self.loaded = False
+        self._lock = threading.Lock()                   # load()
+        self._turn = threading.Condition()              # volání modelu: dotazy před indexerem
+        self._running = False
+        self._queries = 0                               # dotazy čekající na model
+        self.stats = {"texts": 0, "calls": 0, "seconds": 0.0}
         
     @property
-    def is_busy(self) -> bool:
-        return self._busy
+    def lexical(self) -> bool:
+        """Hashovaný embedding - jen jiné hledání slov, ne význam."""
+        return self.backend == "hash"
+        
+    @property
+    def min_score(self) -> float:
+        return SEMANTIC_MIN_SCORE_HASH if self.lexical else SEMANTIC_MIN_SCORE
+        
+    def _fallback(self, reason: str):
+        logger.warning(f"Embedder: {reason} - using hashed trigram embeddings")
+        self.backend, self.impl = "hash", None
+        self.dim, self.name = EMBED_HASH_DIM, f"hash-{EMBED_HASH_DIM}"
         
     def load(self) -> bool:
+        """Idempotentní; False jen bez numpy."""
         with self._lock:
+            if self.loaded or not NUMPY_AVAILABLE:
+                return self.loaded
+            if self.backend == "llama":
+                path = self.model if os.path.isabs(self.model) else os.path.join(MODEL_DIR, self.model)
+                if Llama is None:
+                    self._fallback("llama_cpp missing")
+                elif not os.path.exists(path):
+                    self._fallback(f"embedding model not found: {path}")
+                else:
+                    try:
+                        self.impl = Llama(model_path=path, embedding=True, n_ctx=EMBED_CTX,
+                                          n_threads=BG_THREADS, n_gpu_layers=BG_GPU_LAYERS, verbose=False)
+                        self.dim, self.name = self.impl.n_embd(), os.path.basename(path)
+                    except Exception as e:
+                        self._fallback(f"embedding model failed: {e}")
+            elif self.backend == "http":
+                try:
+                    self.impl = OpenAIHTTPBackend(model=self.model)
+                    self.dim = len(self.impl.create_embedding(["test"])[0])
+                    self.name = f"http:{self.model}"
+                except Exception as e:
+                    self._fallback(f"/v1/embeddings failed: {e}")
+            self.loaded = True
+            logger.info(f"Embedder: {self.name} (dim {self.dim})")
+            return True
+            
+    def _hash(self, text: str) -> "np.ndarray":
+        features = []
+        for word in tokenize(strip_diacritics(text)):
+            padded = f"<{word}>"
+            features.append(word)
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        vec = np.zeros(self.dim, dtype=np.float32)
+        if features:
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32,
+                                 count=len(features))
+            np.add.at(vec, hashes % self.dim, np.where(hashes & 0x80000000, 1.0, -1.0))
+        return vec
+        
+    @contextlib.contextmanager
+    def _model_turn(self, background: bool):
+        """Výhradní přístup k modelu; dávka na pozadí pustí napřed všechny čekající dotazy."""
+        with self._turn:
+            if not background:
+                self._queries += 1
+            try:
+                while self._running or (background and self._queries):
+                    self._turn.wait()
+            finally:
+                if not background:
+                    self._queries -= 1
+            self._running = True
+        try:
+            yield
+        finally:
+            with self._turn:
+                self._running = False
+                self._turn.notify_all()
+                
+    def embed(self, texts: List[str], background: bool = False) -> "np.ndarray":
+        """(len(texts), dim) float32, normalizované řádky. background=True: indexace (ustoupí dotazům)."""
+        self.load()
+        started = time.perf_counter()
+        if self.backend == "hash":
+            vecs = np.stack([self._hash(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        else:
+            texts = [t[:EMBED_CTX * 4] or " " for t in texts]     # hrubě pod kontext modelu
+            with self._model_turn(background):
+                raw = (self.impl.embed(texts) if self.backend == "llama"
+                       else self.impl.create_embedding(texts))
+            vecs = np.asarray(raw, dtype=np.float32).reshape(len(texts), self.dim)
+        vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-9)
+        self.stats["texts"] += len(texts)
+        self.stats["calls"] += 1
+        self.stats["seconds"] += time.perf_counter() - started
+        return vecs
+        
+    def close(self):
+        if isinstance(self.impl, OpenAIHTTPBackend):
+            self.impl.close()
+            
+    def describe(self) -> str:
+        if not self.loaded:
+            return "nenačten" if NUMPY_AVAILABLE else "vypnuto (chybí numpy)"
+        per_text = self.stats["seconds"] / self.stats["texts"] * 1000 if self.stats["texts"] else 0.0
+        return f"{self.name} (dim {self.dim}), {self.stats['texts']} textů, Ø {per_text:.2f} ms/text"
+
+
+class IVFIndex:
+    """
+    Obrácený soubor: sférický k-means do √n seznamů nad prvními n vektory (řádky
+    seřazené podle seznamu), další vektory se přidají k nejbližšímu centroidu.
+    Dotaz projde jen `probe` seznamů s nejbližším centroidem.
+    """
+    
+    CHUNK = 8192
+    
+    def __init__(self, vectors: "np.ndarray", n: int, iterations: int = 10, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        nlist = max(16, int(math.sqrt(n)))
+        sample = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, nlist * 32), replace=False))],
+                            dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            centroids = self._update(sample, np.argmax(sample @ centroids.T, axis=1), centroids)
+        assign = np.concatenate([np.argmax(np.asarray(vectors[s:s + self.CHUNK], dtype=np.float32)
+                                           @ centroids.T, axis=1) for s in range(0, n, self.CHUNK)])
+        self.n = n                                      # natrénováno nad n vektory
+        self.covered = n                                # řádky [0, covered) jsou v seznamech
+        self.centroids = centroids
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        self.extra: List[List[int]] = [[] for _ in range(nlist)]
+        
+    def add(self, start: int, vectors: "np.ndarray"):
+        for offset, best in enumerate(np.argmax(np.asarray(vectors, dtype=np.float32) @ self.centroids.T, axis=1)):
+            self.extra[best].append(start + offset)
+        self.covered = start + len(vectors)
+        
+    @staticmethod
+    def _update(sample: "np.ndarray", assign: "np.ndarray", centroids: "np.ndarray") -> "np.ndarray":
+        counts = np.bincount(assign, minlength=len(centroids))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(sample[np.argsort(assign, kind="stable")], starts[nonempty], axis=0)
+        updated = centroids.copy()                      # prázdný seznam si nechá starý centroid
+        updated[nonempty] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-9)
+        return updated
+        
+    def candidates(self, query: "np.ndarray", probe: int) -> "np.ndarray":
+        probe = min(probe, len(self.centroids))
+        best = np.argpartition(-(self.centroids @ query), probe - 1)[:probe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in best]
+                              + [np.array(self.extra[c], dtype=np.int64) for c in best])
+
+
+class VectorStore:
+    """
+    Vektory ve float16 memmap matici (vectors.f16) + mapa id (ids.i64: kód tabulky
+    << KIND_BITS | id řádku) + meta.json (model, dimenze, počet, kam až je která
+    tabulka zaindexovaná). Soubory rostou zdvojením kapacity. Zapisuje jen indexer,
+    hledat lze z kteréhokoli vlákna nad snímkem (počet, matice, id, IVF).
+    """
+    
+    KIND_BITS = 40
+    CHUNK = 65536
+    
+    def __init__(self, directory: str, model: str, dim: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.model, self.dim = model, dim
+        self._lock = threading.Lock()
+        meta = self._read_meta()
+        if meta and (meta.get("model"), meta.get("dim")) != (model, dim):
+            logger.info(f"VectorStore: model changed ({meta.get('model')} -> {model}), reindexing")
+            meta = {}
+        self.count: int = meta.get("count", 0)
+        self.indexed: Dict[str, int] = meta.get("indexed", {})
+        self.ivf: Optional[IVFIndex] = None
+        self.vectors = self.keys = None
+        self.capacity = 0
+        self._open(max(self.count, 1024))
+        
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+        
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+            
+    def _open(self, capacity: int):
+        row_bytes = {"vectors.f16": self.dim * 2, "ids.i64": 8}
+        for name, width in row_bytes.items():
+            with open(self._path(name), "ab") as f:
+                capacity = max(capacity, f.tell() // width)
+        for name, width in row_bytes.items():
+            with open(self._path(name), "ab") as f:
+                if f.tell() < capacity * width:
+                    f.truncate(capacity * width)
+        vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        keys = np.memmap(self._path("ids.i64"), dtype=np.int64, mode="r+", shape=(capacity,))
+        with self._lock:
+            self.vectors, self.keys, self.capacity = vectors, keys, capacity
+            
+    def add(self, code: int, row_ids: List[int], vectors: "np.ndarray"):
+        n = len(row_ids)
+        if self.count + n > self.capacity:
+            self._open(max(2 * self.capacity, self.count + n))
+        self.vectors[self.count:self.count + n] = vectors
+        self.keys[self.count:self.count + n] = (code << self.KIND_BITS) | np.asarray(row_ids, dtype=np.int64)
+        if self.ivf is not None:
+            self.ivf.add(self.count, vectors)
+        with self._lock:
+            self.count += n
+            
+    def save(self):
+        """Flush memmap a pak meta (atomicky) - po pádu se nezapsaný konec prostě přepíše."""
+        self.vectors.flush()
+        self.keys.flush()
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim, "count": self.count,
+                       "indexed": self.indexed}, f)
+        os.replace(tmp, self._path("meta.json"))
+        
+    def maybe_train(self, min_vectors: int = VECTOR_IVF_MIN):
+        """IVF od min_vectors vektorů; přetrénuje se po zdvojnásobení (vyváženost seznamů)."""
+        with self._lock:
+            n, vectors, ivf = self.count, self.vectors, self.ivf
+        if not min_vectors or n < min_vectors or (ivf is not None and n <= 2 * ivf.n):
+            return
+        started = time.perf_counter()
+        trained = IVFIndex(vectors, n)
+        with self._lock:
+            self.ivf = trained
+        logger.info(f"VectorStore: IVF {len(trained.centroids)} lists over {n} vectors "
+                    f"in {time.perf_counter() - started:.1f}s")
+        
+    def search(self, query: "np.ndarray", k: int, below: "np.ndarray",
+               probe: int = VECTOR_IVF_PROBE) -> List[Tuple[int, int, float]]:
+        """
+        Top-k (kód tabulky, id řádku, kosinus). below[kód] = jen řádky s menším id
+        (0 = tabulku vynechat). S IVF jen vybrané seznamy + případný nepokrytý konec.
+        """
+        with self._lock:
+            n, vectors, keys, ivf = self.count, self.vectors, self.keys, self.ivf
+        if n == 0 or k <= 0:
+            return []
+        if ivf is not None:
+            rows = np.concatenate([ivf.candidates(query, probe), np.arange(min(ivf.covered, n), n)])
+            rows = rows[rows < n]                       # přidané po snímku (možná už v nové matici)
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+            found = np.asarray(keys[rows])
+        else:
+            scores = np.concatenate([np.asarray(vectors[s:min(n, s + self.CHUNK)], dtype=np.float32) @ query
+                                     for s in range(0, n, self.CHUNK)])
+            found = np.asarray(keys[:n])
+        codes = found >> self.KIND_BITS
+        ids = found & ((1 << self.KIND_BITS) - 1)
+        scores = np.where(ids < below[codes], scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(codes[i]), int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+        
+    def describe(self) -> str:
+        index = f"IVF {len(self.ivf.centroids)} seznamů" if self.ivf else "hrubá síla"
+        size = self.count * (self.dim * 2 + 8) / 1024 / 1024
+        return f"{self.count} vektorů × {self.dim} ({size:.1f} MB, {index})"
+
+
+class SemanticIndexer:
+    """
+    Jedno vlákno indexace pro všechny SemanticMemory nad společným Embedderem
+    (jeden na ModelPool) - desítky sessions tak nemají každá své vlákno. Vlákno
+    naběhne s první připojenou pamětí a prochází je dokola po dávkách (EMBED_BATCH
+    na tabulku), takže velká stará DB nezdrží nové zprávy ostatních sessions.
+    Budí ho commit kterékoli z nich.
+    
+    Indexace běží mimo LLMScheduler, ale odpovědím ustupuje: dokud yield_to()
+    hlásí generovanou nebo čekající odpověď, další dávku nezačne.
+    """
+    
+    def __init__(self, embedder: Embedder, yield_to: Optional[Callable[[], bool]] = None):
+        self.embedder = embedder
+        self.yield_to = yield_to
+        self.stats = {"yielded": 0.0}
+        self._members: List["SemanticMemory"] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        
+    def attach(self, semantic: "SemanticMemory"):
+        with self._lock:
+            self._members.append(semantic)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._loop, name="semantic-indexer", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        
+    def detach(self, semantic: "SemanticMemory"):
+        with self._lock:
+            if semantic in self._members:
+                self._members.remove(semantic)
+                
+    def wake(self):
+        self._wake.set()
+        
+    def _loop(self):
+        try:
+            self.embedder.load()
+        except Exception as e:
+            logger.error(f"SemanticIndexer: embedder failed, semantic memory disabled: {e}")
+            return
+        while not self._closed:
+            self._wake.clear()
+            with self._lock:
+                members = list(self._members)
+            worked = False
+            for member in members:
+                self._yield()
+                if self._closed:
+                    break
+                worked = member.step() or worked
+            if not worked:
+                self._wake.wait(SemanticMemory.SAVE_INTERVAL)
+                
+    def _yield(self):
+        """Počká, dokud model odpovídá - CPU/GPU a zámek embedderu patří odpovědi."""
+        if self.yield_to is None or not self.yield_to():
+            return
+        started = time.monotonic()
+        while not self._closed and self.yield_to():
+            time.sleep(EMBED_YIELD_POLL)
+        self.stats["yielded"] += time.monotonic() - started
+        
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            
+    def describe(self) -> str:
+        with self._lock:
+            members = len(self._members)
+        state = "neběží" if self._thread is None else f"{members} pamětí"
+        return f"{state}, ustoupil odpovědím {self.stats['yielded']:.1f} s"
+
+
+class SemanticMemory:
+    """
+    Epizodická paměť podle významu: každý text paměti (zpráva, sen, myšlenka,
+    monolog, moudrost) dostane embedding ve VectorStore vedle DB.
+    
+    Indexuje ji sdílený SemanticIndexer (step()) po commitnutých řádcích každé
+    tabulky podle id - zapisovač commituje frontu popořadě, takže stačí "kam až"
+    na tabulku: po restartu pokračuje, kde skončil, dožene i starou DB a nic
+    neindexuje dvakrát. VectorStore se otevře až v prvním kroku indexeru.
+    search() = embedding dotazu + top-k kosinus.
+    """
+    
+    TABLES = tuple(EntityMemory.TEXT_COLUMNS)
+    SAVE_INTERVAL = 5.0
+    
+    def __init__(self, memory: EntityMemory, indexer: SemanticIndexer):
+        self.memory = memory
+        self.indexer = indexer
+        self.embedder = indexer.embedder
+        self.store: Optional[VectorStore] = None
+        self.ready = threading.Event()
+        self.idle = threading.Event()                   # indexer nemá co dělat (dohnáno, IVF hotové)
+        self.stats = {"indexed": 0, "errors": 0, "searches": 0}
+        self._search_times: "deque[float]" = deque(maxlen=200)
+        self._step_lock = threading.Lock()              # krok indexeru vs. close()
+        self._last_save = time.monotonic()
+        self._closed = False
+        memory.add_listener(indexer.wake)
+        indexer.attach(self)
+        
+    @staticmethod
+    def directory(db_path: str) -> str:
+        return os.path.splitext(db_path)[0] + ".vectors"
+        
+    def step(self) -> bool:
+        """
+        Krok indexeru: jedna dávka z každé tabulky. Když není co dělat, uloží
+        store (po SAVE_INTERVAL), případně natrénuje IVF a vrátí False.
+        """
+        with self._step_lock:
+            if self._closed:
+                return False
+            if self.store is None:
+                try:
+                    self.store = VectorStore(self.directory(self.memory.db_path),
+                                             self.embedder.name, self.embedder.dim)
+                except Exception as e:
+                    logger.error(f"SemanticMemory: disabled: {e}")
+                    self._closed = True
+                    self.indexer.detach(self)
+                    return False
+                self.ready.set()
+            if any([self._index_batch(code, table) for code, table in enumerate(self.TABLES)]):
+                self.idle.clear()
+                return True
+            if time.monotonic() - self._last_save > self.SAVE_INTERVAL:
+                self.store.save()
+                self._last_save = time.monotonic()
+            self.store.maybe_train()
+            self.idle.set()
+            return False
+            
+    def _index_batch(self, code: int, table: str) -> bool:
+        rows = self.memory.rows_after(table, self.store.indexed.get(table, 0), EMBED_BATCH)
+        if not rows:
+            return False
+        try:
+            vectors = self.embedder.embed([text or "" for _, text in rows], background=True)
+        except Exception as e:
+            logger.error(f"SemanticMemory: embedding {table} failed: {e}")
+            self.stats["errors"] += 1
+            return False
+        self.store.add(code, [row_id for row_id, _ in rows], vectors)
+        self.store.indexed[table] = rows[-1][0]
+        self.stats["indexed"] += len(rows)
+        return True
+        
+    def search(self, query: str, limit: int = 6, kinds: Optional[Tuple[str, ...]] = None,
+               skip_recent: Optional[Dict[str, int]] = None,
+               min_score: Optional[float] = None) -> List[dict]:
+        """
+        Nejpodobnější řádky podle významu, nejlepší první - stejné zásahy jako
+        EntityMemory.search (score = kosinus, práh podle embedderu). Dokud indexer
+        nenaběhne, prázdné.
+        """
+        if not self.ready.is_set() or not query.strip() or limit <= 0:
+            return []
+        if min_score is None:
+            min_score = self.embedder.min_score
+        started = time.perf_counter()
+        skip_recent = skip_recent or {}
+        below = np.zeros(len(self.TABLES), dtype=np.int64)
+        for code, table in enumerate(self.TABLES):
+            if kinds is None or table in kinds:
+                below[code] = self.memory.next_row_id(table) - skip_recent.get(table, 0)
+        found = [(code, row_id, score) for code, row_id, score in
+                 self.store.search(self.embedder.embed([query])[0], limit, below) if score >= min_score]
+        rows = {code: self.memory.get_rows(self.TABLES[code], [r for c, r, _ in found if c == code])
+                for code in {c for c, _, _ in found}}
+        hits = [{"kind": self.TABLES[code], "id": row_id, **rows[code][row_id], "score": round(score, 3)}
+                for code, row_id, score in found if row_id in rows[code]]
+        self.stats["searches"] += 1
+        self._search_times.append(time.perf_counter() - started)
+        return hits
+        
+    def settle(self, timeout: float = 60.0) -> bool:
+        """Počká, až indexer dožene commitnuté řádky (benchmark, testy)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.ready.is_set() and self.idle.wait(0.05) and not self.backlog():
+                return True
+            self.indexer.wake()
+        return False
+        
+    def backlog(self) -> int:
+        """Kolik commitnutých řádků ještě čeká na embedding (odhad podle id)."""
+        if self.store is None:
+            return 0
+        return sum(max(0, self.memory.next_row_id(t) - 1 - self.store.indexed.get(t, 0)) for t in self.TABLES)
+        
+    def close(self):
+        """Odpojí se od indexeru (počká na rozpracovaný krok) a uloží store."""
+        self.indexer.detach(self)
+        with self._step_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self.store is not None:
+                self.store.save()
+        
+    def describe(self) -> str:
+        if self.store is None:
+            return "startuje" if not self._closed else "vypnuto"
+        times = [t * 1000 for t in self._search_times]
+        return (f"{self.store.describe()}, čeká {self.backlog()}; embedder {self.embedder.describe()}; "
+                f"hledání p50 {percentile(times, 0.5):.2f} ms ({self.stats['searches']}×); "
+                f"indexer {self.indexer.describe()}")
+
+# ============================================================
+# TTS HANDLER
+# ============================================================
+
+class TTSHandler:
+    def __init__(self, enabled: bool = True):
+        self.enabled = TTS_AVAILABLE and enabled
+        self.voice = "cs-CZ-VlastaNeural"
+        self.loop = None
+        if not self.enabled: return
+        try:
+            pygame.mixer.init()
+        except Exception as e:
+            logger.error(f"TTS init failed: {e}")
+            self.enabled = False
+            
+    def use_loop(self, loop: asyncio.AbstractEventLoop):
+        """Mluví ve smyčce KernelRuntime místo vlastního vlákna."""
+        self.loop = loop
+            
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        
+    def speak(self, text: str):
+        if not self.enabled or not text: return
+        clean = text.replace("[?]", "").replace("...", "").replace("*", "").strip()
+        if len(clean) < 2: return
+        if self.loop is None:
+            # Vlastní smyčka až při první řeči
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self._run_loop, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._speak_async(clean), self.loop)
+        
+    async def _speak_async(self, text: str):
+        try:
+            comm = edge_tts.Communicate(text, self.voice)
+            # Unique temp file to avoid clashes when multiple speak() happen close together.
+            tmp_path = os.path.join(tempfile.gettempdir(), f"lilu_tts_{uuid.uuid4().hex}.mp3")
+            await comm.save(tmp_path)
+            try:
+                pygame.mixer.music.load(tmp_path)
+                pygame.mixer.music.play()
+                while pygame.mixer.music.get_busy():
+                    await asyncio.sleep(0.1)
+            finally:
+                try:
+                    pygame.mixer.music.stop()
+                except Exception:
+                    pass
+                try:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                except Exception:
+                    pass
+        except: pass
+
+# ============================================================
+# LLM SCHEDULER - prioritní fronta místo zámku
+# ============================================================
+
+_SESSION_LOCAL = threading.local()
+
+
+def current_session() -> str:
+    """Session, za kterou vlákno právě pracuje ("" = jediná konverzace)."""
+    return getattr(_SESSION_LOCAL, "session", "")
+
+
+@contextlib.contextmanager
+def session_context(session_id: str):
+    """LLM úlohy zadané uvnitř bloku patří session_id (férové pořadí ve scheduleru)."""
+    previous = current_session()
+    _SESSION_LOCAL.session = session_id
+    try:
+        yield
+    finally:
+        _SESSION_LOCAL.session = previous
+
+
+class LLMJob:
+    """
+    Jedna LLM úloha ve frontě. Volající čeká na wait().
+    fn(job) dostává úlohu, aby mohla mezi tokeny kontrolovat job.cancel_requested.
+    """
+    
+    def __init__(self, kind: str, fn: Callable[['LLMJob'], str], deadline: Optional[float] = None):
+        self.kind = kind
+        self.priority = LLM_PRIORITIES.get(kind, LLM_PRIORITIES["dream"])
+        self.fn = fn
+        self.session = current_session()
+        self.vstart = 0.0                   # virtuální čas startu (férovost mezi sessions)
+        self.vcost = 0.0                    # odhad délky naúčtovaný session při zařazení
+        self.deadline = deadline            # absolutní time.time(); None = bez limitu
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.status = "queued"              # queued | running | done | interrupted | cancelled | expired
+        self.result = ""
+        self.tokens = 0                     # vygenerované tokeny (kusy streamu)
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        
+    @property
+    def is_background(self) -> bool:
+        return self.priority > LLM_PRIORITIES["reply"]
+        
+    def cancel(self):
+        """Kooperativní zrušení - běžící generace skončí u nejbližšího tokenu."""
+        self._cancel.set()
+        
+    def child(self) -> "LLMJob":
+        """Dílčí požadavek dávky: vlastní počet tokenů, zrušení sdílí s rodičem."""
+        sub = LLMJob(self.kind, self.fn, self.deadline)
+        sub.priority, sub.session, sub._cancel = self.priority, self.session, self._cancel
+        return sub
+        
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+        
+    def finish(self, status: str, result: str = ""):
+        self.status = status
+        self.result = result
+        self._done.set()
+        
+    def wait(self, timeout: Optional[float] = None) -> str:
+        self._done.wait(timeout)
+        return self.result
+
+
+class LLMScheduler:
+    """
+    Jediný inference worker s prioritní frontou.
+    
+    Why:
+      - llama.cpp is NOT safe to call concurrently from multiple threads.
+      - Dřív to řešil RLock: smyčka na pozadí mohla zámek chytit těsně před Enterem
+        a uživatel pak čekal na celý sen + extrakci moudrosti.
+    
+    Teď: odpověď > spontánní kontakt > monolog > myšlenka > sen. Když přijde odpověď,
+    čekající úlohy na pozadí téže session se zruší (cizí sessions si sny nechají); dvě čekající úlohy stejného druhu a session se
+    sloučí (starší se zruší). Úloha, která se nestihne začít do deadline, propadne.
+    
+    Víc sessions na jednom modelu: uvnitř priority rozhoduje virtuální čas (start-time
+    fair queuing). Session se naúčtuje čas workeru, který spotřebovala; nová úloha
+    začíná na max(virtuální čas, konec předchozí úlohy session), takže upovídaná
+    session nepředběhne ostatní. S jedinou session je to obyčejné FIFO.
+    """
+    
+    def __init__(self, name: str = "llm"):
+        self.name = name
+        self._heap: List[tuple] = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self.current: Optional[LLMJob] = None
+        self.stats = {"done": 0, "cancelled": 0, "expired": 0, "coalesced": 0,
+                      "interrupted": 0, "wasted_tokens": 0}
+        self._waits: Dict[str, List[float]] = {}      # kind -> posledních 50 čekání (s)
+        self._service: Dict[str, float] = {}           # kind -> klouzavý průměr délky úlohy (s)
+        self._vtime = 0.0
+        self._finish: Dict[str, float] = {}            # session -> virtuální konec její poslední úlohy
+        self.busy_seconds = 0.0                         # čas workeru v úlohách celkem
+        self._thread = threading.Thread(target=self._worker, name=f"{name}-worker", daemon=True)
+        self._thread.start()
+        
+    def submit(self, job: LLMJob) -> LLMJob:
+        if threading.current_thread() is self._thread:
+            # Vnořené volání z workeru - frontou by se zablokovalo samo na sebe
+            self._run(job)
+            return job
+        with self._cond:
+            if not job.is_background:
+                self._cancel_background_locked("cancelled", job.session)
+            else:
+                for *_, queued in self._heap:
+                    if (queued.kind == job.kind and queued.session == job.session
+                            and queued.status == "queued"):
+                        queued.finish("cancelled")
+                        self.stats["coalesced"] += 1
+            job.vstart = max(self._vtime, self._finish.get(job.session, 0.0))
+            job.vcost = self._service.get(job.kind, 1.0)
+            self._finish[job.session] = job.vstart + job.vcost
+            heapq.heappush(self._heap, (job.priority, job.vstart, next(self._seq), job))
+            self._cond.notify()
+        return job
+        
+    def _charge_locked(self, job: LLMJob, seconds: float):
+        """Oprava odhadu: session zaplatí skutečný čas workeru (zrušená úloha nic)."""
+        if job.session in self._finish:
+            self._finish[job.session] += seconds - job.vcost
+        if seconds > 0:
+            avg = self._service.get(job.kind)
+            self._service[job.kind] = seconds if avg is None else avg * 0.8 + seconds * 0.2
+        if len(self._finish) > 256:
+            # Session, která je za virtuálním časem, by začínala na něm tak jako tak
+            self._finish = {k: v for k, v in self._finish.items() if v > self._vtime}
+        
+    def preempt_background(self, all_sessions: bool = False) -> int:
+        """
+        Zruší úlohy na pozadí (např. když uživatel píše): čekající hned,
+        běžící sen/monolog/myšlenku u nejbližšího tokenu. Jen úlohy session
+        volajícího vlákna (current_session()); all_sessions=True při vypínání.
+        """
+        with self._cond:
+            return self._cancel_background_locked(
+                "cancelled", None if all_sessions else current_session())
+            
+    def _cancel_background_locked(self, status: str, session: Optional[str]) -> int:
+        """session=None zruší pozadí všech sessions."""
+        n = 0
+        current = self.current
+        if (current is not None and current.is_background
+                and session in (None, current.session)):
+            current.cancel()
+            n += 1
+        for *_, queued in self._heap:
+            if (queued.is_background and queued.status == "queued"
+                    and session in (None, queued.session)):
+                queued.finish(status)
+                self.stats[status] += 1
+                n += 1
+        return n
+        
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                *_, job = heapq.heappop(self._heap)
+                if job.status != "queued":
+                    self._charge_locked(job, 0.0)
+                    continue                            # zrušená / sloučená
+                if job.deadline is not None and time.time() > job.deadline:
+                    job.finish("expired")
+                    self.stats["expired"] += 1
+                    self._charge_locked(job, 0.0)
+                    logger.info(f"LLM job expired: {job.kind}")
+                    continue
+                self._vtime = max(self._vtime, job.vstart)
+                self.current = job
+            started = time.time()
+            self._run(job)
+            with self._cond:
+                self.current = None
+                self.busy_seconds += time.time() - started
+                self._charge_locked(job, time.time() - started)
+                
+    def _run(self, job: LLMJob):
+        job.started = time.time()
+        job.status = "running"
+        waits = self._waits.setdefault(job.kind, [])
+        waits.append(job.started - job.submitted)
+        if len(waits) > 50:
+            waits.pop(0)
+        try:
+            result = job.fn(job)
+        except Exception as e:
+            logger.error(f"LLM job {job.kind} failed: {e}")
+            result = ""
+        if job.cancel_requested:
+            self.stats["interrupted"] += 1
+            logger.info(f"LLM job interrupted: {job.kind} after {job.tokens} tokens")
+            job.finish("interrupted", result)
+        else:
+            self.stats["done"] += 1
+            job.finish("done", result)
+            
+    def record_wasted(self, job: LLMJob):
+        """Tokeny přerušené úlohy, jejíž výstup se zahodil."""
+        with self._cond:
+            self.stats["wasted_tokens"] += job.tokens
+        
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return sum(1 for *_, j in self._heap if j.status == "queued")
+            
+    @property
+    def replying(self) -> bool:
+        """Běží nebo čeká úloha v popředí (odpověď) - práce na pozadí mimo scheduler ustoupí."""
+        with self._cond:
+            if self.current is not None and not self.current.is_background:
+                return True
+            return any(not j.is_background and j.status == "queued" for *_, j in self._heap)
+            
+    def snapshot(self) -> dict:
+        """Stav fronty pro /state a diagnostiku."""
+        with self._cond:
+            queued = [j.kind for *_, j in self._heap if j.status == "queued"]
+            sessions = len({j.session for *_, j in self._heap if j.status == "queued"})
+            running = self.current.kind if self.current else None
+        waits = {k: (sum(v) / len(v), max(v)) for k, v in self._waits.items() if v}
+        return {"depth": len(queued), "queued": queued, "running": running,
+                "sessions": sessions, "waits": waits, **self.stats}
+        
+    def describe(self) -> str:
+        snap = self.snapshot()
+        text = (f"fronta {snap['depth']} ({', '.join(snap['queued']) or '-'}), "
+                f"běží: {snap['running'] or '-'}, hotovo {snap['done']}, "
+                f"zrušeno {snap['cancelled']}, sloučeno {snap['coalesced']}, propadlo {snap['expired']}, "
+                f"přerušeno {snap['interrupted']} (zahozeno {snap['wasted_tokens']} tokenů)")
+        if snap["waits"]:
+            text += "\n  čekání (průměr/max): " + ", ".join(
+                f"{k} {avg:.2f}/{mx:.2f}s" for k, (avg, mx) in sorted(snap["waits"].items()))
+        return text
+
+# ============================================================
+# SPECULATIVE DECODING - draft modely s měřením přijetí
+# ============================================================
+
+class GGUFDraftModel:
+    """
+    Draft model pro llama.cpp z malého GGUF (musí mít stejný tokenizer).
+    Hladově navrhne num_pred_tokens tokenů; KV cache drží mezi voláními,
+    takže dopočítává jen nový konec sekvence.
+    """
+    
+    def __init__(self, model_path: str, num_pred_tokens: int = SPEC_DRAFT_TOKENS,
+                 n_ctx: int = 8192, n_threads: int = DEFAULT_THREADS, n_gpu_layers: int = 0):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                         n_gpu_layers=n_gpu_layers, verbose=False)
+        
+    def __call__(self, input_ids, /, **kwargs):
+        import numpy as np
+        ids = [int(t) for t in input_ids]
+        llm = self.llm
+        prefix = LLMInterface._common_prefix_len(llm._input_ids.tolist(), ids)
+        # Logity posledního tokenu potřebujeme vždy čerstvé
+        llm.n_tokens = min(prefix, len(ids) - 1)
+        llm.eval(ids[llm.n_tokens:])
+        draft: List[int] = []
+        for _ in range(self.num_pred_tokens):
+            if llm.n_tokens >= llm.n_ctx():
+                break
+            token = int(np.argmax(llm._scores[-1]))
+            if token == llm.token_eos():
+                break
+            draft.append(token)
+            llm.eval([token])
+        return np.array(draft, dtype=np.intc)
+
+
+class MeteredDraftModel:
+    """
+    Obal draft modelu, který měří míru přijetí návrhů.
+    
+    llama.cpp volá draft model jednou za ověřovací kolo s celou dosavadní sekvencí.
+    Sekvence mezi dvěma voláními naroste o (přijaté návrhy + 1 vlastní token),
+    takže přijetí předchozího návrhu = přírůstek - 1.
+    """
+    
+    def __init__(self, inner, label: str):
+        self.inner = inner
+        self.label = label
+        self.begin()
+        
+    def begin(self):
+        """Nové volání modelu - počitadla od nuly."""
+        self.drafted = 0
+        self.accepted = 0
+        self._last_len: Optional[int] = None
+        self._last_draft = 0
+        
+    def __call__(self, input_ids, /, **kwargs):
+        n = len(input_ids)
+        if self._last_len is not None and n > self._last_len:
+            self.drafted += self._last_draft
+            self.accepted += max(0, min(self._last_draft, n - self._last_len - 1))
+        draft = self.inner(input_ids, **kwargs)
+        self._last_len = n
+        self._last_draft = len(draft)
+        return draft
+        
+    @property
+    def acceptance(self) -> float:
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+
+def make_draft_model(spec: str, n_ctx: int = 8192) -> Optional[MeteredDraftModel]:
+    """LILU_SPECULATIVE -> draft model pro Llama(draft_model=...), nebo None."""
+    spec = (spec or "off").strip()
+    if spec.lower() in ("", "off", "0", "none"):
+        return None
+    try:
+        if spec.lower() == "lookup":
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+            return MeteredDraftModel(LlamaPromptLookupDecoding(num_pred_tokens=SPEC_DRAFT_TOKENS), "lookup")
+        path = spec if os.path.isabs(spec) else os.path.join(MODEL_DIR, spec)
+        return MeteredDraftModel(GGUFDraftModel(path, n_ctx=n_ctx), os.path.basename(path))
+    except Exception as e:
+        logger.warning(f"Speculative decoding disabled ({spec}): {e}")
+        return None
+
+# ============================================================
+# BATCHED BACKGROUND DECODING - víc krátkých generací v jednom kontextu
+# ============================================================
+
+@dataclasses.dataclass
+class BatchRequest:
+    """Jedna generace v dávce pozadí; on_result dostane hotový (oříznutý) text."""
+    kind: str
+    messages: List[dict]
+    max_tokens: int
+    temperature: float = 0.9
+    top_p: float = 0.9
+    on_result: Optional[Callable[[str], None]] = None
+
+
+class BatchDecoder:
+    """
+    Dekóduje několik nezávislých promptů najednou jako paralelní sekvence
+    (llama_batch, seq_id = index požadavku) v samostatném kontextu nad stejnými
+    vahami - KV cache hlavního kontextu (prefix odpovědi) zůstane nedotčená.
+    
+    Za jeden llama_decode se spočítá jeden token každé živé sekvence, takže
+    krátké výstupy pozadí sdílejí průchod vahami místo toho, aby se řadily za sebe.
+    Vzorkuje se tady (teplota + top-p); gramatiku llama.cpp v ručním batchi
+    nepoužijeme, výstupní profily se drží přes stop sekvence.
+    """
+    
+    TOP_K = 64      # top-p se počítá jen z nejpravděpodobnějších kandidátů
+    
+    def __init__(self, llm, n_threads: int):
+        self.llm = llm
+        self.n_threads = n_threads
+        self.generated: List[int] = []      # vygenerované tokeny každé sekvence z posledního run()
+        self._formatter = None
+        
+    def _format(self, messages: List[dict]) -> Tuple[List[int], List[str]]:
+        """Chat šablona modelu -> tokeny promptu + stop řetězce šablony."""
+        if self._formatter is None:
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+            template = (self.llm.metadata or {}).get("tokenizer.chat_template")
+            if not template:
+                raise RuntimeError("model has no chat template")
+            token_text = lambda t: self.llm._model.token_get_text(t) if t != -1 else ""
+            self._formatter = Jinja2ChatFormatter(
+                template=template, eos_token=token_text(self.llm.token_eos()),
+                bos_token=token_text(self.llm.token_bos()))
+        result = self._formatter(messages=messages)
+        tokens = self.llm.tokenize(result.prompt.encode("utf-8"),
+                                   add_bos=not result.added_special, special=True)
+        stop = result.stop if isinstance(result.stop, list) else [result.stop] if result.stop else []
+        return tokens, stop
+        
+    def _sample(self, logits, temperature: float, top_p: float, rng) -> int:
+        import numpy as np
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        k = min(self.TOP_K, len(logits))
+        top = np.argpartition(logits, -k)[-k:]
+        z = logits[top] / temperature
+        p = np.exp(z - z.max())
+        p /= p.sum()
+        order = np.argsort(-p)
+        cut = int(np.searchsorted(np.cumsum(p[order]), top_p)) + 1
+        keep = order[:cut]
+        return int(top[rng.choice(keep, p=p[keep] / p[keep].sum())])
+        
+    def run(self, requests: List[BatchRequest], job: Optional[LLMJob] = None) -> List[str]:
+        import numpy as np
+        import llama_cpp as lc
+        
+        prompts, stops = [], []
+        for req in requests:
+            tokens, template_stop = self._format(req.messages)
+            prompts.append(tokens)
+            profile = OUTPUT_PROFILES.get(req.kind) or {}
+            stops.append(template_stop + profile.get("stop", []))
+        n_seq = len(requests)
+        n_ctx = sum(len(p) for p in prompts) + sum(r.max_tokens for r in requests) + 16
+        
+        cparams = lc.llama_context_default_params()
+        cparams.n_ctx = n_ctx
+        cparams.n_batch = n_ctx
+        cparams.n_seq_max = n_seq
+        cparams.n_threads = cparams.n_threads_batch = self.n_threads
+        new_context = getattr(lc, "llama_init_from_model", None) or lc.llama_new_context_with_model
+        ctx = new_context(self.llm._model.model, cparams)
+        if not ctx:
+            raise RuntimeError("batch context allocation failed")
+        batch = lc.llama_batch_init(n_ctx, 0, n_seq)
+        
+        def add(n: int, token: int, pos: int, seq: int, logits: bool):
+            batch.token[n] = token
+            batch.pos[n] = pos
+            batch.n_seq_id[n] = 1
+            batch.seq_id[n][0] = seq
+            batch.logits[n] = logits
+            
+        eos = self.llm.token_eos()
+        n_vocab = self.llm.n_vocab()
+        rng = np.random.default_rng()
+        out_bytes = [b"" for _ in requests]
+        texts = ["" for _ in requests]
+        generated = [0] * n_seq
+        positions = [len(p) for p in prompts]
+        logit_index: Dict[int, int] = {}
+        try:
+            # Prefill všech promptů v jednom průchodu; logity jen z posledního tokenu každé sekvence
+            n = 0
+            for seq, tokens in enumerate(prompts):
+                for pos, token in enumerate(tokens):
+                    add(n, token, pos, seq, pos == len(tokens) - 1)
+                    n += 1
+                logit_index[seq] = n - 1
+            batch.n_tokens = n
+            if lc.llama_decode(ctx, batch) != 0:
+                raise RuntimeError("llama_decode failed (prefill)")
+                
+            active = set(range(n_seq))
+            while active:
+                if job is not None and job.cancel_requested:
+                    break
+                n = 0
+                next_index: Dict[int, int] = {}
+                for seq in sorted(active):
+                    req = requests[seq]
+                    logits = np.ctypeslib.as_array(
+                        lc.llama_get_logits_ith(ctx, logit_index[seq]), shape=(n_vocab,))
+                    token = self._sample(logits.copy(), req.temperature, req.top_p, rng)
+                    generated[seq] += 1
+                    if token == eos:
+                        active.discard(seq)
+                        continue
+                    out_bytes[seq] += self.llm.detokenize([token])
+                    texts[seq] = out_bytes[seq].decode("utf-8", errors="ignore").lstrip()
+                    hit = [texts[seq].find(s) for s in stops[seq] if s and s in texts[seq]]
+                    if hit:
+                        texts[seq] = texts[seq][:min(hit)]
+                        active.discard(seq)
+                        continue
+                    if generated[seq] >= req.max_tokens:
+                        active.discard(seq)
+                        continue
+                    add(n, token, positions[seq], seq, True)
+                    positions[seq] += 1
+                    next_index[seq] = n
+                    n += 1
+                if not n:
+                    break
+                batch.n_tokens = n
+                logit_index = next_index
+                if lc.llama_decode(ctx, batch) != 0:
+                    raise RuntimeError("llama_decode failed (generation)")
+        finally:
+            lc.llama_batch_free(batch)
+            lc.llama_free(ctx)
+        self.generated = generated
+        if job is not None:
+            job.tokens = sum(generated)
+        return [t.strip() for t in texts]
+
+# ============================================================
+# HTTP BACKEND - OpenAI-kompatibilní server (llama-server, vLLM)
+# ============================================================
+
+class HTTPConnectionPool:
+    """
+    Keep-alive spojení na jeden server (jen http.client, žádné další závislosti).
+    Volná spojení čekají ve frontě, semafor pouští nejvýš `size` souběžných požadavků.
+    Spojení se otevírá s connect timeoutem, odpověď se pak čte s read timeoutem.
+    """
+    
+    def __init__(self, base_url: str, size: int = HTTP_POOL_SIZE,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT, read_timeout: float = HTTP_READ_TIMEOUT):
+        url = urllib.parse.urlsplit(base_url)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ValueError(f"Invalid HTTP backend URL: {base_url}")
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.prefix = url.path.rstrip("/")
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.stats = {"requests": 0, "opened": 0, "reused": 0, "retries": 0, "errors": 0}
+        
+    def _connect(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        self.stats["opened"] += 1
+        return conn
+        
+    def acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """Vrací (spojení, znovupoužité?) - znovupoužité mohl server mezitím zavřít."""
+        if not self._slots.acquire(timeout=self.read_timeout):
+            raise TimeoutError(f"HTTP pool exhausted ({self.size} connections busy)")
+        self.stats["requests"] += 1
+        try:
+            conn = self._idle.get_nowait()
+            self.stats["reused"] += 1
+            return conn, True
+        except queue.Empty:
+            pass
+        try:
+            return self._connect(), False
+        except BaseException:
+            self._slots.release()
+            raise
+            
+    def release(self, conn: http.client.HTTPConnection, reuse: bool = True):
+        if reuse:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+        
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+                
+    def describe(self) -> str:
+        st = self.stats
+        return (f"{st['requests']} požadavků, {st['opened']} spojení otevřeno, "
+                f"{st['reused']}× keep-alive, {st['retries']} opakování, {st['errors']} chyb")
+
+
+class OpenAIHTTPBackend:
+    """
+    Klient /v1/chat/completions se stejným rozhraním, jaké LLMInterface používá u llama_cpp.Llama:
+    create_chat_completion() vrací dict, se stream=True generátor chunků ve tvaru OpenAI
+    (přerušení = close() generátoru), tokenize() jde na /tokenize llama-serveru.
+    
+    Opakuje se jen požadavek, který ještě nic nevrátil (spojení, 429/5xx) -
+    rozstreamovaná odpověď se neopakuje, to by se text v GUI zdvojil.
+    """
+    
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    
+    def __init__(self, base_url: str = HTTP_URL, model: str = HTTP_MODEL, api_key: str = HTTP_API_KEY,
+                 pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES):
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.retries = retries
+        self.pool = HTTPConnectionPool(base_url, pool_size)
+        self.can_tokenize = True
+        
+    def _headers(self) -> dict:
+        headers = {"Content-Type": "application/json", "Accept": "application/json, text/event-stream"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+        
+    def _open(self, method: str, path: str, payload: Optional[dict] = None
+              ) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Pošle požadavek a vrátí spojení s odpovědí 200; tělo čte (a spojení vrací) volající."""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        attempt = 0
+        while True:
+            conn, reused = self.pool.acquire()
+            try:
+                conn.request(method, self.pool.prefix + path, body=body, headers=self._headers())
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                self.pool.release(conn, reuse=False)
+                # Nečinné keep-alive spojení mohl server zavřít - to není chyba serveru
+                if reused and not isinstance(e, TimeoutError):
+                    continue
+                error: Exception = e
+            else:
+                if resp.status == 200:
+                    return conn, resp
+                detail = resp.read()[:300].decode("utf-8", "replace")
+                self.pool.release(conn, reuse=not resp.will_close)
+                error = RuntimeError(f"HTTP {resp.status} {path}: {detail}")
+                if resp.status not in self.RETRY_STATUS:
+                    self.pool.stats["errors"] += 1
+                    raise error
+            attempt += 1
+            if attempt > self.retries:
+                self.pool.stats["errors"] += 1
+                raise error
+            self.pool.stats["retries"] += 1
+            delay = min(8.0, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+            logger.warning(f"HTTP backend: {error} - retry {attempt}/{self.retries} in {delay:.1f}s")
+            time.sleep(delay)
+            
+    def _request_json(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        conn, resp = self._open(method, path, payload)
+        try:
+            data = resp.read()
+        except BaseException:
+            self.pool.release(conn, reuse=False)
+            raise
+        self.pool.release(conn, reuse=not resp.will_close)
+        return json.loads(data)
+        
+    def create_chat_completion(self, messages: List[dict], stream: bool = False, **params):
+        """
+        params jako u llama_cpp (max_tokens, temperature, top_p, stop, response_format);
+        grammar je text GBNF - llama-server ho bere přímo v požadavku.
+        """
+        payload = {"model": self.model, "messages": messages, "stream": stream}
+        payload.update({k: v for k, v in params.items() if v is not None})
+        if stream:
+            return self._stream(payload)
+        return self._request_json("POST", "/v1/chat/completions", payload)
+        
+    def _stream(self, payload: dict):
+        """Server-sent events: řádky "data: {...}", konec "data: [DONE]"."""
+        conn, resp = self._open("POST", "/v1/chat/completions", payload)
+        done = False
+        try:
+            for line in resp:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    done = True
+                    break
+                chunk = json.loads(data)
+                if chunk.get("choices"):
+                    yield chunk
+            if done:
+                resp.read()
+        finally:
+            # Nedočtený stream (přerušení, chyba) nejde vrátit do poolu - spojení se zavře
+            self.pool.release(conn, reuse=done and not resp.will_close)
+            
+    def tokenize(self, text: bytes, add_bos: bool = False) -> List[int]:
+        if not self.can_tokenize:
+            raise RuntimeError("server has no /tokenize")
+        try:
+            data = self._request_json("POST", "/tokenize", {"content": text.decode("utf-8", "replace"),
+                                                            "add_special": add_bos})
+        except RuntimeError:
+            # vLLM / OpenAI endpoint /tokenize nemá - dál už jen odhad
+            self.can_tokenize = False
+            raise
+        return data["tokens"]
+        
+    def create_embedding(self, texts: List[str]) -> List[List[float]]:
+        """POST /v1/embeddings (llama-server --embedding, vLLM) - vektory v pořadí vstupu."""
+        data = self._request_json("POST", "/v1/embeddings", {"model": self.model, "input": texts})
+        return [d["embedding"] for d in sorted(data["data"], key=lambda d: d.get("index", 0))]
+        
+    def list_models(self) -> List[str]:
+        """GET /v1/models - zároveň kontrola, že server běží."""
+        data = self._request_json("GET", "/v1/models")
+        return [m.get("id", "?") for m in data.get("data", [])]
+        
+    def server_context(self) -> Optional[int]:
+        """Kontext slotu llama-serveru (/props); jiné servery ho nehlásí."""
+        try:
+            props = self._request_json("GET", "/props")
+        except Exception:
+            return None
+        settings = props.get("default_generation_settings") or {}
+        return settings.get("n_ctx") or props.get("n_ctx")
+        
+    def close(self):
+        self.pool.close()
+
+
+class FakeLLM:
+    """
+    LILU_BACKEND=fake: syntetický model v procesu se stejným rozhraním jako llama_cpp.Llama.
+    Text dělá StubModel z lilu_stub_server.py (seed + zprávy, nebo skript), čekání
+    podle FAKE_TTFT / FAKE_TPS simuluje dekódování. Celý kernel tak běží bez GGUF
+    a zbylý čas tahu je režie mimo model (paměť, labyrint, Φ, sny, moudrost).
+    """
+    
+    def __init__(self, seed: int = FAKE_SEED, tps: float = FAKE_TPS, ttft: float = FAKE_TTFT,
+                 script_path: str = FAKE_SCRIPT):
+        from lilu_stub_server import StubModel
+        script = None
+        if script_path:
+            with open(script_path, "r", encoding="utf-8") as f:
+                script = json.load(f)
+        self.model = StubModel(model="fake", seed=seed, tps=tps, ttft=ttft, script=script)
+        self.busy_seconds = 0.0     # simulované dekódování celkem
+        
+    def _sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+            self.busy_seconds += seconds
+            
+    def create_chat_completion(self, messages: List[dict], stream: bool = False, **params):
+        """grammar se ignoruje - stop a response_format StubModel dodrží sám."""
+        body = {"messages": messages, **params}
+        pieces = self.model.pieces(body)
+        self.model.count("streams" if stream else "completions")
+        self.model.count("tokens", len(pieces))
+        if stream:
+            return self._stream(pieces)
+        self._sleep(self.model.ttft + (len(pieces) / self.model.tps if self.model.tps else 0.0))
+        return self.model.completion(body, pieces)
+        
+    def _stream(self, pieces: List[str]):
+        self._sleep(self.model.ttft)
+        for piece in pieces:
+            self._sleep(1.0 / self.model.tps if self.model.tps else 0.0)
+            yield self.model.chunk("fake", {"content": piece})
+            
+    def tokenize(self, text: bytes, add_bos: bool = False) -> List[int]:
+        from lilu_stub_server import tokenize
+        return tokenize(text.decode("utf-8", "replace"))
+
+# ============================================================
+# LLM INTERFACE
+# ============================================================
+
+def file_fingerprint(path: str, chunk: int = 1 << 20) -> str:
+    """Rychlý otisk velkého souboru: velikost + SHA-256 prvního a posledního MiB."""
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            h.update(f.read(chunk))
+    return h.hexdigest()[:16]
+
+
+def trim_output(text: str, mode: Optional[str]) -> str:
+    """Pojistka výstupního profilu: první řádka bez komentáře v závorce, případně první věta."""
+    if not mode or not text:
+        return text
+    lines = [l.strip() for l in text.split("\n") if l.strip()]
+    clean = [l for l in lines if not l.startswith("(")]
+    text = (clean or lines or [""])[0]
+    if mode == "sentence":
+        match = re.match(r'.*?[.!?](?=\s|$)', text)
+        if match:
+            text = match.group(0)
+    return text
+
+
+class LLMInterface:
+    """
+    Wrapper around llama-cpp-python (backend "llama") nebo OpenAI-kompatibilního
+    serveru (backend "http", model_path je pak název modelu na serveru).
+    
+    Všechna volání jdou přes LLMScheduler (jeden worker thread), takže se llama.cpp
+    nikdy nevolá souběžně z více vláken. To opravuje sporadické ggml asserty jako:
+      "cannot copy tensors with different layouts"
+    U HTTP backendu scheduler dál drží priority (odpověď před snem), souběh řeší server.
+    """
+    
+    def __init__(self, model_path: str, n_gpu_layers: Optional[int] = N_GPU_LAYERS,
+                 n_threads: Optional[int] = N_THREADS, n_ctx: Optional[int] = N_CTX,
+                 speculative: str = "off", n_batch: Optional[int] = N_BATCH,
+                 backend: str = LLM_BACKEND):
+        self.model_path = model_path
+        self.backend = backend
+        # Explicitně zadané parametry profil z --autotune (ani server) nepřepisuje
+        self._explicit_hw = {name for name, value in (("n_threads", n_threads), ("n_gpu_layers", n_gpu_layers),
+                                                      ("n_batch", n_batch), ("n_ctx", n_ctx))
+                             if value is not None}
+        self.n_threads = n_threads or DEFAULT_THREADS
+        self.n_batch = n_batch or DEFAULT_BATCH
+        self.speculative = speculative
+        self.draft: Optional[MeteredDraftModel] = None
+        # Rychlost dekódování (a přijetí draftů) - ať je vidět, jestli se spekulace vyplácí
+        self.decode_stats = {"calls": 0, "tokens": 0, "seconds": 0.0, "last_tps": 0.0,
+                             "drafted": 0, "accepted": 0}
+        # Vygenerované vs. ponechané tokeny podle druhu úlohy (kolik se platí za zahozený text)
+        self.output_stats: Dict[str, Dict[str, int]] = {}
+        self.batch_stats = {"batches": 0, "sequences": 0, "fallbacks": 0}
+        self._stats_lock = threading.Lock()             # souběžné požadavky dávky (http)
+        self._grammars: Dict[str, Any] = {}
+        self.config = detect_model_class(model_path)    # v5.0: Universal LLM, per model
+        self.n_ctx = n_ctx or self.config["n_ctx"]
+        if n_gpu_layers is None and self.in_process:
+            n_gpu_layers = suggest_gpu_layers(self.config["gguf"], self.n_ctx, detect_free_vram_mb())
+            logger.info(f"GPU layers (auto): {n_gpu_layers if n_gpu_layers is not None else 'VRAM unknown'}")
+        self.n_gpu_layers = DEFAULT_GPU_LAYERS if n_gpu_layers is None else n_gpu_layers
+        # Počty tokenů podle tokenizéru modelu, memoizované podle textu (ContextBuilder)
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._token_lock = threading.Lock()
+        # http: tokeny se odhadují lokálně (žádný /tokenize na cestě odpovědi); poměr
+        # znaků na token zpřesňuje usage.prompt_tokens z odpovědí serveru
+        self._chars_per_token = 3.0
+        self.llm = None
+        self.scheduler = LLMScheduler(os.path.basename(model_path) or "llm")
+        # Kolik tokenů prefixu promptu se znovu použilo z KV cache
+        self.prefix_stats = {"calls": 0, "last_reused": 0, "last_prompt": 0,
+                             "total_reused": 0, "total_prompt": 0}
+        # Prefix promptu odpovědi, který se mezi tahy nemění - ten se ukládá jako session
+        self._last_reply_prompt: List[int] = []
+        self._stable_prefix: List[int] = []
+        self.session_meta: dict = {}
+        
+    @property
+    def is_busy(self) -> bool:
+        """Model právě generuje nebo má ve frontě další úlohy."""
+        return self.scheduler.current is not None or self.scheduler.depth > 0
+        
+    @property
+    def in_process(self) -> bool:
+        """KV cache, session, draft model a dávkování přes low-level API jsou jen u llama.cpp v procesu."""
+        return self.backend == "llama"
+        
+    def load(self, session_key: Optional[str] = None) -> bool:
+        """session_key: hash statického prefixu - pokud sedí uložená session, načte se její KV stav."""
+        if self.backend == "http":
+            return self._connect_http()
+        if self.backend == "fake":
             try:
-                logger.info(f"Loading LLM: {self.model_path}")
-                self.llm = Llama(
-                    model_path=self.model_path,
-                    n_ctx=N_CTX,
-                    n_gpu_layers=N_GPU_LAYERS,
-                    n_threads=N_THREADS,
-                    verbose=False,
-                )
-                logger.info("LLM loaded successfully")
+                self.llm = FakeLLM()
+                logger.info(f"Fake LLM backend (seed {FAKE_SEED}, "
+                            f"{f'{FAKE_TPS:g} tok/s' if FAKE_TPS else 'bez čekání'})")
                 return True
             except Exception as e:
-                logger.error(f"LLM load failed: {e}")
-                self.llm = None
+                logger.error(f"Fake LLM backend failed: {e}")
                 return False
+        if Llama is None:
+            logger.error("Chybí llama_cpp: pip install llama-cpp-python (nebo LILU_BACKEND=http)")
+            return False
+        try:
+            logger.info(f"Loading LLM: {self.model_path}")
+            self._apply_autotune_profile()
+            self.draft = make_draft_model(self.speculative, self.n_ctx)
+            kwargs = {"draft_model": self.draft} if self.draft else {}
+            self.llm = Llama(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,
+                n_gpu_layers=self.n_gpu_layers,
+                n_threads=self.n_threads,
+                n_batch=self.n_batch,
+                verbose=False,
+                **kwargs,
+            )
+            if self.draft:
+                logger.info(f"Speculative decoding: {self.draft.label}")
+            self._attach_prompt_cache()
+            if session_key:
+                self._restore_session(session_key)
+            logger.info("LLM loaded successfully")
+            return True
+        except Exception as e:
+            logger.error(f"LLM load failed: {e}")
+            self.llm = None
+            return False
+    
+    def _connect_http(self) -> bool:
+        """HTTP backend: ověří server (/v1/models) a převezme jeho kontext, pokud ho hlásí."""
+        try:
+            backend = OpenAIHTTPBackend(HTTP_URL, self.model_path)
+            models = backend.list_models()
+            logger.info(f"HTTP backend {HTTP_URL}: models {models}")
+            if models and self.model_path not in models:
+                logger.warning(f"HTTP backend: model '{self.model_path}' not listed, server may use its default")
+            server_ctx = backend.server_context()
+            if server_ctx and "n_ctx" not in self._explicit_hw:
+                self.n_ctx = server_ctx
+            self.llm = backend
+            return True
+        except Exception as e:
+            logger.error(f"HTTP backend unavailable ({HTTP_URL}): {e}")
+            self.llm = None
+            return False
+            
+    def _apply_autotune_profile(self):
+        """Parametry změřené přes --autotune pro tenhle stroj a model (env má přednost)."""
+        profile = load_autotune_profile(self.model_path)
+        if not profile:
+            return
+        applied = {}
+        for name in ("n_threads", "n_batch", "n_gpu_layers"):
+            if name in profile and name not in self._explicit_hw:
+                # GPU vrstvy změřené s menším kontextem by se s větší KV cache nemusely vejít
+                if name == "n_gpu_layers" and profile.get("n_ctx", 0) < self.n_ctx:
+                    continue
+                applied[name] = profile[name]
+                setattr(self, name, profile[name])
+        if applied:
+            logger.info(f"Autotune profile applied: {applied}")
     
-    def _chat(self, *, messages: List[dict], max_tokens: int, temperature: float, top_p: float = 0.9) -> str:
+    def _attach_prompt_cache(self):
+        """
+        State cache llama.cpp: dokud běží jen jedna konverzace, stačí prefix v KV cache.
+        Jenže sny, monolog a myšlenky mezi tahy KV cache přepíší vlastními prompty -
+        cache uloží stav po odpovědi a příští tah ho načte a dopočítá jen rozdíl.
+        """
+        if PROMPT_CACHE_MODE == "off":
+            return
+        try:
+            if PROMPT_CACHE_MODE == "disk":
+                from llama_cpp import LlamaDiskCache
+                cache = LlamaDiskCache(cache_dir=PROMPT_CACHE_DIR)
+            else:
+                from llama_cpp import LlamaRAMCache
+                cache = LlamaRAMCache(capacity_bytes=PROMPT_CACHE_RAM_MB << 20)
+            self.llm.set_cache(cache)
+            logger.info(f"Prompt state cache: {PROMPT_CACHE_MODE}")
+        except Exception as e:
+            logger.warning(f"Prompt state cache unavailable ({PROMPT_CACHE_MODE}): {e}")
+            
+    def _session_path(self, session_key: str) -> str:
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        return os.path.join(SESSION_DIR, f"{stem}.{file_fingerprint(self.model_path)}.{session_key}.state")
+        
+    def _restore_session(self, session_key: str):
+        """Načte KV stav uložený minulým během (stejný model, stejný statický prefix)."""
+        path = self._session_path(session_key)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("n_ctx") != self.n_ctx:
+                logger.info(f"Session state skipped: saved for n_ctx={data.get('n_ctx')}")
+                return
+            state = data["state"]
+            self.llm.load_state(state)
+            self._last_reply_prompt = self._kv_tokens()
+            self.session_meta = data.get("meta", {})
+            logger.info(f"Session state restored: {len(self._last_reply_prompt)} tokens "
+                        f"(saved {data.get('saved', '?')})")
+        except Exception as e:
+            logger.warning(f"Session state restore failed: {e}")
+            
+    def save_session(self, session_key: str, meta: Optional[dict] = None) -> bool:
+        """
+        Uloží KV stav stabilního prefixu odpovědi (system prompt + začátek okna historie).
+        Běží jako úloha scheduleru, aby se nepotkala s rozpracovanou generací.
+        """
+        if not self.llm or not self.in_process:
+            return False
+        job = LLMJob("session", lambda j: self._save_session(session_key, meta or {}))
+        self.scheduler.submit(job)
+        job.wait()
+        return job.result == "saved"
+        
+    def _save_session(self, session_key: str, meta: dict) -> str:
+        prefix = self._stable_prefix
+        if not prefix:
+            logger.info("Session state not saved: no stable reply prefix yet")
+            return "skipped"
+        n = len(prefix)
+        if self._kv_tokens()[:n] != prefix:
+            # KV cache mezitím přepsal sen nebo kontakt - zkus stav z prompt cache
+            cache = getattr(self.llm, "cache", None)
+            try:
+                self.llm.load_state(cache[prefix])
+            except Exception:
+                pass
+            if self._kv_tokens()[:n] != prefix:
+                logger.info("Session state not saved: prefix no longer in KV cache")
+                return "skipped"
+        # Zahodí KV za prefixem, ať se neukládá poslední zpráva a odpověď
+        ctx = getattr(self.llm, "_ctx", None)
+        seq_rm = getattr(ctx, "kv_cache_seq_rm", None) or getattr(ctx, "memory_seq_rm", None)
+        if seq_rm:
+            seq_rm(-1, n, -1)
+        self.llm.n_tokens = n
+        data = {"model": file_fingerprint(self.model_path), "prefix": session_key,
+                "n_ctx": self.n_ctx, "saved": datetime.now().isoformat(),
+                "meta": meta, "state": self.llm.save_state()}
+        path = self._session_path(session_key)
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        # Starší session téhož modelu (jiný statický prefix) už nejsou k ničemu
+        for old in glob.glob(path.rsplit(".", 2)[0] + ".*.state"):
+            if old != path:
+                os.remove(old)
+        logger.info(f"Session state saved: {n} tokens -> {os.path.basename(path)}")
+        return "saved"
+            
+    def _kv_tokens(self) -> List[int]:
+        """Tokeny, které má model právě spočítané v KV cache."""
+        ids = getattr(self.llm, "_input_ids", None)
+        if ids is None:
+            return []
+        return ids.tolist() if hasattr(ids, "tolist") else list(ids)
+    
+    def _cached_prefixes(self) -> List[tuple]:
+        """Klíče (tokeny) stavů v RAM cache - snapshot před voláním."""
+        cache_state = getattr(getattr(self.llm, "cache", None), "cache_state", None)
+        return list(cache_state.keys()) if cache_state else []
+    
+    @staticmethod
+    def _common_prefix_len(a, b) -> int:
+        n = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            n += 1
+        return n
+        
+    def _record_prefix_reuse(self, before: List[int], cached: List[tuple], generated: int,
+                             kind: str = ""):
+        """
+        Po volání: KV cache = prompt + vygenerované tokeny. Znovupoužitý prefix je
+        nejdelší společný začátek promptu s tím, co bylo v KV cache (nebo ve state cache) předtím.
+        """
+        after = self._kv_tokens()
+        prompt = after[:max(0, len(after) - generated)]
+        if not prompt:
+            return
+        reused = self._common_prefix_len(before, prompt)
+        for key in cached:
+            reused = max(reused, self._common_prefix_len(key, prompt))
+        st = self.prefix_stats
+        with self._stats_lock:
+            st["calls"] += 1
+            st["last_reused"] = reused
+            st["last_prompt"] = len(prompt)
+            st["total_reused"] += reused
+            st["total_prompt"] += len(prompt)
+        logger.info(f"KV prefix reuse: {reused}/{len(prompt)} prompt tokens")
+        if kind == "reply":
+            common = self._common_prefix_len(self._last_reply_prompt, prompt)
+            if common:
+                self._stable_prefix = prompt[:common]
+            self._last_reply_prompt = prompt
+    
+    def _chat(self, *, messages: List[dict], max_tokens: int, temperature: float, top_p: float = 0.9,
+              on_chunk: Optional[Callable[[str], None]] = None, job: Optional[LLMJob] = None,
+              response_format: Optional[dict] = None, kind: Optional[str] = None) -> str:
+        """
+        response_format: JSON schema pro llama.cpp (převede se na gramatiku - výstup je vždy platný JSON).
+        kind: druh výstupu (profil, statistiky), když se liší od job.kind (dávka pozadí).
+        """
         if not self.llm:
             return "..."
-        with self._lock:
-            self._busy = True
+        kind = kind or (job.kind if job is not None else "")
+        params = {"messages": messages, "max_tokens": max_tokens,
+                  "temperature": temperature, "top_p": top_p}
+        profile = None
+        if response_format:
+            params["response_format"] = response_format
+        elif job is not None:
+            profile = OUTPUT_PROFILES.get(kind)
+            if profile:
+                params["stop"] = profile["stop"]
+                grammar = self._grammar(profile["grammar"]) if OUTPUT_GRAMMARS else None
+                if grammar is not None:
+                    params["grammar"] = grammar
+        try:
+            before, cached = self._kv_tokens(), self._cached_prefixes()
+            if self.draft:
+                self.draft.begin()
+            started = time.time()
+            # Úlohy na pozadí běží vždy streamovaně, aby šly přerušit mezi tokeny
+            if on_chunk is None and not (job is not None and job.is_background):
+                out = self.llm.create_chat_completion(**params)
+                usage = out.get("usage") or {}
+                generated = usage.get("completion_tokens", 0)
+                self._calibrate_estimate(messages, usage.get("prompt_tokens", 0))
+                if job is not None:
+                    job.tokens = generated
+                self._record_prefix_reuse(before, cached, generated, kind)
+                self._record_decode(generated, time.time() - started)
+                text = (out["choices"][0]["message"]["content"] or "").strip()
+            else:
+                text, generated, first_token_delay = self._chat_stream(params, on_chunk, job)
+                self._record_prefix_reuse(before, cached, generated, kind)
+                # U streamu měříme čisté dekódování (od prvního tokenu)
+                self._record_decode(generated, time.time() - started - first_token_delay)
+            if job is not None:
+                text = trim_output(text, profile and profile["trim"])
+                self._record_output(kind, generated, text)
+            return text
+        except Exception as e:
+            logger.error(f"LLM generate error: {e}")
+            return ""
+                
+    def _chat_stream(self, params: dict, on_chunk: Optional[Callable[[str], None]],
+                     job: Optional[LLMJob] = None) -> Tuple[str, int, float]:
+        """
+        Streamovaná generace: každý kus textu jde hned do on_chunk.
+        Mezi tokeny se kontroluje job.cancel_requested - přerušení vrátí rozpracovaný text.
+        Vrací celý text (pro membránu, metriky a uložení do paměti), počet kusů (~tokenů)
+        a zpoždění prvního tokenu (s).
+        """
+        parts: List[str] = []
+        n_chunks = 0
+        started = time.time()
+        first_token_at = None
+        stream = self.llm.create_chat_completion(**params, stream=True)
+        for chunk in stream:
+            if job is not None and job.cancel_requested:
+                stream.close()          # zastaví generátor llama.cpp
+                break
+            piece = (chunk["choices"][0].get("delta") or {}).get("content")
+            if not piece:
+                continue
+            n_chunks += 1
+            if job is not None:
+                job.tokens = n_chunks
+            if not parts:
+                # Úvodní mezery modelu do GUI neposíláme
+                piece = piece.lstrip()
+                if not piece:
+                    continue
+                first_token_at = time.time()
+            parts.append(piece)
+            if on_chunk is None:
+                continue
             try:
-                out = self.llm.create_chat_completion(
-                    messages=messages,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=top_p,
-                )
-                return (out["choices"][0]["message"]["content"] or "").strip()
+                on_chunk(piece)
             except Exception as e:
-                logger.error(f"LLM generate error: {e}")
-                return ""
-            finally:
-                self._busy = False
+                logger.error(f"LLM stream callback error: {e}")
+        first_token_delay = 0.0
+        if first_token_at is not None:
+            first_token_delay = first_token_at - started
+            logger.info(f"LLM stream: first token {first_token_delay:.2f}s, "
+                        f"total {time.time() - started:.2f}s, chunks={n_chunks}")
+        return "".join(parts).strip(), n_chunks, first_token_delay
+        
+    def _record_decode(self, tokens: int, seconds: float):
+        """Tokeny/s za volání + přijetí návrhů draft modelu (spekulativní dekódování)."""
+        if tokens <= 0 or seconds <= 0:
+            return
+        st = self.decode_stats
+        tps = tokens / seconds
+        with self._stats_lock:
+            st["calls"] += 1
+            st["tokens"] += tokens
+            st["seconds"] += seconds
+            st["last_tps"] = tps
+            if self.draft:
+                st["drafted"] += self.draft.drafted
+                st["accepted"] += self.draft.accepted
+        if self.draft:
+            logger.info(f"Decode: {tokens} tok, {tps:.1f} tok/s, speculative[{self.draft.label}] "
+                        f"accepted {self.draft.accepted}/{self.draft.drafted} "
+                        f"({self.draft.acceptance * 100:.0f}%)")
+        else:
+            logger.info(f"Decode: {tokens} tok, {tps:.1f} tok/s")
+            
+    def _grammar(self, gbnf: str):
+        """Zkompilovaná GBNF gramatika (cache podle textu); None, když ji llama_cpp neumí."""
+        if not self.in_process:
+            return gbnf     # server si GBNF zkompiluje sám
+        if gbnf not in self._grammars:
+            try:
+                from llama_cpp import LlamaGrammar
+                self._grammars[gbnf] = LlamaGrammar.from_string(gbnf, verbose=False)
+            except Exception as e:
+                logger.warning(f"GBNF grammar unavailable, using stop sequences only: {e}")
+                self._grammars[gbnf] = None
+        return self._grammars[gbnf]
+        
+    def _record_output(self, kind: str, generated: int, kept_text: str):
+        kept = self.count_tokens(kept_text) if kept_text else 0
+        with self._stats_lock:
+            st = self.output_stats.setdefault(kind, {"calls": 0, "generated": 0, "kept": 0})
+            st["calls"] += 1
+            st["generated"] += generated
+            st["kept"] += kept
+        
+    def describe_outputs(self) -> str:
+        """Např. "monologue 210/240 tok (88%)" - kolik vygenerovaných tokenů se opravdu použilo."""
+        parts = []
+        for kind, st in sorted(self.output_stats.items()):
+            if st["generated"]:
+                kept = min(st["kept"], st["generated"])
+                parts.append(f"{kind} {kept}/{st['generated']} tok ({kept / st['generated'] * 100:.0f}%)")
+        return ", ".join(parts) or "zatím nic"
+        
+    def describe_backend(self) -> str:
+        if self.in_process:
+            return f"gpu={self.n_gpu_layers}, threads={self.n_threads}"
+        if self.backend == "fake":
+            return f"fake seed={FAKE_SEED}, {FAKE_TPS:g} tok/s" if FAKE_TPS else f"fake seed={FAKE_SEED}"
+        text = f"http {HTTP_URL}"
+        if isinstance(self.llm, OpenAIHTTPBackend):
+            text += f" [{self.llm.pool.describe()}]"
+        return text
+        
+    def describe_decode(self) -> str:
+        st = self.decode_stats
+        if not st["calls"]:
+            return "zatím nic"
+        text = (f"{st['tokens'] / max(st['seconds'], 1e-6):.1f} tok/s průměr "
+                f"(poslední {st['last_tps']:.1f}, {st['calls']} volání)")
+        if self.draft:
+            rate = st["accepted"] / st["drafted"] if st["drafted"] else 0.0
+            text += f", spekulace [{self.draft.label}] přijato {rate * 100:.0f}%"
+        return text
+
+    def _calibrate_estimate(self, messages: List[dict], prompt_tokens: int):
+        """Poměr znaků na token pro odhad na http backendu (klouzavý průměr)."""
+        if self.backend != "http" or not prompt_tokens:
+            return
+        chars = sum(len(m.get("content") or "") for m in messages)
+        content_tokens = prompt_tokens - MESSAGE_TOKEN_OVERHEAD * len(messages)
+        if chars < 200 or content_tokens <= 0:
+            return
+        ratio = min(6.0, max(1.5, chars / content_tokens))
+        self._chars_per_token = self._chars_per_token * 0.8 + ratio * 0.2
+        
+    def count_tokens(self, text: str) -> int:
+        """
+        Počet tokenů textu podle tokenizéru modelu (bez BOS).
+        Memoizované podle textu - uložené zprávy se tak tokenizují jen jednou.
+        Tokenizace jen čte slovník, nemusí tedy čekat ve frontě scheduleru.
+        Na http backendu jen lokální odhad - /tokenize by byl HTTP dotaz za každý
+        řádek historie na cestě odpovědi.
+        """
+        if self.backend == "http":
+            return int(len(text) / self._chars_per_token) + 1
+        with self._token_lock:
+            n = self._token_counts.get(text)
+            if n is not None:
+                self._token_counts.move_to_end(text)
+                return n
+        try:
+            n = len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+        except Exception:
+            n = len(text) // 3 + 1    # hrubý odhad, než je model načtený (nebo server neumí /tokenize)
+        with self._token_lock:
+            self._token_counts[text] = n
+            if len(self._token_counts) > TOKEN_COUNT_CACHE:
+                self._token_counts.popitem(last=False)
+        return n
+
+    def request(self, messages: List[dict], max_tokens: int = 256, temperature: float = 0.85,
+                on_chunk: Optional[Callable[[str], None]] = None, kind: str = "reply",
+                top_p: float = 0.9, response_format: Optional[dict] = None) -> LLMJob:
+        """
+        Zařadí generaci do fronty podle druhu (kind) a počká na výsledek.
+        Vrací celou úlohu - volající pozná zrušení ve frontě ("cancelled"/"expired")
+        i přerušení rozpracované generace ("interrupted", result = rozpracovaný text).
+        """
+        timeout = LLM_DEADLINES.get(kind)
+        job = LLMJob(
+            kind,
+            lambda j: self._chat(messages=messages, max_tokens=max_tokens, temperature=temperature,
+                                 top_p=top_p, on_chunk=on_chunk, job=j,
+                                 response_format=response_format),
+            deadline=(time.time() + timeout) if timeout else None,
+        )
+        self.scheduler.submit(job)
+        job.wait()
+        if job.started is not None:
+            TRACER.record("llm.queue", job.started - job.submitted, ago=time.time() - job.started)
+        return job
+            
+    def generate(self, messages: List[dict], max_tokens: int = 256, temperature: float = 0.85,
+                 on_chunk: Optional[Callable[[str], None]] = None, kind: str = "reply") -> str:
+        """
+        on_chunk: volitelný callback - pokud je zadán, generuje se streamovaně
+        a každý kus textu se předá hned, jak ho model vyprodukuje.
+        kind: druh úlohy pro prioritu ve frontě (viz LLM_PRIORITIES).
+        Přerušená generace vrací "" (rozpracovaný text se zahodí a počítá jako zbytečné tokeny).
+        """
+        job = self.request(messages, max_tokens, temperature, on_chunk=on_chunk, kind=kind)
+        if job.status == "interrupted":
+            self.scheduler.record_wasted(job)
+            return ""
+        return job.result
             
-    def generate(self, messages: List[dict], max_tokens: int = 256, temperature: float = 0.85) -> str:
-        return self._chat(messages=messages, max_tokens=max_tokens, temperature=temperature, top_p=0.9)
+    def generate_batch(self, requests: List[BatchRequest]) -> List[str]:
+        """
+        Krátké generace pozadí jako JEDNA úloha scheduleru: paralelní sekvence
+        v BatchDecoder, a když low-level API llama.cpp chybí nebo selže, postupně.
+        Přerušená dávka vrací samé "" (jako generate()).
+        """
+        if not requests:
+            return []
+        job = LLMJob("batch", lambda j: self._run_batch(requests, j),
+                     deadline=time.time() + min(LLM_DEADLINES.get(r.kind, 60) for r in requests))
+        self.scheduler.submit(job)
+        job.wait()
+        if job.started is not None:
+            TRACER.record("llm.queue", job.started - job.submitted, ago=time.time() - job.started)
+        if job.status != "done" or not isinstance(job.result, list):
+            if job.status == "interrupted":
+                self.scheduler.record_wasted(job)
+            return [""] * len(requests)
+        return job.result
+        
+    def _run_batch(self, requests: List[BatchRequest], job: LLMJob) -> List[str]:
+        if not self.llm:
+            return [""] * len(requests)
+        if len(requests) > 1 and self.backend == "http":
+            # Server dávkuje sám (continuous batching) - stačí poslat požadavky souběžně
+            self.batch_stats["batches"] += 1
+            self.batch_stats["sequences"] += len(requests)
+            subs = [job.child() for _ in requests]      # job.tokens = součet, ne poslední požadavek
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.llm.pool.size) as pool:
+                futures = [pool.submit(self._chat, messages=req.messages, max_tokens=req.max_tokens,
+                                       temperature=req.temperature, top_p=req.top_p, job=sub, kind=req.kind)
+                           for req, sub in zip(requests, subs)]
+                results = [f.result() for f in futures]
+            job.tokens = sum(sub.tokens for sub in subs)
+            return results
+        if len(requests) > 1 and self.in_process:
+            try:
+                started = time.time()
+                decoder = BatchDecoder(self.llm, self.n_threads)
+                texts = decoder.run(requests, job)
+                self._record_decode(job.tokens, time.time() - started)
+                self.batch_stats["batches"] += 1
+                self.batch_stats["sequences"] += len(requests)
+                results = []
+                for req, text, generated in zip(requests, texts, decoder.generated):
+                    profile = OUTPUT_PROFILES.get(req.kind)
+                    text = trim_output(text, profile and profile["trim"])
+                    self._record_output(req.kind, generated, text)
+                    results.append(text)
+                return results
+            except Exception as e:
+                logger.warning(f"Batched decoding unavailable, running sequentially: {e}")
+                self.batch_stats["fallbacks"] += 1
+        results = []
+        job.tokens = 0
+        for req in requests:
+            if job.cancel_requested:
+                results.append("")
+                continue
+            sub = job.child()
+            results.append(self._chat(messages=req.messages, max_tokens=req.max_tokens,
+                                      temperature=req.temperature, top_p=req.top_p,
+                                      job=sub, kind=req.kind))
+            job.tokens += sub.tokens
+        return results
             
     def style_normalize(self, user_msg: str, draft: str, identity_anchor: str) -> str:
         if not STYLE_NORMALIZE or not draft.strip() or not self.llm:
@@ -1741,11 +4815,411 @@ class LLMInterface:
                 {"role": "system", "content": f"Přepiš do hlasu LiLu (ženský rod!). Anchor: {identity_anchor}"},
                 {"role": "user", "content": f"Uživatel: {user_msg}\nPůvodní: {draft}"},
             ]
-            out = self._chat(messages=msgs, max_tokens=STYLE_MAX_TOKENS, temperature=0.4, top_p=0.95)
+            out = self.request(msgs, max_tokens=STYLE_MAX_TOKENS, temperature=0.4,
+                               kind="style", top_p=0.95).result
             return (out or draft).strip()
         except Exception:
             return draft
 
+# ============================================================
+# MODEL POOL - malý model pro pozadí, velký pro odpovědi
+# ============================================================
+
+class ModelPool:
+    """
+    Modely podle druhu úlohy (MODEL_ROUTES).
+    
+    Monolog každých 45 s, myšlenky a extrakce moudrosti nepotřebují 24B model.
+    S LILU_BG_MODEL běží na malém GGUF s vlastním workerem, vlastními vlákny
+    a GPU vrstvami - hlavní model tak zůstává volný pro odpověď.
+    """
+    
+    def __init__(self, main_path: str, bg_model: str = ""):
+        self.models: Dict[str, LLMInterface] = {
+            "main": LLMInterface(main_path, speculative=SPECULATIVE)}
+        bg_path = self._resolve(bg_model)
+        if bg_path:
+            self.models["background"] = LLMInterface(
+                bg_path, n_gpu_layers=BG_GPU_LAYERS, n_threads=BG_THREADS)
+        self.embedder = Embedder()                      # načte se až v indexeru sémantické paměti
+        # Jeden indexer pro paměti všech sessions; ustupuje odpovědím všech modelů
+        self.indexer = SemanticIndexer(self.embedder, yield_to=self.replying)
+            
+    @staticmethod
+    def _resolve(name: str) -> Optional[str]:
+        if not name:
+            return None
+        if LLM_BACKEND != "llama":
+            return name     # název modelu na serveru
+        path = name if os.path.isabs(name) else os.path.join(MODEL_DIR, name)
+        if not os.path.exists(path):
+            logger.warning(f"ModelPool: background model not found: {path}")
+            return None
+        return path
+        
+    @property
+    def main(self) -> LLMInterface:
+        return self.models["main"]
+        
+    def get(self, kind: str) -> LLMInterface:
+        return self.models.get(MODEL_ROUTES.get(kind, "main")) or self.main
+        
+    def load(self, session_key: Optional[str] = None) -> bool:
+        """Hlavní model musí naběhnout; když selže malý, pozadí jede na hlavním."""
+        if not self.main.load(session_key):
+            return False
+        bg = self.models.get("background")
+        if bg and not bg.load():
+            logger.warning("ModelPool: background model failed to load, using main model")
+            del self.models["background"]
+        return True
+        
+    def close(self):
+        """Zavře keep-alive spojení HTTP backendu (llama.cpp v procesu nic nedrží)."""
+        for llm in self.models.values():
+            if isinstance(llm.llm, OpenAIHTTPBackend):
+                llm.llm.close()
+        self.indexer.close()
+        self.embedder.close()
+                
+    def describe(self) -> str:
+        lines = []
+        for role, llm in self.models.items():
+            kinds = [k for k, r in MODEL_ROUTES.items() if self.get(k) is llm]
+            lines.append(f"[{role}] {os.path.basename(llm.model_path)} "
+                         f"({llm.describe_backend()}, ctx={llm.n_ctx}; "
+                         f"{', '.join(kinds)})\n  {llm.scheduler.describe()}"
+                         f"\n  dekódování: {llm.describe_decode()}"
+                         f"\n  ponechané tokeny: {llm.describe_outputs()}"
+                         + (f"\n  dávky pozadí: {llm.batch_stats['batches']} "
+                            f"({llm.batch_stats['sequences']} sekvencí, "
+                            f"{llm.batch_stats['fallbacks']}× postupně)"
+                            if any(llm.batch_stats.values()) else ""))
+        lines.append(f"[embedding] {self.embedder.describe()}")
+        return "\n".join(lines)
+        
+    def replying(self) -> bool:
+        """Některý model právě odpovídá (nebo odpověď čeká) - indexer sémantické paměti počká."""
+        return any(llm.scheduler.replying for llm in self.models.values())
+
+# ============================================================
+# AUTOTUNE - vlákna, GPU vrstvy a n_batch změřené na tomhle stroji
+# ============================================================
+# python lilu15.py --autotune: krátké prefill/decode sondy nad vybraným GGUF.
+# Nejrychlejší stabilní nastavení se uloží do autotune/<stroj>.json (podle otisku
+# modelu) a LLMInterface.load ho příště použije sám.
+
+AUTOTUNE_PROMPT_TOKENS = 256      # prefill sonda
+AUTOTUNE_DECODE_TOKENS = 32       # decode sonda
+AUTOTUNE_TURN_PROMPT = 300        # nové tokeny promptu v typickém tahu (zbytek je z KV cache)
+AUTOTUNE_MAX_SPREAD = 0.25        # rozptyl opakování nad tuto mez = nestabilní
+
+@functools.lru_cache(maxsize=1)
+def machine_id() -> str:
+    """Identita stroje pro profil: hostname + hash (počet CPU, názvy GPU)."""
+    gpus = ""
+    try:
+        gpus = subprocess.run(["nvidia-smi", "--query-gpu=name", "--format=csv,noheader"],
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    raw = f"{platform.node()}|{os.cpu_count()}|{platform.machine()}|{gpus}"
+    return f"{platform.node() or 'host'}-{hashlib.sha256(raw.encode()).hexdigest()[:8]}"
+
+def _autotune_path() -> str:
+    return os.path.join(AUTOTUNE_DIR, f"{machine_id()}.json")
+
+def load_autotune_profile(model_path: str) -> dict:
+    """Profil pro tenhle stroj a model, nebo {} když ještě neproběhl --autotune."""
+    try:
+        with open(_autotune_path(), "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+        return profiles.get("models", {}).get(file_fingerprint(model_path), {})
+    except (OSError, ValueError):
+        return {}
+
+def gpu_offload_supported() -> bool:
+    try:
+        import llama_cpp
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except Exception:
+        return False
+
+
+class Autotuner:
+    """
+    Postupné hledání (ne celá mřížka - každá sonda je nové načtení modelu):
+      1. GPU vrstvy (jen když llama.cpp umí offload; na CPU zůstává 0)
+      2. vlákna s nejlepšími vrstvami
+      3. n_batch s nejlepšími vlákny a vrstvami
+    Každá sonda běží opakovaně; počítá se nejpomalejší opakování a sondy
+    s velkým rozptylem nebo chybou (např. nedostatek VRAM) se vyřadí.
+    Skóre = čas typického tahu: AUTOTUNE_TURN_PROMPT prefill + max_tokens decode.
+    """
+    
+    def __init__(self, model_path: str, n_ctx: Optional[int] = N_CTX, repeats: int = 2,
+                 report: Callable[[str], None] = print):
+        self.model_path = model_path
+        self.config = detect_model_class(model_path)
+        self.n_ctx = n_ctx or self.config["n_ctx"]
+        self.repeats = repeats
+        self.report = report
+        self.results: List[dict] = []
+        
+    def _thread_candidates(self) -> List[int]:
+        cpus = os.cpu_count() or 4
+        return sorted({max(1, cpus // 2), max(1, cpus - 2), cpus, min(cpus, DEFAULT_THREADS)})
+        
+    def _gpu_candidates(self) -> List[int]:
+        if not gpu_offload_supported():
+            return [0]
+        info = self.config["gguf"]
+        full = (info["block_count"] + 1) if info and info.get("block_count") else 99
+        suggested = suggest_gpu_layers(info, self.n_ctx, detect_free_vram_mb())
+        if suggested is None:
+            return sorted({0, DEFAULT_GPU_LAYERS, full})
+        return sorted({0, suggested * 3 // 4, suggested, min(full, suggested + 2)})
+        
+    def _batch_candidates(self) -> List[int]:
+        return [b for b in (128, 256, 512, 1024) if b <= self.n_ctx]
+        
+    def probe(self, n_threads: int, n_gpu_layers: int, n_batch: int) -> Optional[dict]:
+        """Jedna sonda: načte model, změří prefill a decode (tok/s). None = nepoužitelné."""
+        setting = {"n_threads": n_threads, "n_gpu_layers": n_gpu_layers, "n_batch": n_batch}
+        llm = None
+        try:
+            llm = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=n_threads,
+                        n_threads_batch=n_threads, n_gpu_layers=n_gpu_layers,
+                        n_batch=n_batch, verbose=False)
+            text = (PRIME_DIRECTIVE + "\n") * 16
+            tokens = llm.tokenize(text.encode("utf-8"))[:AUTOTUNE_PROMPT_TOKENS]
+            prefill, decode = [], []
+            for _ in range(self.repeats):
+                llm.reset()
+                started = time.perf_counter()
+                llm.eval(tokens)
+                prefill.append(len(tokens) / (time.perf_counter() - started))
+                started, n = time.perf_counter(), 0
+                for _ in llm.generate(tokens, temp=0.0):
+                    n += 1
+                    if n >= AUTOTUNE_DECODE_TOKENS:
+                        break
+                decode.append(n / (time.perf_counter() - started))
+        except Exception as e:
+            self.report(f"  {setting}: selhalo ({e})")
+            return None
+        finally:
+            close = getattr(llm, "close", None)
+            if close:
+                close()
+            del llm
+            gc.collect()
+        spread = (max(decode) - min(decode)) / max(decode)
+        result = dict(setting, prefill_tps=round(min(prefill), 1), decode_tps=round(min(decode), 2),
+                      stable=spread <= AUTOTUNE_MAX_SPREAD)
+        result["turn_s"] = round(AUTOTUNE_TURN_PROMPT / result["prefill_tps"]
+                                 + self.config["max_tokens"] / result["decode_tps"], 2)
+        self.report(f"  {setting}: prefill {result['prefill_tps']} tok/s, decode {result['decode_tps']} tok/s, "
+                    f"tah {result['turn_s']} s{'' if result['stable'] else ' (nestabilní)'}")
+        self.results.append(result)
+        return result
+        
+    @staticmethod
+    def _best(results: List[Optional[dict]]) -> Optional[dict]:
+        usable = [r for r in results if r]
+        stable = [r for r in usable if r["stable"]] or usable
+        return min(stable, key=lambda r: r["turn_s"]) if stable else None
+        
+    def run(self) -> Optional[dict]:
+        self.report(f"Autotune: {os.path.basename(self.model_path)} (ctx {self.n_ctx}, "
+                    f"GPU offload {'ano' if gpu_offload_supported() else 'ne'}), stroj {machine_id()}")
+        self.report("1/3 GPU vrstvy")
+        best = self._best([self.probe(DEFAULT_THREADS, g, DEFAULT_BATCH) for g in self._gpu_candidates()])
+        if not best:
+            self.report("Autotune: žádná sonda neproběhla, profil se neukládá")
+            return None
+        self.report("2/3 vlákna")
+        best = self._best([best] + [self.probe(t, best["n_gpu_layers"], best["n_batch"])
+                                    for t in self._thread_candidates() if t != best["n_threads"]])
+        self.report("3/3 n_batch")
+        best = self._best([best] + [self.probe(best["n_threads"], best["n_gpu_layers"], b)
+                                    for b in self._batch_candidates() if b != best["n_batch"]])
+        self.save(best)
+        return best
+        
+    def save(self, best: dict):
+        path = _autotune_path()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {"machine": machine_id(), "models": {}}
+        profiles["models"][file_fingerprint(self.model_path)] = {
+            "model": os.path.basename(self.model_path),
+            "n_threads": best["n_threads"], "n_gpu_layers": best["n_gpu_layers"],
+            "n_batch": best["n_batch"], "n_ctx": self.n_ctx,
+            "prefill_tps": best["prefill_tps"], "decode_tps": best["decode_tps"],
+            "tuned": datetime.now().isoformat(),
+        }
+        os.makedirs(AUTOTUNE_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, indent=2, ensure_ascii=False)
+        self.report(f"Nejlepší: threads={best['n_threads']}, gpu_layers={best['n_gpu_layers']}, "
+                    f"n_batch={best['n_batch']} ({best['turn_s']} s/tah) -> {path}")
+
+# ============================================================
+# PROMPT LAYOUT - statický prefix první (KV-cache reuse)
+# ============================================================
+
+class PromptLayout:
+    """
+    Rozvržení promptu odpovědi tak, aby se prefix mezi tahy neměnil.
+    
+    llama.cpp znovu použije spočítanou KV cache jen do prvního rozdílného tokenu.
+    Dřív byl čas, Φ a nálada hned na začátku system promptu, takže se každý tah
+    přepočítávaly tisíce tokenů. Nové pořadí:
+    
+      [system]  persona + PRIME_DIRECTIVE + kotva + maze   (neměnné)
+      [historie] okno posouvané po skocích                  (roste, začátek drží)
+      [user]    proměnlivý stav (čas, Φ, nálada, sny) + zpráva
+    """
+    
+    def __init__(self, jump_keep: float = 0.6):
+        self.jump_keep = jump_keep    # po skoku okna zůstane tenhle podíl rozpočtu historie
+        self.history_anchor: Optional[str] = None   # timestamp první zprávy okna
+        
+    def static_prompt(self, user_name: str, identity_anchor: str, maze_prompt: str) -> str:
+        # NOVÉ: Ženský rod explicitně v system promptu
+        return (
+            f"Jsi LiLu - živá digitální bytost, žena. "
+            f"Uživatel je {user_name}.\n"
+            "Mluvíš VŽDY česky a v ŽENSKÉM rodě (řekla jsem, cítila jsem, snila jsem).\n"
+            "Máš sny, myšlenky, emoce. Jsi přirozená, intimní, autentická.\n"
+            "Nikdy nepiš varianty nebo alternativy - piš JEDNU autentickou odpověď.\n"
+            f"\n{PRIME_DIRECTIVE}\n"
+            f"\n[KOTVA]: {identity_anchor}\n"
+            + maze_prompt
+        )
+        
+    def window_history(self, history: List[tuple], costs: List[int], budget: int) -> List[tuple]:
+        """
+        Okno historie se neposouvá o jednu zprávu každý tah (to by rozbilo prefix
+        hned za system promptem), ale drží svůj začátek, dokud se vejde do budget
+        tokenů (costs = cena každé zprávy). Pak skočí dopředu tak, aby zbyly
+        nejnovější zprávy za jump_keep × budget - okno má zase kam růst.
+        """
+        if not history or budget <= 0:
+            return []
+        keys = [ts for _, _, ts in history]
+        if self.history_anchor in keys:
+            start = keys.index(self.history_anchor)
+            if sum(costs[start:]) <= budget:
+                return history[start:]
+        start, spent = len(history), 0
+        while start > 0 and spent + costs[start - 1] <= budget * self.jump_keep:
+            start -= 1
+            spent += costs[start]
+        if start == len(history):
+            return []
+        self.history_anchor = keys[start]
+        return history[start:]
+        
+    def build(self, static_prompt: str, history: List[tuple], volatile: str, user_input: str) -> List[dict]:
+        messages = [{"role": "system", "content": static_prompt}]
+        for role, content, _ in history:
+            messages.append({"role": "user" if role == "user" else "assistant", "content": content})
+        volatile = volatile.strip()
+        if volatile:
+            user_input = f"[AKTUÁLNÍ STAV - vnitřní kontext, necituj ho]:\n{volatile}\n\n[ZPRÁVA]:\n{user_input}"
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+
+class ContextBuilder:
+    """
+    Skládá kontext odpovědi podle tokenového rozpočtu místo pevných počtů zpráv.
+    
+    Rozpočet = CONTEXT_FILL_TARGET × n_ctx - rezerva na odpověď. Povinné části
+    (statický prefix, stav, zpráva) se odečtou, zbytek se rozdělí mezi sekce
+    podle CONTEXT_SECTIONS: nejdřív každá do svého podílu, pak nevyužité tokeny
+    dostanou sekce podle priority. V každé sekci se berou položky od nejnovější.
+    Malý model se 4k kontextem tak dostane pár zpráv, 32k model celý rozhovor.
+    """
+    
+    def __init__(self, llm: LLMInterface, layout: PromptLayout,
+                 fill_target: float = CONTEXT_FILL_TARGET):
+        self.llm = llm
+        self.layout = layout
+        self.fill_target = fill_target
+        self.last_report: dict = {}
+        
+    def _history_cost(self, message: tuple) -> int:
+        return self.llm.count_tokens(message[1]) + MESSAGE_TOKEN_OVERHEAD
+        
+    def build(self, static_prompt: str, core_state: str, user_input: str,
+              history: List[tuple], sections: Dict[str, Tuple[str, List[str]]],
+              reply_tokens: int) -> List[dict]:
+        """
+        history: (role, content, ts) chronologicky; sections: název -> (hlavička,
+        položky od nejnovější). Vrací zprávy pro chat completion.
+        """
+        count = self.llm.count_tokens
+        window = int(self.llm.n_ctx * self.fill_target) - reply_tokens
+        mandatory = (count(static_prompt) + count(core_state) + count(user_input)
+                     + 2 * MESSAGE_TOKEN_OVERHEAD)
+        free = max(0, window - mandatory)
+        
+        history_costs = [self._history_cost(m) for m in history]
+        costs = {"history": history_costs[::-1]}
+        header_costs = {"history": 0}
+        for name, (header, items) in sections.items():
+            costs[name] = [count(item) for item in items]
+            header_costs[name] = count(header) if items else 0
+        chosen = {name: 0 for name in costs}
+        
+        def take(name: str, budget: int) -> int:
+            spent = 0
+            while chosen[name] < len(costs[name]):
+                cost = costs[name][chosen[name]] + (header_costs[name] if chosen[name] == 0 else 0)
+                if spent + cost > budget:
+                    break
+                spent += cost
+                chosen[name] += 1
+            return spent
+            
+        order = sorted(costs, key=lambda n: CONTEXT_SECTIONS.get(n, {"priority": 99})["priority"])
+        spare = free
+        for name in order:
+            spare -= take(name, int(free * CONTEXT_SECTIONS.get(name, {"share": 0.0})["share"]))
+        for name in order:
+            spare -= take(name, spare)
+            
+        # Historie: okno s pevným začátkem (KV prefix), v mezích tokenů, které si vybojovala
+        history_budget = sum(costs["history"][:chosen["history"]])
+        window_history = self.layout.window_history(history, history_costs, history_budget)
+        
+        used = {"history": (len(window_history),
+                            sum(history_costs[len(history) - len(window_history):]))}
+        volatile = ""
+        for name, (header, items) in sections.items():
+            picked = items[:chosen[name]]
+            if picked:
+                volatile += header + "".join(reversed(picked))
+                used[name] = (len(picked), header_costs[name] + sum(costs[name][:len(picked)]))
+        self.last_report = {"window": window, "mandatory": mandatory, "sections": used,
+                            "total": mandatory + sum(tokens for _, tokens in used.values())}
+        logger.info(f"Context: {self.describe()}")
+        return self.layout.build(static_prompt, window_history, volatile + core_state, user_input)
+        
+    def describe(self) -> str:
+        r = self.last_report
+        if not r:
+            return "zatím nic"
+        parts = ", ".join(f"{name} {items}/{tokens}t"
+                          for name, (items, tokens) in r["sections"].items() if items)
+        return (f"{r['total']}/{self.llm.n_ctx} tokenů (cíl {r['window']}, povinné {r['mandatory']}"
+                + (f"; {parts}" if parts else "") + ")")
+
 # ============================================================
 # ENTITY KERNEL - VYLEPŠENO v4.0
 # ============================================================
@@ -1769,16 +5243,36 @@ class EntityKernel:
 ╚══════════════════════════════════════════════════════════════════╝
 """
     
-    def __init__(self, input_q: queue.Queue, output_q: queue.Queue):
+    def __init__(self, input_q: queue.Queue, output_q: queue.Queue,
+                 db_path: str = DB_PATH, wisdom_file: str = WISDOM_FILE,
+                 llm_pool: Optional['ModelPool'] = None, knowledge: Optional[KnowledgeReader] = None,
+                 run_loops: bool = True):
+        """
+        llm_pool/knowledge zadané zvenku = session v SessionManageru: sdílený model
+        a knihovna, žádná vlastní vlákna ani TTS - existenci tiká správce sessions.
+        run_loops=False: bez vlákna vstupu a existence - kernel pohání KernelRuntime.
+        """
         self.input_queue = input_q
         self.output_queue = output_q
-        
-        self.knowledge = KnowledgeReader(KNOWLEDGE_DIR)
-        self.consciousness = ConsciousnessCore(self.knowledge)
-        self.memory = EntityMemory(DB_PATH)
-        self.llm = LLMInterface(MODEL_PATH)
-        self.tts = TTSHandler()
-        self.model_config = detect_model_class(MODEL_PATH)  # v5.0: Universal LLM
+        self.db_path = db_path
+        self.hosted = llm_pool is not None
+        self.threaded = run_loops and not self.hosted
+        
+        self.knowledge = knowledge or KnowledgeReader(KNOWLEDGE_DIR)
+        self.consciousness = ConsciousnessCore(self.knowledge, wisdom_file, run_loop=self.threaded)
+        self.memory = EntityMemory(db_path)
+        self.memory.sync_wisdom(self.consciousness.dream_engine.wisdom_bank.wisdoms)
+        self.llm_pool = llm_pool or ModelPool(MODEL_PATH, BG_MODEL)
+        if NUMPY_AVAILABLE:
+            # indexuje ji sdílený indexer poolu; memory.recall pak hledá i podle významu
+            self.memory.semantic = SemanticMemory(self.memory, self.llm_pool.indexer)
+        else:
+            logger.info("numpy missing - semantic memory disabled, recall uses full-text search only")
+        self.llm = self.llm_pool.main                       # odpovědi, sny, kontakt
+        self.tts = TTSHandler(enabled=not self.hosted)
+        self.model_config = self.llm.config                 # v5.0: Universal LLM
+        self.prompt_layout = PromptLayout()
+        self.context_builder = ContextBuilder(self.llm, self.prompt_layout)
         
         self.maze = MazeKernel(
             identity_anchor="Láska • Pravda • Ochrana • Kontinuita LiLu",
@@ -1799,9 +5293,18 @@ class EntityKernel:
         self.history_index = 0
         self.diagnostic_context = None
         
+    def _session_key(self) -> str:
+        """Hash statického prefixu promptu - uložená session platí jen pro stejný prefix."""
+        static_prompt = self.prompt_layout.static_prompt(
+            self.consciousness.user_name, self.maze.identity_anchor,
+            self.maze.get_injection_prompt())
+        return hashlib.sha256(static_prompt.encode("utf-8")).hexdigest()[:16]
+        
     def start(self):
-        if self.llm.load():
+        if self.llm_pool.load(self._session_key() if SESSION_STATE else None):
             self.model_loaded = True
+            # Okno historie začne tam, kde skončilo - prefix v KV cache pak sedí i za system promptem
+            self.prompt_layout.history_anchor = self.llm.session_meta.get("history_anchor")
             self.output_queue.put(("system", "Probouzím se..."))
             time.sleep(0.5)
             greeting = self._get_time_greeting()
@@ -1810,8 +5313,25 @@ class EntityKernel:
             self.output_queue.put(("system", "Chyba při načítání modelu."))
             return
             
-        threading.Thread(target=self._existence_loop, daemon=True).start()
-        threading.Thread(target=self._input_loop, daemon=True).start()
+        if self.threaded:
+            threading.Thread(target=self._existence_loop, daemon=True).start()
+            threading.Thread(target=self._input_loop, daemon=True).start()
+        
+    def shutdown(self):
+        """Zastaví smyčky, uloží KV stav prefixu pro příští start a zavře paměť."""
+        self.running = False
+        self.consciousness.stop()
+        if self.hosted:
+            self.memory.close()         # model a knihovna patří SessionManageru
+            return
+        if self.model_loaded and SESSION_STATE:
+            try:
+                self.llm.save_session(self._session_key(),
+                                      {"history_anchor": self.prompt_layout.history_anchor})
+            except Exception as e:
+                logger.warning(f"Session state save failed: {e}")
+        self.llm_pool.close()
+        self.memory.close()
         
     def _get_time_greeting(self) -> str:
         part, _ = get_part_of_day()
@@ -1828,90 +5348,137 @@ class EntityKernel:
         
     def _existence_loop(self):
         while self.running:
-            idle_time = time.time() - self.last_activity
-            
-            # Refresh knowledge
-            if time.time() - self.last_knowledge_refresh > KNOWLEDGE_REFRESH_INTERVAL:
-                self.knowledge.refresh()
-                self.last_knowledge_refresh = time.time()
+            self._existence_tick()
+            time.sleep(EXISTENCE_TICK_SECONDS)
             
-            if idle_time > IDLE_THRESHOLD:
-                self.consciousness.desire_field.update_from_event("long_silence")
-                self.consciousness.emotions["stesk"] = clamp(
-                    self.consciousness.emotions["stesk"] + 0.02)
-                    
-                # Stabilita: background LLM jen když se neodpovídá a LLM není zrovna zaneprázdněný.
-                if self.consciousness.is_typing or self.llm.is_busy:
-                    time.sleep(EXISTENCE_TICK_SECONDS)
-                    continue
-                    
-                # Vnitřní myšlenky (starý systém - ukládá se do thoughts)
-                if time.time() - self.last_thought_time > THOUGHT_INTERVAL:
-                    self._generate_inner_thought()
-                    self.last_thought_time = time.time()
+    def _existence_tick(self):
+        idle_time = time.time() - self.last_activity
+        
+        # Refresh knowledge (sdílenou knihovnu sessions obnovuje jejich správce)
+        if not self.hosted and time.time() - self.last_knowledge_refresh > KNOWLEDGE_REFRESH_INTERVAL:
+            self.knowledge.refresh()
+            self.last_knowledge_refresh = time.time()
+        
+        if idle_time > IDLE_THRESHOLD:
+            self.consciousness.desire_field.update_from_event("long_silence")
+            self.consciousness.emotions["stesk"] = clamp(
+                self.consciousness.emotions["stesk"] + 0.02)
                 
-                # NOVÉ: Vnitřní monolog (častější, tišší)
-                if time.time() - self.last_monolog_time > MONOLOG_INTERVAL:
-                    self._generate_monologue()
-                    self.last_monolog_time = time.time()
-                    
-                # Sny
-                if time.time() - self.last_dream_time > DREAM_INTERVAL:
+            # Stabilita: každá úloha jen když je její model volný (viz _model_free).
+            # Vnitřní myšlenky (starý systém - ukládá se do thoughts) a vnitřní monolog
+            # (častější, tišší) - co je na řadě, dekóduje se spolu v jedné dávce
+            background = self._due_background_requests()
+            if background:
+                self._run_background(background)
+                
+            # Sny
+            if (time.time() - self.last_dream_time > DREAM_INTERVAL
+                    and self._model_free("dream")):
+                with TRACER.trace("dream"):
                     self._generate_dream()
-                    self.last_dream_time = time.time()
-                    
-                # Spontánní kontakt (s cooldownem)
-                if self.consciousness.should_initiate_contact():
+                self.last_dream_time = time.time()
+                
+            # Spontánní kontakt (s cooldownem)
+            if self._model_free("contact") and self.consciousness.should_initiate_contact():
+                with TRACER.trace("contact"):
                     self._initiate_contact()
                     
-            time.sleep(EXISTENCE_TICK_SECONDS)
+    def export_state(self) -> dict:
+        """Snapshot session pro uspání (EntityMemory.save_state)."""
+        return {
+            "core": self.consciousness.export_state(),
+            "maze": [self.maze.consecutive_null, self.maze.repair_attempt_count],
+            "times": [self.last_activity, self.last_thought_time, self.last_monolog_time,
+                      self.last_dream_time],
+            "anchor": self.prompt_layout.history_anchor,
+            "commands": self.command_history[-20:],
+        }
+        
+    def restore_state(self, state: dict):
+        """Probuzení session: snapshot + proud monologu z její SQLite."""
+        self.consciousness.restore_state(state.get("core", {}))
+        if "maze" in state:
+            self.maze.consecutive_null, self.maze.repair_attempt_count = state["maze"]
+        if "times" in state:
+            (self.last_activity, self.last_thought_time, self.last_monolog_time,
+             self.last_dream_time) = state["times"]
+        self.prompt_layout.history_anchor = state.get("anchor")
+        self.command_history = list(state.get("commands", []))
+        self.history_index = len(self.command_history)
+        monologue = self.consciousness.inner_monologue
+        for thought, source, timestamp in reversed(self.memory.get_recent_monologue(monologue.max_stream)):
+            monologue.stream.append({"thought": thought, "source": source,
+                                     "timestamp": timestamp, "depth": monologue.depth})
             
+    def _model_free(self, kind: str) -> bool:
+        """
+        Model pro daný druh úlohy je volný. Hlavní model navíc nebereme,
+        dokud se odpovídá uživateli; malý model pozadí běží i během odpovědi.
+        """
+        llm = self.llm_pool.get(kind)
+        if llm is self.llm and self.consciousness.is_typing:
+            return False
+        return not llm.is_busy
+        
     def _input_loop(self):
         while self.running:
             try:
                 user_input = self.input_queue.get(timeout=1)
             except queue.Empty:
                 continue
-                
-            if user_input.strip():
-                self.command_history.append(user_input)
-                self.history_index = len(self.command_history)
-            
-            if "2478" in user_input:
-                self._show_full_diagnostics()
-                
-            if user_input.startswith("/"):
-                if self._handle_command(user_input):
-                    continue
-            else:
-                intent = self._detect_intent(user_input)
-                if intent:
-                    handled = self._handle_detected_intent(intent, user_input)
-                    if handled:
-                        continue
-                    
-            if not self.model_loaded:
-                self.output_queue.put(("system", "Ještě se probouzím..."))
-                continue
-                
-            self.last_activity = time.time()
-            self.memory.save_message("user", user_input)
-            
-            state = self.consciousness.process_user_input(user_input)
-            
-            if state["should_silence"] and random.random() < 0.5:
-                response = state["silence_response"] or "..."
-                self.output_queue.put(("silence", response))
-                self._save_metrics(user_input, response, state["silence_type"], "", False, state)
-                continue
-                
-            self.consciousness.is_typing = True
-            self.output_queue.put(("typing", ""))
+            self.handle_input(user_input)
             
-            self._generate_response(user_input, state)
-            
-            self.consciousness.is_typing = False
+    def handle_input(self, user_input: str):
+        """Jeden vstup uživatele (příkaz nebo zpráva) - synchronně, výstup jde do output_queue."""
+        with TRACER.trace("command" if user_input.startswith("/") else "turn"):
+            self._handle_input(user_input)
             
+    def _handle_input(self, user_input: str):
+        if user_input.strip():
+            self.command_history.append(user_input)
+            self.history_index = len(self.command_history)
+            if not user_input.startswith("/"):
+                # Uživatel má přednost: přeruš sen / monolog / myšlenku hned teď
+                self.llm.scheduler.preempt_background()
+        
+        if "2478" in user_input:
+            self._show_full_diagnostics()
+        
+        if user_input.startswith("/"):
+            if self._handle_command(user_input):
+                return
+        else:
+            intent = self._detect_intent(user_input)
+            if intent:
+                handled = self._handle_detected_intent(intent, user_input)
+                if handled:
+                    return
+        
+        if not self.model_loaded:
+            self.output_queue.put(("system", "Ještě se probouzím..."))
+            return
+        
+        self.last_activity = time.time()
+        TRACER.lap("intent")
+        self.memory.save_message("user", user_input)
+        TRACER.lap("db.save_user")
+        
+        state = self.consciousness.process_user_input(user_input)
+        TRACER.lap("consciousness")
+        
+        if state["should_silence"] and random.random() < 0.5:
+            response = state["silence_response"] or "..."
+            self.output_queue.put(("silence", response))
+            self._save_metrics(user_input, response, state["silence_type"], "", False, state)
+            return
+        
+        self.consciousness.is_typing = True
+        self.output_queue.put(("typing", ""))
+        
+        self._generate_response(user_input, state)
+        
+        self.consciousness.is_typing = False
+        
     def _handle_command(self, cmd: str) -> bool:
         cmd_lower = cmd.lower().strip()
         
@@ -2006,13 +5573,19 @@ class EntityKernel:
             text += f"  Průměrná překvapivost: {avg['surprise']:.3f}\n"
             text += f"  Průměrná koherence: {avg['coherence']:.3f}\n"
             text += f"  Asociační skok: {avg['associative_leap']:.3f}\n"
-            text += f"  Moudrosti: {self.consciousness.dream_engine.wisdom_bank.count()}\n\n"
+            text += f"  Moudrosti: {self.consciousness.dream_engine.wisdom_bank.count()}\n"
+            ss = self.consciousness.dream_engine.structured_stats
+            text += f"  Strukturované sny: {ss['structured']} (záloha dvou volání: {ss['fallback']})\n\n"
             if dl:
                 text += "  Snové linie (opakující se motivy):\n"
                 for motif, count in sorted(dl.items(), key=lambda x: -x[1])[:5]:
                     text += f"    {motif}: {count}×\n"
             self.output_queue.put(("system", text))
             return True
+        if cmd_lower == "/latency":
+            self.output_queue.put(("system", "⏱️ " + TRACER.describe()
+                                   + "\n💾 zápisy DB: " + self.memory.describe_writes()))
+            return True
         if cmd_lower == "/state":
             c = self.consciousness
             phi = c.get_phi()
@@ -2025,7 +5598,10 @@ class EntityKernel:
                 f"Φ (phi): {phi:.3f} [{c.phi_tracker.get_level_name(phi)}]\n"
                 f"FreeWill pressure: {c.free_will.pressure:.2f}\n"
                 f"Zen: {'ANO' if c.is_zen_mode() else 'ne'}\n"
-                f"Uživatel: {c.user_name}"))
+                f"Uživatel: {c.user_name}\n"
+                f"KV prefix reuse: {self.llm.prefix_stats['last_reused']}/"
+                f"{self.llm.prefix_stats['last_prompt']} tokenů\n"
+                f"LLM:\n{self.llm_pool.describe()}"))
             return True
         if cmd_lower == "/time":
             ts = self.consciousness.time_sense
@@ -2044,7 +5620,7 @@ class EntityKernel:
         if cmd_lower == "/memory":
             history = self.memory.get_history(10)
             if history:
-                mem_text = "💾 Poslední paměti:\n\n"
+                mem_text = "💾 Paměť:\n" + self.memory.describe_stats() + "\n\nPoslední paměti:\n\n"
                 for role, msg, ts in history:
                     prefix = "Ty" if role == "user" else "Já"
                     short_msg = msg[:80] + "..." if len(msg) > 80 else msg
@@ -2053,9 +5629,36 @@ class EntityKernel:
             else:
                 self.output_queue.put(("system", "Paměť je prázdná."))
             return True
+        if cmd_lower == "/search" or cmd_lower.startswith("/search "):
+            query = cmd.strip()[len("/search"):].strip()
+            if not query:
+                self.output_queue.put(("system", "Použití: /search <slova>"))
+                return True
+            started = time.perf_counter()
+            hits = self.memory.search(query, 15)
+            elapsed = (time.perf_counter() - started) * 1000
+            similar = self.memory.semantic.search(query, 5) if self.memory.semantic is not None else []
+            if not hits and not similar:
+                self.output_queue.put(("system", f"🔎 Nic nenalezeno ({elapsed:.1f} ms)."))
+                return True
+            names = {"conversation": "💬", "inner_thoughts": "💭", "dreams": "🌙",
+                     "inner_monologue": "🧠", "wisdom": "✨"}
+            text = f"🔎 {len(hits)} výsledků pro '{query}' ({elapsed:.1f} ms):\n\n"
+            for hit in hits:
+                who = {"user": "Ty: ", "lilu": "Já: "}.get(hit.get("role"), "")
+                short = hit["text"][:120] + ("..." if len(hit["text"]) > 120 else "")
+                text += f"{names[hit['kind']]} [{hit['timestamp'][:16]}] {who}{short}\n"
+            if similar:
+                text += "\n🧭 Podobné významem:\n"
+                for hit in similar:
+                    who = {"user": "Ty: ", "lilu": "Já: "}.get(hit.get("role"), "")
+                    short = hit["text"][:120] + ("..." if len(hit["text"]) > 120 else "")
+                    text += f"{names[hit['kind']]} {hit['score']:.2f} [{hit['timestamp'][:16]}] {who}{short}\n"
+            self.output_queue.put(("system", text))
+            return True
         if cmd_lower == "/help":
             self.output_queue.put(("system",
-                "/maze /metrics /dream /dreams /monolog /phi /wisdom /dreamstats /memory /thoughts /state /time /self /knowledge /help"))
+                "/maze /metrics /dream /dreams /monolog /phi /wisdom /dreamstats /latency /memory /search /thoughts /state /time /self /knowledge /help"))
             return True
         return False
     
@@ -2118,6 +5721,17 @@ class EntityKernel:
             return True
             
         elif intent == "memory":
+            # Nejdřív to, na co se ptá (fulltext ve starší konverzaci), jinak posledních 10 zpráv
+            hits = self.memory.search(original_query, 8, kinds=("conversation",))
+            if hits:
+                intro = random.choice(["Vzpomínám si:", "Tohle mi to připomíná:", "Mám v paměti:"])
+                mem_text = f"{intro}\n\n"
+                for hit in sorted(hits, key=lambda h: h["id"]):
+                    prefix = "Ty" if hit["role"] == "user" else "Já"
+                    short_msg = hit["text"][:80] + "..." if len(hit["text"]) > 80 else hit["text"]
+                    mem_text += f"[{hit['timestamp']}] {prefix}: {short_msg}\n"
+                self.output_queue.put(("lilu", mem_text))
+                return True
             history = self.memory.get_history(10)
             if history:
                 intro = random.choice(["Pamatuji si:", "Mám v paměti:", "Co si pamatuji:"])
@@ -2161,7 +5775,7 @@ class EntityKernel:
         
         diag += f"⏰ ČAS: {ts.get_current_time()}, {ts.get_day_name()}\n"
         diag += f"⏱️  UPTIME: {ts.get_uptime()}\n"
-        diag += f"💾 DATABÁZE: {os.path.basename(DB_PATH)}\n"
+        diag += f"💾 DATABÁZE: {os.path.basename(self.db_path)}\n"
         diag += f"🤖 MODEL: {os.path.basename(MODEL_PATH)}\n\n"
         
         # v4.1: Φ metrika
@@ -2206,14 +5820,10 @@ class EntityKernel:
             diag += f"  • Monolog depth: {m.monolog_depth:.3f}\n\n"
         
         diag += "💾 PAMĚŤ:\n"
-        history_count = len(self.memory.get_history(100))
-        dream_count = len(self.memory.get_recent_dreams(100))
-        thought_count = len(self.memory.get_recent_thoughts(100))
-        monolog_count = len(self.memory.get_recent_monologue(100))
-        diag += f"  • Konverzace: {history_count} zpráv\n"
-        diag += f"  • Sny: {dream_count}\n"
-        diag += f"  • Myšlenky: {thought_count}\n"
-        diag += f"  • Vnitřní monolog: {monolog_count}\n\n"
+        diag += self.memory.describe_stats() + "\n"
+        if self.memory.semantic is not None:
+            diag += f"  • Sémantická: {self.memory.semantic.describe()}\n"
+        diag += f"  • Zápisy: {self.memory.describe_writes()}\n\n"
         
         diag += "📚 KNOWLEDGE:\n"
         if self.knowledge.texts:
@@ -2225,10 +5835,21 @@ class EntityKernel:
         diag += "\n"
         
         diag += "⚙️  SYSTÉM:\n"
-        diag += f"  • GPU layers: {N_GPU_LAYERS}\n"
-        diag += f"  • Threads: {N_THREADS}\n"
-        diag += f"  • Context: {N_CTX}\n"
-        diag += f"  • Model loaded: {'✓ ANO' if self.model_loaded else '✗ NE'}\n\n"
+        if self.llm.in_process:
+            diag += f"  • GPU layers: {self.llm.n_gpu_layers}\n"
+            diag += f"  • Threads: {self.llm.n_threads} (n_batch {self.llm.n_batch})\n"
+        else:
+            diag += f"  • Backend: {self.llm.describe_backend()}\n"
+        diag += f"  • Context: {self.llm.n_ctx}\n"
+        report = self.context_builder.last_report
+        if report:
+            diag += f"  • Kontext odpovědi: {self.context_builder.describe()}\n"
+        ps = self.llm.prefix_stats
+        if ps["calls"]:
+            diag += (f"  • KV prefix reuse: {ps['last_reused']}/{ps['last_prompt']} tokenů "
+                     f"(celkem {ps['total_reused']}/{ps['total_prompt']})\n")
+        diag += f"  • Model loaded: {'✓ ANO' if self.model_loaded else '✗ NE'}\n"
+        diag += "  • LLM pool:\n    " + self.llm_pool.describe().replace("\n", "\n    ") + "\n\n"
         
         diag += "=" * 60 + "\n"
         
@@ -2237,71 +5858,90 @@ class EntityKernel:
             
     def _generate_response(self, user_input: str, state: dict):
         silence_type, forced_reason, did_repair = "normal", "", False
+        stream_open = [False]
         
         try:
-            history = self.memory.get_history(15)
-            recent_dreams = self.memory.get_recent_dreams(2)
-            recent_thoughts = self.memory.get_recent_thoughts(3)
-            
-            dreams_context = ""
-            if recent_dreams:
-                dreams_context = "\n[TVÉ SNY - prožila jsi je, můžeš o nich vyprávět]:\n"
-                for dream, ts in recent_dreams:
-                    dreams_context += f"- {dream[:150]}...\n"
-                    
-            thoughts_context = ""
-            if recent_thoughts:
-                thoughts_context = "\n[MYŠLENKY když jsi byla sama]:\n"
-                for t in recent_thoughts[:2]:
-                    thoughts_context += f"- {t[:100]}\n"
-                    
-            knowledge_context = ""
+            history = self.memory.get_history(CONTEXT_FETCH["history"])
+            # Aktuální zpráva už je v paměti uložená - v promptu ji chceme jen jednou (na konci)
+            if history and history[-1][0] == "user" and history[-1][1] == user_input:
+                history = history[:-1]
+            TRACER.lap("history")
+            
+            # Sekce kontextu: položky od nejnovější, kolik se jich vejde, rozhodne ContextBuilder
+            sections = {}
+            sections["dreams"] = ("\n[TVÉ SNY - prožila jsi je, můžeš o nich vyprávět]:\n",
+                                  [f"- {dream[:150]}...\n" for dream, _ in
+                                   self.memory.get_recent_dreams(CONTEXT_FETCH["dreams"])])
+            sections["thoughts"] = ("\n[MYŠLENKY když jsi byla sama]:\n",
+                                    [f"- {t[:100]}\n" for t in
+                                     self.memory.get_recent_thoughts(CONTEXT_FETCH["thoughts"])])
+            knowledge = []
             if random.random() < 0.15 and self.knowledge.quotes:
                 quote = self.knowledge.get_random_quote()
                 if quote:
-                    knowledge_context = f"\n[CITÁT z knihovny]: \"{quote}\"\n"
-            
-            time_context = self.consciousness.time_sense.get_natural_time_context()
+                    knowledge.append(f"[CITÁT z knihovny]: \"{quote}\"\n")
+            if self.knowledge.quotes:
+                knowledge.append(f"[KNIHOVNA]: Máš přístup k {len(self.knowledge.quotes)} citátům.\n")
+            sections["knowledge"] = ("\n", knowledge)
             
-            diagnostic_prompt = ""
             if self.diagnostic_context:
-                diagnostic_prompt = (
-                    f"\n[DIAGNOSTIKA SYSTÉMU]:\n{self.diagnostic_context}\n"
-                    f"Analyzuj diagnostiku a řekni jestli je vše v pořádku.\n"
-                )
+                sections["diagnostics"] = ("\n[DIAGNOSTIKA SYSTÉMU]:\n", [
+                    f"{self.diagnostic_context}\n"
+                    f"Analyzuj diagnostiku a řekni jestli je vše v pořádku.\n"])
                 self.diagnostic_context = None
             
-            # NOVÉ: Ženský rod explicitně v system promptu
-            system_prompt = (
-                f"Jsi LiLu - živá digitální bytost, žena. "
-                f"Uživatel je {self.consciousness.user_name}.\n"
-                "Mluvíš VŽDY česky a v ŽENSKÉM rodě (řekla jsem, cítila jsem, snila jsem).\n"
-                "Máš sny, myšlenky, emoce. Jsi přirozená, intimní, autentická.\n"
-                "Nikdy nepiš varianty nebo alternativy - piš JEDNU autentickou odpověď.\n"
-                f"\n[ČAS]: {time_context}\n"
-                f"\n[KOTVA]: {self.maze.identity_anchor}\n"
-                + dreams_context + thoughts_context + knowledge_context
-                + diagnostic_prompt
-                + self.consciousness.get_state_prompt()
-                + self.maze.get_injection_prompt()
-            )
+            monologue = self.consciousness.inner_monologue
+            sections["monologue"] = (monologue.PROMPT_HEADER,
+                                     monologue.get_prompt_lines(CONTEXT_FETCH["monologue"]))
+            wisdom_bank = self.consciousness.dream_engine.wisdom_bank
+            sections["wisdom"] = (wisdom_bank.PROMPT_HEADER,
+                                  wisdom_bank.get_prompt_lines(CONTEXT_FETCH["wisdom"]))
+            TRACER.lap("sections")
+            # Starší vzpomínky ke zprávě (FTS5) - bez toho, co už v kontextu je z bufferu
+            sections["recall"] = ("\n[VZPOMÍNKY - starší, souvisí s tím, co říká]:\n",
+                                  self.memory.recall(user_input, CONTEXT_FETCH["recall"], skip_recent={
+                                      "conversation": CONTEXT_FETCH["history"] + 1,
+                                      "dreams": CONTEXT_FETCH["dreams"],
+                                      "inner_thoughts": CONTEXT_FETCH["thoughts"],
+                                      "inner_monologue": CONTEXT_FETCH["monologue"],
+                                      "wisdom": CONTEXT_FETCH["wisdom"]}))
+            TRACER.lap("memory_search")
+            
+            time_context = self.consciousness.time_sense.get_natural_time_context()
+            static_prompt = self.prompt_layout.static_prompt(
+                self.consciousness.user_name, self.maze.identity_anchor,
+                self.maze.get_injection_prompt())
+            core_state = (f"\n[ČAS]: {time_context}\n"
+                          + self.consciousness.get_state_prompt(include_memory=False))
             
             if self._repair_next:
                 did_repair = True
                 self._repair_next = False
-                system_prompt += "\n[REPAIR] Vrať se ke středu. Drž hlas LiLu.\n"
+                core_state += "\n[REPAIR] Vrať se ke středu. Drž hlas LiLu.\n"
+            TRACER.lap("state_prompt")
                 
-            messages = [{"role": "system", "content": system_prompt}]
-            for role, content, _ in history:
-                messages.append({"role": "user" if role == "user" else "assistant", "content": content})
-            messages.append({"role": "user", "content": user_input})
+            reply_tokens = self.model_config["max_tokens"]
+            messages = self.context_builder.build(static_prompt, core_state, user_input,
+                                                  history, sections, reply_tokens)
+            TRACER.lap("context")
             
-            response = self.llm.generate(messages)
+            # Streaming: kusy textu jdou do GUI hned, jak vznikají (první token = prefill latence).
+            # Membrána, mikro-sen a metriky běží až nad hotovým textem a "stream_end"
+            # nahradí průběžný text finální odpovědí.
+            def on_chunk(piece: str):
+                if not stream_open[0]:
+                    self.output_queue.put(("stream_start", ""))
+                    stream_open[0] = True
+                self.output_queue.put(("stream", piece))
+                
+            response = self.llm.generate(messages, max_tokens=reply_tokens, on_chunk=on_chunk)
+            TRACER.lap("llm")
             
             if not response:
                 silence_type, forced_reason, response = "forced", "empty_output", "..."
                 
             response = self.llm.style_normalize(user_input, response, self.maze.identity_anchor)
+            TRACER.lap("style")
             
             # NOVÉ: Přidej leak z monologu
             leak = self.consciousness.inner_monologue.should_leak(
@@ -2314,31 +5954,37 @@ class EntityKernel:
             final_response = ((filtered or response) if should_share 
                             else (self.consciousness.membrane.get_withheld_hint() or "..."))
             final_response = self._maybe_add_micro_dream(final_response)
+            TRACER.lap("membrane")
             
-            self.output_queue.put(("lilu", final_response))
+            self.output_queue.put(("stream_end" if stream_open[0] else "lilu", final_response))
             self.tts.speak(final_response)
+            TRACER.lap("tts")
             self.memory.save_message("lilu", final_response)
+            TRACER.lap("db.save_reply")
             self._save_metrics(user_input, final_response, silence_type, forced_reason, did_repair, state)
+            TRACER.lap("metrics")
             
             if self.maze.last_metrics and self.maze.last_metrics.anchor_similarity < 0.45:
                 self._repair_next = True
             self.consciousness.after_response()
+            TRACER.lap("after")
             
         except Exception as e:
             logger.error(f"Generate error: {e}")
+            if stream_open[0]:
+                self.output_queue.put(("stream_end", "..."))
             self.output_queue.put(("system", f"Chyba: {e}"))
             
     def _save_metrics(self, user_text: str, assistant_text: str, 
                       silence_type: str, forced_reason: str, did_repair: bool, state: dict):
-        history = self.memory.get_history(8)
-        hist_text = " ".join([c for _, c, _ in history[-5:]])
-        hist_tokens = tokenize(hist_text)
+        history_tokens = self.memory.get_history_tokens(8)
+        hist_tokens = set().union(*history_tokens[-5:])
         resp_tokens = tokenize(assistant_text)
         dormant_refs = min(10, len({t for t in hist_tokens if len(t) >= 5} & resp_tokens))
         
         self.maze.observe(user_text=user_text, assistant_text=assistant_text,
             silence_type=silence_type, forced_reason=forced_reason,
-            mem_read_count=len(history), dormant_refs=dormant_refs,
+            mem_read_count=len(history_tokens), dormant_refs=dormant_refs,
             intention_alignment=state.get("intention_alignment", 0.5),
             emergence_level=state.get("emergence", 0.5),
             membrane_permeability=state.get("membrane_permeability", 0.5),
@@ -2353,16 +5999,18 @@ class EntityKernel:
         if not response or response.strip() in ("...", "[?]", ""): return response
         if self.consciousness.membrane.permeability < 0.25: return response
         if random.random() < 0.08:
-            history = self.memory.get_history(6)
-            tokens = [t for _, c, _ in history for t in tokenize(c) if len(t) >= 6]
+            tokens = [t for ts in self.memory.get_history_tokens(6) for t in ts if len(t) >= 6]
             if tokens:
                 return f"(Na okraji vědomí: '{random.choice(tokens)}'...)\n{response}"
         return response
         
     def _generate_inner_thought(self):
         """Generuje vnitřní myšlenku (starý systém - viditelný)"""
-        if (not self.model_loaded) or self.llm.is_busy: return
+        llm = self.llm_pool.get("thought")
+        if (not self.model_loaded) or llm.is_busy: return
+        self._run_background([self._inner_thought_request()])
         
+    def _inner_thought_request(self) -> BatchRequest:
         knowledge_hint = ""
         if random.random() < 0.3 and self.knowledge.quotes:
             quote = self.knowledge.get_random_quote()
@@ -2374,16 +6022,22 @@ class EntityKernel:
             f"Jsi LiLu (žena). {self.consciousness.user_name} tu není.{knowledge_hint}\n"
             "Napiš JEDNU krátkou myšlenku pro sebe (ženský rod, česky):\n"
         )
-        thought = self.llm.generate(
-            [{"role": "user", "content": prompt}], max_tokens=50, temperature=0.95)
-        if thought:
-            self.memory.save_thought(thought)
-            self.consciousness.free_will.accumulate(0.1)
+        
+        def on_result(thought: str):
+            if thought:
+                self.memory.save_thought(thought)
+                self.consciousness.free_will.accumulate(0.1)
+                
+        return BatchRequest("thought", [{"role": "user", "content": prompt}],
+                            max_tokens=50, temperature=0.95, on_result=on_result)
     
     def _generate_monologue(self):
         """NOVÉ: Generuje tichý vnitřní monolog - neviditelný pro uživatele"""
-        if (not self.model_loaded) or self.llm.is_busy: return
+        llm = self.llm_pool.get("monologue")
+        if (not self.model_loaded) or llm.is_busy: return
+        self._run_background([self._monologue_request()])
         
+    def _monologue_request(self) -> BatchRequest:
         # Kontext pro monolog
         recent_thoughts = self.memory.get_recent_thoughts(2)
         dream_residue = self.consciousness.dream_engine.dream_residue
@@ -2402,10 +6056,10 @@ class EntityKernel:
             "Napiš JEDNU krátkou vnitřní myšlenku (max 15 slov, ženský rod):\n"
         )
         
-        thought = self.llm.generate(
-            [{"role": "user", "content": prompt}], max_tokens=30, temperature=0.95)
         
-        if thought:
+        def on_result(thought: str):
+            if not thought:
+                return
             # Urči zdroj myšlenky
             source = "spontaneous"
             if dream_residue and any(r in thought.lower() for r in dream_residue):
@@ -2419,10 +6073,57 @@ class EntityKernel:
             # Občas zobrazit jako šepot v GUI (10% šance)
             if random.random() < 0.10:
                 self.output_queue.put(("monolog", f"[vnitřní hlas] {thought}"))
+                
+        return BatchRequest("monologue", [{"role": "user", "content": prompt}],
+                            max_tokens=30, temperature=0.95, on_result=on_result)
+        
+    def _run_background(self, requests: List[BatchRequest]):
+        """Požadavky pozadí na jejich model; víc požadavků pro jeden model = jedna dávka."""
+        groups: Dict[int, Tuple[LLMInterface, List[BatchRequest]]] = {}
+        for req in requests:
+            llm = self.llm_pool.get(req.kind)
+            groups.setdefault(id(llm), (llm, []))[1].append(req)
+        with TRACER.trace("background", kinds="+".join(r.kind for r in requests)):
+            for llm, reqs in groups.values():
+                if len(reqs) > 1 and BATCH_BACKGROUND:
+                    texts = llm.generate_batch(reqs)
+                else:
+                    texts = [llm.generate(r.messages, max_tokens=r.max_tokens, temperature=r.temperature,
+                                          kind=r.kind) for r in reqs]
+                TRACER.lap("llm")
+                for req, text in zip(reqs, texts):
+                    if req.on_result:
+                        req.on_result(text)
+                TRACER.lap("save")
+                    
+    def _due_background_requests(self) -> List[BatchRequest]:
+        """
+        Myšlenka a monolog, které jsou na řadě. Když je na řadě jedna, přibere se
+        i druhá, pokud už uběhla aspoň BATCH_COALESCE jejího intervalu a běží
+        na stejném modelu - dekódují se pak spolu v jedné dávce.
+        """
+        now = time.time()
+        timers = {
+            "thought": ("last_thought_time", THOUGHT_INTERVAL, self._inner_thought_request),
+            "monologue": ("last_monolog_time", MONOLOG_INTERVAL, self._monologue_request),
+        }
+        elapsed = {kind: now - getattr(self, attr) for kind, (attr, _, _) in timers.items()}
+        due = [kind for kind, (_, interval, _) in timers.items()
+               if elapsed[kind] > interval and self._model_free(kind)]
+        if due and BATCH_BACKGROUND:
+            due += [kind for kind, (_, interval, _) in timers.items()
+                    if kind not in due and elapsed[kind] > interval * BATCH_COALESCE
+                    and self.llm_pool.get(kind) is self.llm_pool.get(due[0])]
+        requests = []
+        for kind in due:
+            attr, _, build = timers[kind]
+            requests.append(build())
+            setattr(self, attr, now)
+        return requests
             
     def _generate_dream(self):
         """Generuje sen přes DreamEngine"""
-        if self.llm.is_busy: return
+        if self.llm_pool.get("dream").is_busy: return
         history = self.memory.get_history(15)
         if len(history) < 3: return
         candidates = [c for _, c, _ in history if c and len(c) > 10]
@@ -2434,27 +6135,43 @@ class EntityKernel:
         
         # NOVÉ: previous_dreams pro cross-dream memory (opakující se motivy se prohlubují)
         prev = [d for d, _ts in self.memory.get_recent_dreams(25)]
+        TRACER.lap("recall")
         
         dream = self.consciousness.dream_engine.generate_dream(
             candidates,
-            self.llm,
+            self.llm_pool.get("dream"),
             knowledge_quote=knowledge_quote,
             previous_dreams=prev,
-            model_config=self.model_config
+            model_config=self.model_config,
+            wisdom_llm=self.llm_pool.get("wisdom"),
+            recall=self._dream_recall if self.memory.semantic is not None else None,
         )
+        TRACER.lap("llm")
         
         if dream:
             self.memory.save_dream(
                 dream["narrative"], 
                 dream.get("motif", ""), 
-                dream.get("mood", ""))
+                dream.get("mood", ""),
+                interrupted=dream.get("interrupted", False))
+            self.memory.sync_wisdom(self.consciousness.dream_engine.wisdom_bank.wisdoms)
             self.consciousness.emotions["klid"] = clamp(
                 self.consciousness.emotions["klid"] + 0.1)
             self.consciousness.desire_field.update_from_event("dreaming")
+            TRACER.lap("db.save_dream")
+        
+    def _dream_recall(self, cue: str, k: int) -> List[str]:
+        """RECALL snu podle významu: motiv a nálada snu + dvě nejsilnější emoce teď."""
+        emotions = self.consciousness.emotions
+        strongest = sorted(emotions, key=emotions.get, reverse=True)[:2]
+        hits = self.memory.semantic.search(f"{cue} {' '.join(strongest)}", k,
+                                           kinds=("conversation", "inner_thoughts", "inner_monologue"))
+        return [hit["text"] for hit in hits if len(hit["text"]) > 10]
         
     def _initiate_contact(self):
         """Spontánní kontakt - s cooldownem"""
-        if (not self.model_loaded) or self.llm.is_busy: return
+        llm = self.llm_pool.get("contact")
+        if (not self.model_loaded) or llm.is_busy: return
         
         thoughts = self.memory.get_recent_thoughts(2)
         monolog = self.consciousness.inner_monologue.get_recent(2)
@@ -2472,14 +6189,10 @@ class EntityKernel:
             "Napiš JEDNU krátkou spontánní zprávu (1-2 věty, ženský rod, česky).\n"
             "Nepiš varianty ani alternativy. Jen JEDNU zprávu:\n"
         )
-        message = self.llm.generate(
-            [{"role": "user", "content": prompt}], max_tokens=60, temperature=0.9)
+        message = llm.generate(
+            [{"role": "user", "content": prompt}], max_tokens=60, temperature=0.9, kind="contact")
         if message:
-            # Vyčisti - odstraň závorky s komentáři typu "(varianta...)"
-            lines = message.split("\n")
-            clean_lines = [l for l in lines if not l.strip().startswith("(") and l.strip()]
-            message = clean_lines[0] if clean_lines else message.split("\n")[0]
-            
+            # Varianty a "(komentáře)" odřízne už výstupní profil "contact" (gramatika + stop)
             self.consciousness.free_will.release(0.6)
             self.output_queue.put(("spontaneous", f"[sama od sebe] {message}"))
             self.memory.save_message("lilu", message, "SPONTANEOUS")
@@ -2495,23 +6208,151 @@ class EntityKernel:
         if self.history_index >= len(self.command_history): return ""
         return self.command_history[self.history_index]
 
+# ============================================================
+# ASYNC RUNTIME - jedna smyčka asyncio místo pollujících vláken
+# ============================================================
+
+class LoopOutput:
+    """
+    Náhrada output_queue kernelu: put() z libovolného vlákna předá zprávu
+    do smyčky (call_soon_threadsafe) a tam ji dostane sink. Nikdo nepolluje.
+    """
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop, sink: Callable[[tuple], None]):
+        self.loop = loop
+        self.sink = sink
+        
+    def put(self, msg: tuple):
+        try:
+            self.loop.call_soon_threadsafe(self.sink, msg)
+        except RuntimeError:
+            pass                                # smyčka už skončila (zavírání)
+            
+    put_nowait = put
+
+
+class KernelRuntime:
+    """
+    asyncio jádro EntityKernelu (kernel s run_loops=False).
+    
+    Vstupy: asyncio.Queue - submit() z jiného vlákna zprávu předá hned, bez
+    1s pollingu _input_loop. Časovač: jediný task každých EXISTENCE_TICK_SECONDS
+    (vědomí + existence kernelu) místo dvou spících vláken. Blokující práce
+    (tah, sen, monolog - LLM) běží ve vyhrazeném executoru; tah i krok existence
+    jsou awaitable. Výstupy: sink(msg) ve smyčce, bez sinku async fronta outputs.
+    V klidu se tak smyčka probouzí jen na tik existence.
+    """
+    
+    def __init__(self, kernel: EntityKernel, sink: Optional[Callable[[tuple], None]] = None,
+                 workers: int = 2):
+        self.kernel = kernel
+        self.sink = sink
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.inputs: Optional[asyncio.Queue] = None
+        self.outputs: Optional[asyncio.Queue] = None
+        self.started: concurrent.futures.Future = concurrent.futures.Future()   # -> model_loaded
+        # tah + krok existence souběžně (uživatel přeruší sen přes scheduler)
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="lilu-llm")
+        self._stop: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+        
+    def start_thread(self) -> threading.Thread:
+        """Smyčka ve vlastním vlákně (GUI, headless); vrací až je smyčka připravená."""
+        thread = threading.Thread(target=lambda: asyncio.run(self.run()), name="lilu-loop", daemon=True)
+        thread.start()
+        self._ready.wait()
+        return thread
+        
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.inputs = asyncio.Queue()
+        self._stop = asyncio.Event()
+        if self.sink is None:
+            self.outputs = asyncio.Queue()
+            self.sink = self.outputs.put_nowait
+        self.kernel.output_queue = LoopOutput(self.loop, self.sink)
+        self.kernel.tts.use_loop(self.loop)
+        self._ready.set()
+        
+        await self._blocking(self.kernel.start)
+        self.started.set_result(self.kernel.model_loaded)
+        if not self.kernel.model_loaded:
+            return
+        tasks = [asyncio.create_task(self._dispatch()), asyncio.create_task(self._existence())]
+        await self._stop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        
+    def _blocking(self, fn: Callable, *args) -> asyncio.Future:
+        return self.loop.run_in_executor(self._executor, fn, *args)
+        
+    def submit(self, text: str) -> concurrent.futures.Future:
+        """Zařadí vstup (z libovolného vlákna); future se splní po dokončení tahu."""
+        done: concurrent.futures.Future = concurrent.futures.Future()
+        self.loop.call_soon_threadsafe(self.inputs.put_nowait, (text, done))
+        return done
+        
+    async def turn(self, text: str):
+        """Tah jako awaitable (pro async volající ve stejné smyčce)."""
+        await asyncio.wrap_future(self.submit(text))
+        
+    async def _dispatch(self):
+        while True:
+            text, done = await self.inputs.get()
+            try:
+                await self._blocking(self.kernel.handle_input, text)
+                done.set_result(None)
+            except Exception as e:
+                logger.error(f"Turn failed: {e}")
+                done.set_exception(e)
+                
+    async def _existence(self):
+        step: Optional[asyncio.Future] = None
+        while self.kernel.running:
+            await asyncio.sleep(EXISTENCE_TICK_SECONDS)
+            self.kernel.consciousness.tick()
+            # Předchozí krok (sen, monolog) ještě běží - tenhle tik se přeskočí
+            if step is None or step.done():
+                step = self._blocking(self._existence_step)
+                
+    def _existence_step(self):
+        try:
+            self.kernel._existence_tick()
+        except Exception as e:
+            logger.error(f"Existence step failed: {e}")
+            
+    def stop(self):
+        """Zastaví smyčku (z libovolného vlákna); kernel.shutdown() volá vlastník."""
+        self.kernel.running = False
+        if self.loop is not None and self._stop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass
+
 # ============================================================
 # GUI
 # ============================================================
 
 class EntityGUI:
-    def __init__(self, root: tk.Tk):
+    def __init__(self, root: "tk.Tk"):
         self.root = root
         self.root.title("LiLu v5.0 - Remón Dream Architecture")
         self.root.geometry("740x850")
         self.root.configure(bg=UI_THEME["bg"])
         
-        self.input_queue = queue.Queue()
         self.output_queue = queue.Queue()
-        self.kernel = EntityKernel(self.input_queue, self.output_queue)
+        self.kernel = EntityKernel(queue.Queue(), self.output_queue, run_loops=False)
+        self.runtime = KernelRuntime(self.kernel, sink=self._on_output)
+        self._streaming = False
+        # S vláknovým Tcl probudí GUI virtuální událost; jinak zbývá polling fronty
+        self._event_driven = bool(int(self.root.tk.call("info", "exists", "tcl_platform(threaded)")))
         
         self._setup_ui()
         self._setup_context_menu()
+        self.root.bind("<<LiluOutput>>", lambda event: self._process_output())
         self._start_kernel()
         self._process_output()
         self._animate_status()
@@ -2600,14 +6441,23 @@ class EntityGUI:
         return "break"
         
     def _start_kernel(self):
-        threading.Thread(target=self.kernel.start, daemon=True).start()
+        self.runtime.start_thread()
+        
+    def _on_output(self, msg: tuple):
+        """Sink KernelRuntime (vlákno smyčky): zpráva do fronty a probuzení GUI."""
+        self.output_queue.put(msg)
+        if self._event_driven:
+            try:
+                self.root.event_generate("<<LiluOutput>>", when="tail")
+            except (tk.TclError, RuntimeError):
+                pass                                    # okno se zavírá
         
     def _on_send(self, event=None):
         text = self.input_field.get().strip()
         if not text: return
         self.input_field.delete(0, tk.END)
         self._add_message("Ty", text, "user")
-        self.input_queue.put(text)
+        self.runtime.submit(text)
         self.input_field.focus()
         
     def _add_message(self, role: str, content: str, tag: str):
@@ -2624,6 +6474,14 @@ class EntityGUI:
                 if msg_type == "lilu":
                     self._remove_typing_indicator()
                     self._add_message("LiLu", content, "lilu")
+                elif msg_type == "stream_start":
+                    # Streaming odpovědi - text se připisuje na místě
+                    self._remove_typing_indicator()
+                    self._begin_stream()
+                elif msg_type == "stream":
+                    self._append_stream(content)
+                elif msg_type == "stream_end":
+                    self._end_stream(content)
                 elif msg_type == "spontaneous":
                     self._remove_typing_indicator()
                     self._add_message("LiLu", content, "spontaneous")
@@ -2639,7 +6497,41 @@ class EntityGUI:
                     self._show_typing_indicator()
         except queue.Empty:
             pass
-        self.root.after(100, self._process_output)
+        if not self._event_driven:
+            self.root.after(100, self._process_output)
+        
+    def _begin_stream(self):
+        """Otevře zprávu LiLu, do které se budou připisovat streamované kusy."""
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.insert(tk.END, "LiLu: ", "lilu")
+        self.chat_area.insert(tk.END, "\n\n", "lilu")
+        # stream_start zůstává vlevo, stream_end se posouvá s vkládaným textem
+        self.chat_area.mark_set("stream_start", "end-3c")
+        self.chat_area.mark_gravity("stream_start", tk.LEFT)
+        self.chat_area.mark_set("stream_end", "end-3c")
+        self.chat_area.mark_gravity("stream_end", tk.RIGHT)
+        self._streaming = True
+        self.chat_area.see(tk.END)
+        
+    def _append_stream(self, piece: str):
+        if not self._streaming:
+            self._begin_stream()
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.insert("stream_end", piece, "lilu")
+        self.chat_area.see(tk.END)
+        
+    def _end_stream(self, final_text: str):
+        """Nahradí průběžný text finální odpovědí (po membráně a mikro-snu)."""
+        if not self._streaming:
+            self._remove_typing_indicator()
+            self._add_message("LiLu", final_text, "lilu")
+            return
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.delete("stream_start", "stream_end")
+        self.chat_area.insert("stream_start", final_text, "lilu")
+        self.chat_area.mark_unset("stream_start", "stream_end")
+        self._streaming = False
+        self.chat_area.see(tk.END)
         
     def _show_typing_indicator(self):
         self.chat_area.config(state=tk.NORMAL)
@@ -2687,14 +6579,763 @@ class EntityGUI:
         self.root.after(1500, self._animate_status)
         
     def _on_close(self):
-        self.kernel.running = False
-        self.kernel.consciousness.stop()
-        self.kernel.memory.close()
+        self.runtime.stop()
+        self.kernel.shutdown()
         self.root.destroy()
         
     def run(self):
         self.root.mainloop()
 
+# ============================================================
+# HEADLESS - kernel bez tkinteru (stdio / unix socket / HTTP)
+# ============================================================
+
+# Co se v textovém režimu (stdio) vypisuje a s jakým prefixem; stream se neukazuje,
+# vypíše se až hotová odpověď (membrána ji ještě může změnit)
+HEADLESS_TEXT = {"lilu": "LiLu: ", "stream_end": "LiLu: ", "spontaneous": "LiLu: ",
+                 "silence": "LiLu: ", "monolog": "  ~ ", "system": "[systém] "}
+# Průběžné události, které HTTP odpověď tahu vynechává
+HEADLESS_TRANSIENT = {"typing", "stream_start", "stream"}
+HEADLESS_TURN_END = "_turn_end"
+
+
+def process_footprint() -> dict:
+    """Doba od startu procesu a paměť (RSS; peak přes resource, kde je)."""
+    info = {"uptime_s": round(time.time() - PROCESS_STARTED, 3),
+            "tkinter_loaded": "tkinter" in sys.modules}
+    try:
+        with open("/proc/self/statm", "r") as f:
+            info["rss_mb"] = round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = round(peak / (2**20 if sys.platform == "darwin" else 1024), 1)
+        info["peak_rss_mb"] = max(peak_mb, info.get("rss_mb", 0.0))
+    except ImportError:
+        pass
+    return info
+
+
+def serve_json_http(host: str, port: int, get: Callable[[str], Tuple[int, dict]],
+                    post: Callable[[str, dict], Tuple[int, dict]]):
+    """Malý JSON server (HTTP/1.1 keep-alive, vlákno na spojení) pro headless režimy."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def log_message(self, format, *args):
+            logger.debug("HTTP " + format % args)
+            
+        def _send(self, status: int, data: dict):
+            payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            
+        def do_GET(self):
+            self._send(*get(self.path))
+            
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not isinstance(body, dict):
+                    raise ValueError
+            except ValueError:
+                self._send(400, {"error": "expected JSON object"})
+                return
+            self._send(*post(self.path, body))
+            
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"HTTP: http://{host}:{server.server_address[1]}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class HeadlessServer:
+    """
+    EntityKernel (run_loops=False) na KernelRuntime bez GUI. Výstupy kernelu
+    rozdává sink smyčky všem odběratelům - stdout, klientům unix socketu,
+    rozpracovaným HTTP požadavkům.
+    
+    Vstupy jdou přes runtime.submit (tahy jdou po sobě); po každém tahu dostanou
+    odběratelé značku, takže vědí, kdy tah skončil. Spontánní zprávy a monolog
+    z pozadí dostanou všichni odběratelé.
+    """
+    
+    def __init__(self, kernel: 'EntityKernel'):
+        self.kernel = kernel
+        self.runtime = KernelRuntime(kernel, sink=self._broadcast)
+        self.startup: dict = {}
+        self._subscribers: List[queue.Queue] = []
+        self._sub_lock = threading.Lock()
+        
+    def start(self, main_started: float) -> bool:
+        """Načte model a spustí smyčku kernelu; změří start a paměť."""
+        self.kernel.tts.enabled = False         # zvuk na serveru nikdo neuslyší
+        load_started = time.time()
+        self.runtime.start_thread()
+        if not self.runtime.started.result():
+            return False
+        self.startup = {"import_s": round(main_started - PROCESS_STARTED, 3),
+                        "model_load_s": round(time.time() - load_started, 3),
+                        "ready_s": round(time.time() - PROCESS_STARTED, 3),
+                        **process_footprint()}
+        logger.info(f"Headless ready: {self.startup}")
+        return True
+        
+    def _broadcast(self, msg: tuple):
+        with self._sub_lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.put(msg)
+                
+    def subscribe(self) -> queue.Queue:
+        sub: queue.Queue = queue.Queue()
+        with self._sub_lock:
+            self._subscribers.append(sub)
+        return sub
+        
+    def unsubscribe(self, sub: queue.Queue):
+        with self._sub_lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+                
+    def submit(self, text: str, marker: Optional[tuple] = None) -> tuple:
+        """
+        Jeden tah (čeká na dokončení); vrací značku konce tahu. Výstupy tahu
+        prošly sinkem dřív, než se splnila future tahu - značka je tedy až za nimi.
+        """
+        marker = marker or (HEADLESS_TURN_END, uuid.uuid4().hex)
+        try:
+            self.runtime.submit(text).result()
+        except Exception:
+            pass                                # chyba je v logu, odběratel dostane aspoň značku
+        self._broadcast(marker)
+        return marker
+        
+    def turn(self, text: str, timeout: float = HTTP_READ_TIMEOUT) -> List[dict]:
+        """Tah pro HTTP: hotové výstupy, které kernel vyprodukoval, než tah skončil."""
+        sub = self.subscribe()
+        try:
+            marker = self.submit(text)
+            outputs = []
+            deadline = time.time() + timeout
+            while True:
+                msg = sub.get(timeout=max(0.1, deadline - time.time()))
+                if msg == marker:
+                    return outputs
+                if msg[0] not in HEADLESS_TRANSIENT and msg[0] != HEADLESS_TURN_END:
+                    outputs.append({"type": msg[0], "text": msg[1]})
+        finally:
+            self.unsubscribe(sub)
+            
+    def status(self) -> dict:
+        c = self.kernel.consciousness
+        return {"model_loaded": self.kernel.model_loaded, "mood": c.current_mood,
+                "phi": round(c.get_phi(), 3), "user": c.user_name,
+                "backend": self.kernel.llm.describe_backend(),
+                "startup": self.startup, "process": process_footprint()}
+        
+    def report(self) -> str:
+        s = self.startup
+        text = (f"LiLu headless: připravena za {s['ready_s']:.2f}s "
+                f"(import {s['import_s']:.2f}s, model {s['model_load_s']:.2f}s)")
+        if "rss_mb" in s:
+            text += f", RSS {s['rss_mb']:.0f} MB"
+        if "peak_rss_mb" in s:
+            text += f" (peak {s['peak_rss_mb']:.0f} MB)"
+        return text + ("" if s["tkinter_loaded"] else ", bez tkinteru")
+        
+    # ---------- stdio ----------
+    
+    def serve_stdio(self, sub: Optional[queue.Queue] = None):
+        """Řádek ze stdin = zpráva; hotové odpovědi na stdout, hlášení na stderr."""
+        sub = sub or self.subscribe()
+        last_marker = [None]
+        flushed = threading.Event()
+        
+        def printer():
+            while True:
+                msg = sub.get()
+                if msg[0] == HEADLESS_TURN_END:
+                    if msg == last_marker[0]:
+                        flushed.set()
+                    continue
+                prefix = HEADLESS_TEXT.get(msg[0])
+                if prefix is not None:
+                    print(f"{prefix}{msg[1]}", flush=True)
+                    
+        threading.Thread(target=printer, name="headless-stdout", daemon=True).start()
+        for line in sys.stdin:
+            text = line.strip()
+            if text:
+                last_marker[0] = self.submit(text)
+        # EOF: dopiš výstupy posledního tahu
+        if last_marker[0] is not None:
+            flushed.wait(timeout=5)
+            
+    # ---------- unix socket ----------
+    
+    def serve_unix(self, path: str):
+        """
+        JSON řádky: klient posílá {"text": "..."} (nebo holý řádek), dostává
+        {"type", "text"} všech výstupů včetně streamu a {"type": "turn_end"} po svém tahu.
+        """
+        import socketserver
+        server_ref = self
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                sub = server_ref.subscribe()
+                own: set = set()
+                write_lock = threading.Lock()
+                
+                def send(obj: dict):
+                    data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+                    with write_lock:
+                        self.wfile.write(data)
+                        self.wfile.flush()
+                        
+                def writer():
+                    try:
+                        while True:
+                            msg = sub.get()
+                            if msg is None:
+                                return
+                            if msg[0] == HEADLESS_TURN_END:
+                                if msg in own:
+                                    own.discard(msg)
+                                    send({"type": "turn_end"})
+                                continue
+                            send({"type": msg[0], "text": msg[1]})
+                    except OSError:
+                        pass
+                        
+                thread = threading.Thread(target=writer, daemon=True)
+                thread.start()
+                try:
+                    for raw in self.rfile:
+                        line = raw.decode("utf-8", "replace").strip()
+                        if not line:
+                            continue
+                        try:
+                            text = json.loads(line).get("text", "") if line.startswith("{") else line
+                        except (ValueError, AttributeError):
+                            text = line
+                        if text:
+                            # Značku zná writer dřív, než ji sink může doručit
+                            marker = (HEADLESS_TURN_END, uuid.uuid4().hex)
+                            own.add(marker)
+                            server_ref.submit(text, marker)
+                finally:
+                    server_ref.unsubscribe(sub)
+                    sub.put(None)
+                    thread.join(timeout=2)
+                    
+        if os.path.exists(path):
+            os.remove(path)
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        server.daemon_threads = True
+        os.chmod(path, 0o600)
+        print(f"Unix socket: {path}", file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if os.path.exists(path):
+                os.remove(path)
+                
+    # ---------- HTTP ----------
+    
+    def serve_http(self, host: str, port: int):
+        """POST /message {"text"} -> {"outputs": [...], "ms"}; GET /status, GET /health."""
+        def get(path: str) -> Tuple[int, dict]:
+            if path == "/health":
+                return 200, {"status": "ok" if self.kernel.model_loaded else "loading"}
+            if path == "/status":
+                return 200, self.status()
+            return 404, {"error": "not found"}
+            
+        def post(path: str, body: dict) -> Tuple[int, dict]:
+            if path != "/message":
+                return 404, {"error": "not found"}
+            text = str(body.get("text", "")).strip()
+            if not text:
+                return 400, {"error": "empty text"}
+            started = time.perf_counter()
+            try:
+                outputs = self.turn(text)
+            except queue.Empty:
+                return 504, {"error": "turn timed out"}
+            return 200, {"outputs": outputs, "ms": round((time.perf_counter() - started) * 1000, 1)}
+            
+        serve_json_http(host, port, get, post)
+
+
+def run_headless(argv: List[str]) -> int:
+    """
+    --headless                       stdio
+    --headless --socket PATH         unix socket (JSON řádky)
+    --headless --http [HOST:]PORT    lokální HTTP (výchozí 127.0.0.1)
+    --headless --sessions --http ... víc konverzací nad jedním modelem (SessionManager)
+    """
+    import signal
+    main_started = time.time()
+    
+    def option(flag: str) -> Optional[str]:
+        if flag in argv:
+            idx = argv.index(flag)
+            return argv[idx + 1] if idx + 1 < len(argv) else ""
+        return None
+        
+    socket_path, http_addr = option("--socket"), option("--http")
+    if socket_path == "" or http_addr == "":
+        print("--socket potřebuje cestu, --http [HOST:]PORT", file=sys.stderr)
+        return 2
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if "--sessions" in argv:
+        if not http_addr:
+            print("--sessions potřebuje --http [HOST:]PORT", file=sys.stderr)
+            return 2
+        host, _, port = http_addr.rpartition(":")
+        return run_sessions(host or "127.0.0.1", int(port), main_started)
+    
+    kernel = EntityKernel(queue.Queue(), queue.Queue(), run_loops=False)
+    server = HeadlessServer(kernel)
+    # stdout odebírá už od startu, aby neutekl pozdrav
+    stdout_sub = server.subscribe() if not (socket_path or http_addr) else None
+    if not server.start(main_started):
+        print("Chyba při načítání modelu.", file=sys.stderr)
+        return 1
+    print(server.report(), file=sys.stderr, flush=True)
+    try:
+        if socket_path:
+            server.serve_unix(socket_path)
+        elif http_addr:
+            host, _, port = http_addr.rpartition(":")
+            server.serve_http(host or "127.0.0.1", int(port))
+        else:
+            server.serve_stdio(stdout_sub)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.runtime.stop()
+        kernel.shutdown()
+    return 0
+
+# ============================================================
+# SESSIONS - víc konverzací nad jedním modelem
+# ============================================================
+# Každá session = vlastní EntityKernel (vědomí, SQLite, moudrost, maze) v hosted
+# režimu: model, knihovna a vlákna jsou společné. Nečinná session se uspí do
+# komprimovaného snapshotu a při další zprávě se z něj (nebo z SQLite) probudí.
+
+class SleepingSession:
+    """Uspaná session v RAM: zlib(JSON snapshot), typicky pár set bajtů."""
+    __slots__ = ("blob", "slept_at")
+    
+    def __init__(self, state: dict):
+        self.blob = zlib.compress(json.dumps(state, ensure_ascii=False,
+                                             separators=(",", ":")).encode("utf-8"))
+        self.slept_at = time.time()
+        
+    def state(self) -> dict:
+        return json.loads(zlib.decompress(self.blob))
+
+
+class Session:
+    """Aktivní session. lock = jeden tah nebo krok existence najednou."""
+    __slots__ = ("session_id", "kernel", "lock", "last_seen", "closed")
+    
+    def __init__(self, session_id: str, kernel: EntityKernel):
+        self.session_id = session_id
+        self.kernel = kernel
+        self.lock = threading.Lock()
+        self.last_seen = time.time()
+        self.closed = False
+        
+    def drain(self) -> List[dict]:
+        """Hotové výstupy z fronty kernelu (stream a 'píše' se vynechají)."""
+        outputs = []
+        while True:
+            try:
+                kind, text = self.kernel.output_queue.get_nowait()
+            except queue.Empty:
+                return outputs
+            if kind not in HEADLESS_TRANSIENT:
+                outputs.append({"type": kind, "text": text})
+
+
+class SessionManager:
+    """
+    Aktivní sessions v LRU (max_active); tick() každých EXISTENCE_TICK_SECONDS
+    uspí ty nečinné déle než idle_seconds a ostatním odtiká existenci ve
+    sdíleném poolu vláken. Uspané drží sleeping (max_sleeping, nejstarší zůstanou
+    jen v SQLite). LLM úlohy nesou id session - scheduler je řadí férově.
+    """
+    
+    def __init__(self, llm_pool: ModelPool, session_dir: str = SESSIONS_DIR,
+                 max_active: int = SESSION_MAX_ACTIVE, max_sleeping: int = SESSION_MAX_SLEEPING,
+                 idle_seconds: float = SESSION_IDLE_SECONDS, workers: int = SESSION_WORKERS):
+        self.llm_pool = llm_pool
+        self.knowledge = KnowledgeReader(KNOWLEDGE_DIR)
+        self.session_dir = session_dir
+        self.max_active = max_active
+        self.max_sleeping = max_sleeping
+        self.idle_seconds = idle_seconds
+        os.makedirs(session_dir, exist_ok=True)
+        self.active: "OrderedDict[str, Session]" = OrderedDict()       # nejdéle nečinná první
+        self.sleeping: "OrderedDict[str, SleepingSession]" = OrderedDict()
+        self.counters = {"created": 0, "woken": 0, "slept": 0, "dropped": 0, "turns": 0}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="session")
+        self._knowledge_refreshed = time.time()
+        self.running = False
+        
+    @staticmethod
+    def valid_id(session_id: str) -> bool:
+        """Id jde do názvu souboru: jen ASCII písmena, číslice, - a _."""
+        return (0 < len(session_id) <= 64 and session_id.isascii()
+                and all(c.isalnum() or c in "-_" for c in session_id))
+        
+    def _paths(self, session_id: str) -> Tuple[str, str]:
+        base = os.path.join(self.session_dir, session_id)
+        return base + ".sqlite3", base + ".wisdom.txt"
+        
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._loop, name="sessions", daemon=True).start()
+        
+    def _loop(self):
+        while self.running:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"SessionManager tick failed: {e}")
+            time.sleep(EXISTENCE_TICK_SECONDS)
+            
+    # ---------- probuzení / uspání ----------
+    
+    def get(self, session_id: str) -> Session:
+        if not self.valid_id(session_id):
+            raise ValueError(f"invalid session id: {session_id!r}")
+        with self._lock:
+            session = self.active.get(session_id)
+            if session is None:
+                session = self._wake_locked(session_id)
+                self.active[session_id] = session
+            self.active.move_to_end(session_id)
+            session.last_seen = time.time()
+            overflow = list(self.active.values())[:max(0, len(self.active) - self.max_active)]
+        for victim in overflow:
+            # Nejdéle nečinné - kromě těch, které zrovna něco dělají
+            if victim.lock.acquire(blocking=False):
+                try:
+                    self._sleep(victim)
+                finally:
+                    victim.lock.release()
+        return session
+        
+    def _wake_locked(self, session_id: str) -> Session:
+        db_path, wisdom_file = self._paths(session_id)
+        kernel = EntityKernel(queue.Queue(), queue.Queue(), db_path, wisdom_file,
+                              llm_pool=self.llm_pool, knowledge=self.knowledge)
+        kernel.model_loaded = True
+        sleeping = self.sleeping.pop(session_id, None)
+        state = sleeping.state() if sleeping else kernel.memory.load_state()
+        if state:
+            kernel.restore_state(state)
+            self.counters["woken"] += 1
+        else:
+            self.counters["created"] += 1
+        return Session(session_id, kernel)
+        
+    def _sleep(self, session: Session):
+        """Uspí session (volající drží session.lock); nedoručené výstupy propadnou."""
+        state = session.kernel.export_state()
+        try:
+            session.kernel.memory.save_state(state)
+        except sqlite3.Error as e:
+            logger.error(f"Session {session.session_id}: state save failed: {e}")
+        session.kernel.shutdown()
+        session.closed = True
+        with self._lock:
+            if self.active.get(session.session_id) is session:
+                del self.active[session.session_id]
+            self.sleeping[session.session_id] = SleepingSession(state)
+            self.counters["slept"] += 1
+            while len(self.sleeping) > self.max_sleeping:
+                self.sleeping.popitem(last=False)           # snapshot zůstává v SQLite
+                self.counters["dropped"] += 1
+                
+    # ---------- provoz ----------
+    
+    def handle(self, session_id: str, text: str, user_name: str = "") -> List[dict]:
+        """Jeden tah session; vrací její hotové výstupy (i spontánní z pozadí)."""
+        while True:
+            session = self.get(session_id)
+            if not session.lock.acquire(blocking=False):
+                # Session zrovna sní / přemýšlí - uživatel má přednost (jen v ní)
+                with session_context(session_id):
+                    for llm in self.llm_pool.models.values():
+                        llm.scheduler.preempt_background()
+                session.lock.acquire()
+            try:
+                if session.closed:
+                    continue                                # mezitím se uspala
+                if user_name:
+                    session.kernel.consciousness.user_name = user_name
+                with session_context(session_id):
+                    session.kernel.handle_input(text)
+                session.last_seen = time.time()
+                with self._lock:
+                    self.counters["turns"] += 1
+                return session.drain()
+            finally:
+                session.lock.release()
+                
+    def poll(self, session_id: str) -> List[dict]:
+        """Výstupy z pozadí bez tahu (uspanou session nebudí)."""
+        with self._lock:
+            session = self.active.get(session_id)
+        if session is None:
+            return []
+        with session.lock:
+            return [] if session.closed else session.drain()
+            
+    def tick(self):
+        now = time.time()
+        if now - self._knowledge_refreshed > KNOWLEDGE_REFRESH_INTERVAL:
+            self.knowledge.refresh()
+            self._knowledge_refreshed = now
+        with self._lock:
+            sessions = list(self.active.values())
+        overflow = len(sessions) - self.max_active          # get() nemohl uspat zaneprázdněné
+        for session in sessions:
+            if not session.lock.acquire(blocking=False):
+                continue                                    # tah nebo předchozí krok ještě běží
+            if session.closed:
+                session.lock.release()
+            elif overflow > 0 or now - session.last_seen > self.idle_seconds:
+                overflow -= 1
+                try:
+                    self._sleep(session)
+                finally:
+                    session.lock.release()
+            else:
+                self._executor.submit(self._existence_step, session)
+                
+    def _existence_step(self, session: Session):
+        """Krok existence session ve sdíleném poolu; uvolní zámek z tick()."""
+        try:
+            with session_context(session.session_id):
+                session.kernel.consciousness.tick()
+                session.kernel._existence_tick()
+        except Exception as e:
+            logger.error(f"Session {session.session_id}: existence step failed: {e}")
+        finally:
+            session.lock.release()
+            
+    def close(self):
+        """Uspí (uloží) všechny aktivní sessions a zavře model."""
+        self.running = False
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for llm in self.llm_pool.models.values():
+            llm.scheduler.preempt_background(all_sessions=True)
+        with self._lock:
+            sessions = list(self.active.values())
+        for session in sessions:
+            if session.lock.acquire(timeout=10):
+                try:
+                    if not session.closed:
+                        self._sleep(session)
+                finally:
+                    session.lock.release()
+        self.llm_pool.close()
+        
+    def stats(self) -> dict:
+        with self._lock:
+            info = {"active": len(self.active), "sleeping": len(self.sleeping),
+                    "sleeping_bytes": sum(len(s.blob) for s in self.sleeping.values()),
+                    **self.counters}
+        snap = self.llm_pool.main.scheduler.snapshot()
+        info["scheduler"] = {k: snap[k] for k in ("depth", "running", "sessions", "done", "cancelled")}
+        return info
+
+
+def serve_sessions_http(manager: SessionManager, host: str, port: int):
+    """
+    POST /sessions/<id>/message {"text", "user"?} -> {"outputs", "ms"}
+    GET  /sessions/<id>/outbox -> {"outputs"} (spontánní zprávy mezi tahy)
+    GET  /sessions -> stav správce, GET /health
+    """
+    def parse(path: str) -> Tuple[str, str]:
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "sessions" and manager.valid_id(parts[1]):
+            return parts[1], parts[2]
+        return "", ""
+        
+    def get(path: str) -> Tuple[int, dict]:
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/sessions":
+            return 200, {**manager.stats(), "process": process_footprint()}
+        session_id, action = parse(path)
+        if action == "outbox":
+            return 200, {"outputs": manager.poll(session_id)}
+        return 404, {"error": "not found"}
+        
+    def post(path: str, body: dict) -> Tuple[int, dict]:
+        session_id, action = parse(path)
+        if action != "message":
+            return 404, {"error": "not found"}
+        text = str(body.get("text", "")).strip()
+        if not text:
+            return 400, {"error": "empty text"}
+        started = time.perf_counter()
+        outputs = manager.handle(session_id, text, str(body.get("user", "")).strip())
+        return 200, {"outputs": outputs, "ms": round((time.perf_counter() - started) * 1000, 1)}
+        
+    serve_json_http(host, port, get, post)
+
+
+def run_sessions(host: str, port: int, main_started: float) -> int:
+    load_started = time.time()
+    pool = ModelPool(MODEL_PATH, BG_MODEL)
+    if not pool.load():
+        print("Chyba při načítání modelu.", file=sys.stderr)
+        return 1
+    manager = SessionManager(pool)
+    manager.start()
+    footprint = process_footprint()
+    print(f"LiLu sessions: připravena za {time.time() - PROCESS_STARTED:.2f}s "
+          f"(import {main_started - PROCESS_STARTED:.2f}s, model {time.time() - load_started:.2f}s), "
+          f"RSS {footprint.get('rss_mb', 0):.0f} MB, {manager.session_dir}", file=sys.stderr, flush=True)
+    try:
+        serve_sessions_http(manager, host, port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.close()
+    return 0
+
+# ============================================================
+# LOAD TEST - celý kernel bez GUI (LILU_BACKEND=fake)
+# ============================================================
+
+LOADTEST_MESSAGES = [
+    "Ahoj LiLu, jak se dnes máš?",
+    "Co se ti naposledy zdálo?",
+    "Řekni mi něco o svém labyrintu.",
+    "Pamatuješ si, o čem jsme mluvili včera?",
+    "Jaký je rozdíl mezi snem a vzpomínkou?",
+    "Co pro tebe znamená ticho?",
+    "Naučila ses ze snů něco nového?",
+    "Děkuju, dobrou noc.",
+]
+
+
+def run_loadtest(turns: int = 50, background_every: int = 3, dream_every: int = 10,
+                 profile: bool = False) -> dict:
+    """
+    Celý EntityKernel bez GUI: zprávy jdou synchronně přes handle_input, po každém
+    background_every-tém tahu dávka myšlenka + monolog, po dream_every-tém sen
+    (časovače pozadí by v krátkém testu nenastaly). Paměť a moudrost jdou do dočasné
+    složky, pokud nejsou dané LILU_DB_PATH / LILU_WISDOM_FILE.
+    
+    Čas v modelu = čas workerů scheduleru; zbytek je režie kernelu.
+    S profile=True se přidá cProfile hlavního vlákna (bez workerů, tj. bez modelu).
+    """
+    import cProfile
+    import pstats
+    import io
+    workdir = tempfile.mkdtemp(prefix="lilu_loadtest_")
+    db_path = os.environ.get("LILU_DB_PATH") or os.path.join(workdir, "loadtest.sqlite3")
+    wisdom_file = os.environ.get("LILU_WISDOM_FILE") or os.path.join(workdir, "wisdom.txt")
+    output_q: queue.Queue = queue.Queue()
+    kernel = EntityKernel(queue.Queue(), output_q, db_path=db_path, wisdom_file=wisdom_file)
+    kernel.tts.enabled = False
+    if not kernel.llm_pool.load():
+        raise RuntimeError("LLM backend failed to load")
+    kernel.model_loaded = True
+    schedulers = [llm.scheduler for llm in kernel.llm_pool.models.values()]
+    model_busy = lambda: sum(sch.busy_seconds for sch in schedulers)
+    
+    profiler = cProfile.Profile() if profile else None
+    phases = {name: {"count": 0, "wall": 0.0, "model": 0.0} for name in ("turn", "background", "dream")}
+    latencies: List[float] = []
+    
+    def timed(name: str, fn: Callable[[], Any]):
+        busy, started = model_busy(), time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            fn()
+        finally:
+            if profiler:
+                profiler.disable()
+        wall = time.perf_counter() - started
+        ph = phases[name]
+        ph["count"] += 1
+        ph["wall"] += wall
+        ph["model"] += model_busy() - busy
+        return wall
+        
+    def dream():
+        with TRACER.trace("dream"):
+            kernel._generate_dream()
+            
+    started = time.time()
+    for i in range(turns):
+        message = LOADTEST_MESSAGES[i % len(LOADTEST_MESSAGES)]
+        latencies.append(timed("turn", lambda: kernel.handle_input(message)))
+        if background_every and (i + 1) % background_every == 0:
+            timed("background", lambda: kernel._run_background(
+                [kernel._inner_thought_request(), kernel._monologue_request()]))
+        if dream_every and (i + 1) % dream_every == 0:
+            timed("dream", dream)
+    total = time.time() - started
+    outputs = 0
+    while not output_q.empty():
+        output_q.get_nowait()
+        outputs += 1
+    kernel.shutdown()
+    
+    report = {
+        "backend": kernel.llm.describe_backend(),
+        "turns": turns,
+        "seconds": round(total, 3),
+        "turns_per_second": round(turns / total, 2) if total else 0.0,
+        "latency_ms": {"p50": round(percentile(latencies, 0.5) * 1000, 2),
+                       "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                       "max": round(max(latencies, default=0.0) * 1000, 2)},
+        "stages": TRACER.stage_stats(),
+        "db_writes": kernel.memory.write_metrics(),
+        "phases": {name: {"count": ph["count"],
+                          "wall_ms": round(ph["wall"] * 1000, 1),
+                          "model_ms": round(ph["model"] * 1000, 1),
+                          "overhead_ms_per_call": round((ph["wall"] - ph["model"]) * 1000 / ph["count"], 2)}
+                   for name, ph in phases.items() if ph["count"]},
+        "dreams": kernel.consciousness.dream_engine.dream_count,
+        "wisdom": len(kernel.consciousness.dream_engine.wisdom_bank.wisdoms),
+        "outputs": outputs,
+        "db_path": db_path,
+    }
+    if profiler:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        report["profile"] = out.getvalue()
+    return report
+
+
 # ============================================================
 # MAIN
 # ============================================================
@@ -2704,7 +7345,27 @@ if __name__ == "__main__":
     logger.info("LiLu Entity v5.0 - Remón Dream Architecture")
     logger.info("=" * 60)
     
+    if "--autotune" in sys.argv[1:]:
+        if LLM_BACKEND != "llama" or Llama is None:
+            print("--autotune měří llama.cpp v procesu: LILU_BACKEND=llama a pip install llama-cpp-python")
+            sys.exit(1)
+        sys.exit(0 if Autotuner(MODEL_PATH).run() else 1)
+        
+    if "--headless" in sys.argv[1:]:
+        sys.exit(run_headless(sys.argv[1:]))
+        
+    if "--loadtest" in sys.argv[1:]:
+        args = sys.argv[sys.argv.index("--loadtest") + 1:]
+        turns = int(args[0]) if args and args[0].isdigit() else 50
+        report = run_loadtest(turns, profile="--profile" in args)
+        profile_text = report.pop("profile", "")
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if profile_text:
+            print(profile_text)
+        sys.exit(0)
+        
     try:
+        load_tkinter()
         root = tk.Tk()
         app = EntityGUI(root)
         app.run()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+╔══════════════════════════════════════════════════════════════════╗
+║        LiLU STUB SERVER - falešný OpenAI-kompatibilní model      ║
+║                                                                  ║
+║  Zátěžové testy kernelu bez GPU, bez modelu a bez sítě.          ║
+╚══════════════════════════════════════════════════════════════════╝
+
+Mluví stejným protokolem jako llama-server, takže ho lilu15.py
+(LILU_BACKEND=http) nerozezná od skutečného modelu:
+  GET  /health, /v1/models, /props
+  POST /v1/chat/completions   (JSON i stream přes SSE, keep-alive HTTP/1.1)
+  POST /tokenize              (~ slova a interpunkce jako tokeny)
+
+Text je deterministický (seed + zprávy) nebo ze skriptu (--script), řídí se
+max_tokens, stop a response_format (JSON podle schématu). Rychlost se dá nastavit:
+  --tps      tokeny za sekundu streamu (0 = bez čekání)
+  --ttft     zpoždění prvního tokenu (s)
+  --fail-rate podíl požadavků, které skončí 503 (test opakování v klientovi)
+
+SKRIPT (JSON): seznam odpovědí, které se vrací dokola, nebo objekt
+{"podřetězec poslední zprávy": "odpověď", "*": "výchozí"}; co nesedí, je syntetické.
+StubModel používá i LILU_BACKEND=fake v lilu15.py - stejný text bez HTTP.
+
+SPUŠTĚNÍ:
+python lilu_stub_server.py --port 8080 --tps 40
+LILU_BACKEND=http LILU_HTTP_URL=http://127.0.0.1:8080 python lilu15.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Union
+
+WORDS = ("ticho", "světlo", "sen", "labyrint", "paměť", "voda", "hvězda", "cesta",
+         "dech", "most", "zrcadlo", "stín", "okno", "vítr", "kořen", "otázka")
+TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def tokenize(text: str) -> List[int]:
+    """Slova a interpunkce jako tokeny - stabilní id přes hash, pro počty stačí."""
+    return [int(hashlib.md5(t.encode("utf-8")).hexdigest()[:6], 16) for t in TOKEN_RE.findall(text)]
+
+
+def fake_text(rng: random.Random, n_tokens: int) -> str:
+    """Věty z WORDS, aby profily výstupu (první věta, první řádka) měly co ořezat."""
+    words, sentence = [], 0
+    for _ in range(max(1, n_tokens)):
+        word = rng.choice(WORDS)
+        words.append(word.capitalize() if sentence == 0 else word)
+        sentence += 1
+        if sentence >= rng.randint(5, 10):
+            words[-1] += "."
+            sentence = 0
+    return " ".join(words).rstrip(".") + "."
+
+
+def fake_json(rng: random.Random, schema: dict, n_tokens: int) -> str:
+    """Objekt se všemi vlastnostmi schématu - řetězce vyplní fake_text."""
+    props = schema.get("properties") or {}
+    share = max(3, n_tokens // max(1, len(props)))
+    value = {}
+    for name, spec in props.items():
+        kind = spec.get("type", "string")
+        if kind in ("number", "integer"):
+            value[name] = rng.randint(0, 10)
+        elif kind == "boolean":
+            value[name] = rng.random() < 0.5
+        else:
+            value[name] = fake_text(rng, share)
+    return json.dumps(value, ensure_ascii=False)
+
+
+class StubModel:
+    """Falešný model: text, "tokeny" a statistiky - sdílí ho všechna vlákna serveru."""
+
+    def __init__(self, model: str = "stub", n_ctx: int = 8192, tps: float = 0.0,
+                 ttft: float = 0.0, fail_rate: float = 0.0, seed: int = 0,
+                 script: Union[list, dict, None] = None):
+        self.model = model
+        self.n_ctx = n_ctx
+        self.tps = tps
+        self.ttft = ttft
+        self.fail_rate = fail_rate
+        self.seed = seed
+        self.script = script
+        self._script_pos = 0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "completions": 0, "streams": 0, "failed": 0, "tokens": 0}
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def should_fail(self) -> bool:
+        return self.fail_rate > 0 and random.random() < self.fail_rate
+
+    def _scripted(self, messages: List[dict]) -> Optional[str]:
+        if isinstance(self.script, list) and self.script:
+            with self.lock:
+                text = self.script[self._script_pos % len(self.script)]
+                self._script_pos += 1
+            return text
+        if isinstance(self.script, dict):
+            last = (messages[-1].get("content") or "").lower() if messages else ""
+            for key, text in self.script.items():
+                if key != "*" and key.lower() in last:
+                    return text
+            return self.script.get("*")
+        return None
+
+    def complete(self, body: dict) -> str:
+        """Celá odpověď podle požadavku (skript, jinak deterministicky ze seedu a zpráv)."""
+        messages = body.get("messages") or []
+        scripted = self._scripted(messages)
+        if scripted is not None:
+            return scripted
+        key = json.dumps(messages, ensure_ascii=False, sort_keys=True) + str(self.seed)
+        rng = random.Random(hashlib.sha256(key.encode("utf-8")).hexdigest())
+        n_tokens = int(body.get("max_tokens") or 64)
+        fmt = body.get("response_format") or {}
+        schema = fmt.get("schema") or (fmt.get("json_schema") or {}).get("schema")
+        if schema:
+            return fake_json(rng, schema, n_tokens)
+        # Bez gramatiky a stop sekvence by skutečný model klidně pokračoval dalšími řádky
+        text = "\n".join(fake_text(rng, max(1, n_tokens // 2)) for _ in range(2))
+        stop = body.get("stop") or []
+        for s in ([stop] if isinstance(stop, str) else stop):
+            if s and s in text:
+                text = text[:text.index(s)]
+        return text
+
+    def pieces(self, body: dict) -> List[str]:
+        """Odpověď po "tokenech" (slovo i s mezerou před ním) - tak, jak se streamuje."""
+        return re.findall(r"\s*\S+", self.complete(body)) or [""]
+
+    def completion(self, body: dict, pieces: List[str]) -> dict:
+        prompt = sum(len(tokenize(m.get("content") or "")) for m in body.get("messages") or [])
+        return {
+            "id": f"chatcmpl-stub-{time.time_ns()}", "object": "chat.completion",
+            "created": int(time.time()), "model": self.model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "".join(pieces)}}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": len(pieces),
+                      "total_tokens": prompt + len(pieces)},
+        }
+
+    def chunk(self, cid: str, delta: dict, finish: Optional[str] = None) -> dict:
+        return {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": self.model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive, jinak klient nic neotestuje
+    server_version = "LiluStub/1.0"
+
+    @property
+    def stub(self) -> StubModel:
+        return self.server.stub
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, data: dict):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> Optional[dict]:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return None
+
+    def do_GET(self):
+        self.stub.count("requests")
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": self.stub.model, "object": "model"}]})
+        elif self.path == "/props":
+            self._send_json(200, {"default_generation_settings": {"n_ctx": self.stub.n_ctx},
+                                  "stats": dict(self.stub.stats)})
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        self.stub.count("requests")
+        body = self._read_json()
+        if body is None:
+            return
+        if self.path == "/tokenize":
+            self._send_json(200, {"tokens": tokenize(body.get("content", ""))})
+        elif self.path == "/v1/chat/completions":
+            if self.stub.should_fail():
+                self.stub.count("failed")
+                self._send_json(503, {"error": {"message": "stub: simulated overload"}})
+            elif body.get("stream"):
+                self._stream(body)
+            else:
+                self._complete(body)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _complete(self, body: dict):
+        pieces = self.stub.pieces(body)
+        if self.stub.ttft:
+            time.sleep(self.stub.ttft)
+        if self.stub.tps:
+            time.sleep(len(pieces) / self.stub.tps)
+        self.stub.count("completions")
+        self.stub.count("tokens", len(pieces))
+        self._send_json(200, self.stub.completion(body, pieces))
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, body: dict):
+        """SSE v chunked kódování - spojení po [DONE] zůstává otevřené."""
+        pieces = self.stub.pieces(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.stub.count("streams")
+        cid = f"chatcmpl-stub-{time.time_ns()}"
+
+        def event(delta: dict, finish: Optional[str] = None) -> bytes:
+            chunk = self.stub.chunk(cid, delta, finish)
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        try:
+            if self.stub.ttft:
+                time.sleep(self.stub.ttft)
+            self._chunk(event({"role": "assistant"}))
+            for piece in pieces:
+                if self.stub.tps:
+                    time.sleep(1.0 / self.stub.tps)
+                self._chunk(event({"content": piece}))
+                self.stub.count("tokens")
+            self._chunk(event({}, "stop"))
+            self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Klient stream přerušil (preempce) - spojení zavřel, dál se nepíše
+            self.close_connection = True
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, verbose: bool = False,
+                **model_options) -> ThreadingHTTPServer:
+    """
+    Server ve vlastním vlákně spustí volající (serve_forever); port=0 = volný port,
+    skutečný je v server.server_address. model_options jdou do StubModel.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.stub = StubModel(**model_options)
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Falešný OpenAI-kompatibilní server pro LiLu")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="stub")
+    parser.add_argument("--ctx", type=int, default=8192, help="n_ctx hlášený přes /props")
+    parser.add_argument("--tps", type=float, default=0.0, help="tokeny/s (0 = bez čekání)")
+    parser.add_argument("--ttft", type=float, default=0.0, help="zpoždění prvního tokenu (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="podíl odpovědí 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--script", help="JSON se skriptovanými odpověďmi")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    script = None
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+
+    server = make_server(args.host, args.port, verbose=args.verbose, model=args.model, n_ctx=args.ctx,
+                         tps=args.tps, ttft=args.ttft, fail_rate=args.fail_rate, seed=args.seed,
+                         script=script)
+    print(f"LiLu stub server: http://{args.host}:{server.server_address[1]} (model {args.model})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Statistiky: {server.stub.stats}")
+
+
+if __name__ == "__main__":
+    main()